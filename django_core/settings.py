@@ -123,3 +123,16 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Object bodies live outside the database in a content-addressed store.
+PYGIT_OBJECT_STORE = 'utils_app.storage.FileSystemObjectStore'
+PYGIT_OBJECTS_ROOT = BASE_DIR / 'objects'
+
+# Finished snapshot archives are cached here by tree SHA; set to None to
+# always build them on the fly. Anything in it can be deleted at any time.
+PYGIT_ARCHIVE_ROOT = BASE_DIR / 'archives'
+
+# Parsed commits and trees are kept in an in-process LRU of this many bytes;
+# set PYGIT_OBJECT_CACHE_ALIAS to a CACHES alias to share them across workers.
+PYGIT_OBJECT_CACHE_BYTES = 64 * 1024 * 1024
+PYGIT_OBJECT_CACHE_ALIAS = None
@@ -0,0 +1,157 @@
+"""Line diffs shared by the py_git client and the Django views.
+
+Kept free of Django and of client state so both sides can import it.
+"""
+
+# Comparisons and frontier steps myers_diff may spend before it gives up and
+# reports the differing middle as replaced wholesale.
+DIFF_MAX_COST = 400_000
+DIFF_CONTEXT = 3
+
+
+class _TooExpensive(Exception):
+    pass
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, budget):
+    """Return ``(x, y, u, v)``, the middle snake of a shortest edit path, in absolute indexes.
+
+    Forward and backward searches keep only their current frontier, so the
+    search needs space linear in the input.
+    """
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    forward, backward = {1: 0}, {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        budget[0] -= 2 * d + 2
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            start = x
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            budget[0] -= x - start
+            forward[k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[delta - k] >= n:
+                return alo + start, blo + start - k, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            start = x
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            budget[0] -= x - start
+            backward[k] = x
+            if not odd and -d <= delta - k <= d and x + forward[delta - k] >= n:
+                return ahi - x, bhi - y, ahi - start, bhi - start + k
+        if budget[0] < 0:
+            raise _TooExpensive
+
+
+def _edit_script(a, alo, ahi, b, blo, bhi, out, budget):
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        out.append((" ", alo))
+        alo += 1
+        blo += 1
+    tail = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        tail.append((" ", ahi))
+    if alo == ahi or blo == bhi:
+        out.extend(("-", i) for i in range(alo, ahi))
+        out.extend(("+", j) for j in range(blo, bhi))
+    else:
+        # With common ends stripped both sides are non-empty, so the edit
+        # distance is at least 2 and each half of the split is shorter.
+        x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi, budget)
+        _edit_script(a, alo, x, b, blo, y, out, budget)
+        out.extend((" ", i) for i in range(x, u))
+        _edit_script(a, u, ahi, b, v, bhi, out, budget)
+    out.extend(reversed(tail))
+
+
+def myers_diff(a, b):
+    """Return a minimal edit script as ``(tag, line)`` pairs, tag in ' ', '-', '+'.
+
+    This is Myers' linear-space variant: each step finds the middle snake
+    of a shortest edit path and recurses on either side of it. Once the
+    search has cost DIFF_MAX_COST steps it stops, and the lines between the
+    common prefix and suffix are reported as removed and re-added wholesale.
+    """
+    ids = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    script = []
+    try:
+        _edit_script(a_ids, 0, len(a), b_ids, 0, len(b), script, [DIFF_MAX_COST])
+    except _TooExpensive:
+        prefix = 0
+        while prefix < len(a) and prefix < len(b) and a_ids[prefix] == b_ids[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < len(a) - prefix and suffix < len(b) - prefix
+               and a_ids[-1 - suffix] == b_ids[-1 - suffix]):
+            suffix += 1
+        script = ([(" ", i) for i in range(prefix)]
+                  + [("-", i) for i in range(prefix, len(a) - suffix)]
+                  + [("+", j) for j in range(prefix, len(b) - suffix)]
+                  + [(" ", i) for i in range(len(a) - suffix, len(a))])
+    return [(tag, b[i] if tag == "+" else a[i]) for tag, i in script]
+
+
+def diff_hunks(a, b, context=DIFF_CONTEXT):
+    """Group a line diff into hunks of ``(tag, old_no, new_no, line)`` rows."""
+    ops = myers_diff(a, b)
+    rows = []
+    old_no = new_no = 0
+    for tag, line in ops:
+        old_no += tag != "+"
+        new_no += tag != "-"
+        rows.append((tag, old_no if tag != "+" else None, new_no if tag != "-" else None, line))
+
+    hunks = []
+    last_end = -1
+    for i, (tag, *_rest) in enumerate(rows):
+        if tag == " ":
+            continue
+        start, end = max(i - context, 0), min(i + context + 1, len(rows))
+        if hunks and start <= last_end:
+            hunks[-1].extend(rows[last_end:end])
+        else:
+            hunks.append(rows[start:end])
+        last_end = end
+    return hunks
+
+
+def hunk_header(hunk, shift=0):
+    """Return the ``@@ -start,count +start,count @@`` line of a hunk.
+
+    ``shift`` is the number of lines earlier hunks added net. A side with
+    no lines in the hunk starts at the line before it, as in ``-0,0`` for
+    a new file.
+    """
+    old = [old_no for _, old_no, _, _ in hunk if old_no is not None]
+    new = [new_no for _, _, new_no, _ in hunk if new_no is not None]
+    old_start = old[0] if old else new[0] - 1 - shift
+    new_start = new[0] if new else old[0] - 1 + shift
+    return f"@@ -{old_start},{len(old)} +{new_start},{len(new)} @@"
+
+
+def unified_diff(a, b, context=DIFF_CONTEXT):
+    """Yield the hunk headers and ``tag + line`` rows of a unified diff."""
+    shift = 0
+    for hunk in diff_hunks(a, b, context):
+        yield hunk_header(hunk, shift)
+        for tag, _, _, line in hunk:
+            shift += (tag == "+") - (tag == "-")
+            yield tag + line
@@ -1,126 +1,925 @@
 import os
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
 import hashlib
+import itertools
+import mmap
+import struct
 import json
 import requests
 import argparse
 import time
-import fnmatch
+import re
+import selectors
+import signal
+import socket
+import tempfile
+import zlib
+
+from linediff import unified_diff
 
 REPO_DIR = ".py_git"
 OBJECTS_DIR = os.path.join(REPO_DIR, "objects")
 INDEX_FILE = os.path.join(REPO_DIR, "index.json")
 HEAD_FILE = os.path.join(REPO_DIR, "HEAD")
-REMOTE_URL = "http://localhost:8000/api/git"
+CONFIG_FILE = os.path.join(REPO_DIR, "config.json")
+PACK_DIR = os.path.join(OBJECTS_DIR, "pack")
+REMOTE_URL = os.environ.get("PY_GIT_REMOTE", "http://localhost:8000/api/git")
+CHUNK_SIZE = 1 << 16
+HAVE_BATCH = 1000
+CHECKOUT_PROGRESS_EVERY = 1000
+GC_GRACE_SECONDS = 14 * 24 * 3600
+WATCH_SOCKET = os.path.join(REPO_DIR, "watch.sock")
+WATCH_POLL_INTERVAL = 2.0
+WATCH_TIMEOUT = 5.0
+WATCH_MAX_DIRTY = 200000
+DEFAULT_JOBS = int(os.environ.get("PY_GIT_JOBS", 0)) or os.cpu_count() or 1
+HTTP_TIMEOUT = (10, 300)
+HTTP_RETRIES = 5
+HTTP_BACKOFF = 0.5
+HTTP_POOL_SIZE = 32
+PUSH_BATCH_BYTES = 8 << 20
+PUSH_BATCH_OBJECTS = 2000
+CLONE_BUCKET_OBJECTS = 2000
+CLONE_STATE_FILE = os.path.join(REPO_DIR, "clone.json")
 
-def load_ignores():
-    try:
-        with open('.py_gitignore', 'r') as f:
-            patterns = []
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                patterns.append(line)
-            return patterns
-    except FileNotFoundError:
-        return []
-    
+STREAM_MAGIC = b"PGS1"
+STREAM_ZLIB = 0x01
+STREAM_CONTENT_TYPE = "application/x-pygit-stream"
+FRAME_HEADER = struct.Struct(">20sQ")
+END_FRAME = b"\0" * FRAME_HEADER.size
 
-IGNORES = load_ignores()
-    
-def is_ignored(path, ignores):
-    norm = path.replace(os.sep, '/')
-    for pattern in ignores:
-        if pattern.endswith('/'):
-            base = pattern.rstrip('/')
-            if norm == base or norm.startswith(base + '/'):
-                return True
-        if fnmatch.fnmatch(norm, pattern):
-            return True
+# Chunk manifests take type 5, which git leaves unused, so packs can hold them.
+PACK_TYPES = {'commit': 1, 'tree': 2, 'blob': 3, 'chunked': 5}
+PACK_TYPE_NAMES = {code: name for name, code in PACK_TYPES.items()}
+OFS_DELTA = 6
+IDX_HEADER = b'\xfftOc\x00\x00\x00\x02'
+DELTA_TYPES = ('blob', 'tree')
+DELTA_BLOCK = 16
+DELTA_WINDOW = 10
+DELTA_MAX_DEPTH = 50
+DELTA_MAX_SIZE = 1 << 20
 
-    return False
+# Format 1 repositories write text trees; format 2 writes git's binary
+# layout. Both are always readable.
+REPO_FORMAT = 2
+TREE_MODES = {'blob': b'100644', 'tree': b'40000'}
+TREE_KINDS = {mode: kind for kind, mode in TREE_MODES.items()}
 
-def iter_tracked_files(root='.', ignores=None):
-    if ignores is None:
-        ignores = []
-
-    root = os.path.abspath(root)
-    for dirpath, dirnames, filenames in os.walk(root):
-        rel_dir = os.path.relpath(dirpath, root)
-        if rel_dir == '.':
-            rel_dir = ''
-        dirnames[:] = [
-            d for d in dirnames
-            if not is_ignored(os.path.join(rel_dir, d), ignores)
-        ]
-        for filename in filenames:
-            rel_path = os.path.join(rel_dir, filename) if rel_dir else filename
-            if is_ignored(rel_path, ignores):
+CHUNK_TYPE = 'chunked'
+CDC_ANCHOR = b'\n'
+CDC_WINDOW = 48
+CDC_MAX_CANDIDATES = 1 << 16
+CDC_DEFAULTS = {"threshold": 16 << 20, "min_size": 256 << 10, "avg_size": 1 << 20, "max_size": 4 << 20}
+
+IGNORE_FILE = ".py_gitignore"
+GLOB_CHARS = frozenset('*?[\\')
+
+def _parse_ignore(line):
+    line = line.rstrip('\n')
+    if line.startswith('#'):
+        return None
+    while line.endswith(' ') and not line.endswith('\\ '):
+        line = line[:-1]
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    elif line.startswith(('\\!', '\\#')):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    return line.lstrip('/'), negate, dir_only, anchored
+
+def _glob_to_regex(body, anchored):
+    out = []
+    i = 0
+    if body.startswith('**/'):
+        out.append('(?:.*/)?')
+        i = 3
+    while i < len(body):
+        c = body[i]
+        if body.startswith('/**/', i):
+            out.append('/(?:.*/)?')
+            i += 4
+            continue
+        if body.startswith('/**', i) and i + 3 == len(body):
+            out.append('/.*')
+            break
+        if c == '*':
+            while i + 1 < len(body) and body[i + 1] == '*':
+                i += 1
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = body.find(']', i + 2)
+            if end == -1:
+                out.append('\\[')
+            else:
+                inner = body[i + 1:end]
+                if inner.startswith('!'):
+                    inner = '^' + inner[1:]
+                out.append('[' + inner.replace('\\', '\\\\').replace('[', '\\[') + ']')
+                i = end
+        elif c == '\\' and i + 1 < len(body):
+            i += 1
+            out.append(re.escape(body[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    regex = ''.join(out)
+    return regex if anchored else '(?:.*/)?' + regex
+
+class IgnoreMatcher:
+    """Compiled rules from one ignore file, matched relative to its directory.
+
+    Literal names, anchored literal paths and ``*.ext`` patterns are looked up
+    in dicts; everything else is folded into one alternation regex ordered so
+    the first group that matches is the last rule in the file. Each lookup
+    yields rule numbers and the highest one wins, as in git.
+    """
+
+    def __init__(self, patterns):
+        self.rules = []
+        self.names = {}
+        self.paths = {}
+        self.suffixes = {}
+        globs = []
+        for pattern in patterns:
+            parsed = _parse_ignore(pattern)
+            if parsed is None:
                 continue
-            yield rel_path
+            body, negate, dir_only, anchored = parsed
+            rule = len(self.rules)
+            self.rules.append((negate, dir_only))
+            if GLOB_CHARS.isdisjoint(body):
+                bucket = self.paths if anchored else self.names
+                bucket.setdefault(body, []).append(rule)
+            elif (not anchored and body.startswith('*.')
+                    and GLOB_CHARS.isdisjoint(body[1:])):
+                self.suffixes.setdefault(body[1:], []).append(rule)
+            else:
+                globs.append((rule, _glob_to_regex(body, anchored)))
+        self.dir_regex = self._compile(globs)
+        self.file_regex = self._compile(
+            [(rule, regex) for rule, regex in globs if not self.rules[rule][1]])
+
+    @staticmethod
+    def _compile(globs):
+        if not globs:
+            return None
+        return re.compile('|'.join(
+            f'(?P<r{rule}>{regex})' for rule, regex in reversed(globs)))
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, 'r') as f:
+                return cls(f)
+        except FileNotFoundError:
+            return None
+
+    def _best(self, rules, best, is_dir):
+        for rule in rules:
+            if rule > best and (is_dir or not self.rules[rule][1]):
+                best = rule
+        return best
+
+    def match(self, path, is_dir):
+        """Return True if ignored, False if re-included, None if no rule applies."""
+        name = path.rpartition('/')[2]
+        best = self._best(self.names.get(name, ()), -1, is_dir)
+        best = self._best(self.paths.get(path, ()), best, is_dir)
+        if self.suffixes:
+            dot = name.find('.')
+            while dot != -1:
+                best = self._best(self.suffixes.get(name[dot:], ()), best, is_dir)
+                dot = name.find('.', dot + 1)
+        regex = self.dir_regex if is_dir else self.file_regex
+        if regex is not None:
+            m = regex.fullmatch(path)
+            if m:
+                best = max(best, int(m.lastgroup[1:]))
+        if best < 0:
+            return None
+        return not self.rules[best][0]
+
+def load_ignores(ignores, dir_path, rel_dir):
+    """Return ``ignores`` extended with the ignore file in ``dir_path``, if any."""
+    matcher = IgnoreMatcher.from_file(os.path.join(dir_path, IGNORE_FILE))
+    if matcher is None:
+        return ignores
+    return ignores + [(rel_dir, matcher)]
+
+def is_ignored(path, is_dir, ignores):
+    for base, matcher in reversed(ignores):
+        rel = path[len(base) + 1:] if base else path
+        result = matcher.match(rel, is_dir)
+        if result is not None:
+            return result
+    return False
+
+def root_ignores(root):
+    """Return the ignore stack in force above ``root`` and its path from the repo root.
+
+    The repository root is the working directory. Its ignore file and those
+    of every directory down to, but not including, ``root`` apply to paths
+    under ``root``; bases and paths are relative to the repository root. A
+    ``root`` outside the repository is treated as a root of its own.
+    """
+    top = os.path.abspath('.')
+    prefix = os.path.relpath(root, top).replace(os.sep, '/')
+    if prefix == '.' or prefix.split('/', 1)[0] == '..':
+        return [], ''
+    ignores = []
+    parts = prefix.split('/')
+    for depth in range(len(parts)):
+        ignores = load_ignores(ignores, os.path.join(top, *parts[:depth]), '/'.join(parts[:depth]))
+    return ignores, prefix
+
+def object_path(sha1):
+    return os.path.join(OBJECTS_DIR, sha1[:2], sha1[2:])
+
+
+def _store_loose(sha1, tmp_path):
+    path = object_path(sha1)
+    if object_exists(sha1):
+        os.remove(tmp_path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
 
 def hash_object(data, obj_type, write=True):
     header = f"{obj_type} {len(data)}\0".encode()
     full_data = header + data
     sha1 = hashlib.sha1(full_data).hexdigest()
     
+    if write and not object_exists(sha1):
+        fd, tmp_path = tempfile.mkstemp(dir=OBJECTS_DIR, prefix='tmp_obj_')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(full_data))
+        _store_loose(sha1, tmp_path)
+    return sha1
+
+
+def hash_stream(chunks, size, obj_type, write=True):
+    header = f"{obj_type} {size}\0".encode()
+    sha = hashlib.sha1(header)
+    seen = 0
+    if not write:
+        for chunk in chunks:
+            sha.update(chunk)
+            seen += len(chunk)
+    else:
+        compressor = zlib.compressobj()
+        fd, tmp_path = tempfile.mkstemp(dir=OBJECTS_DIR, prefix='tmp_obj_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressor.compress(header))
+                for chunk in chunks:
+                    sha.update(chunk)
+                    seen += len(chunk)
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    if seen != size:
+        if write:
+            os.remove(tmp_path)
+        raise ValueError(f"Object size changed while hashing ({seen} != {size})")
+    sha1 = sha.hexdigest()
     if write:
-        path_dir = os.path.join(OBJECTS_DIR, sha1[:2])
-        os.makedirs(path_dir, exist_ok=True)
-        path = os.path.join(path_dir, sha1[2:])
-        if not os.path.exists(path):
-            with open(path, 'wb') as f:
-                f.write(full_data)
+        _store_loose(sha1, tmp_path)
     return sha1
 
-def init():
+
+def chunking_config():
+    settings = load_config().get("chunking")
+    if not settings:
+        return None
+    return dict(CDC_DEFAULTS, **(settings if isinstance(settings, dict) else {}))
+
+
+def _cdc_cut(buf, min_size, avg_size, max_size, hard_mask, easy_mask):
+    limit = min(len(buf), max_size)
+    if limit <= min_size:
+        return limit
+    pos = buf.find(CDC_ANCHOR, min_size - 1, limit - 1)
+    tested = 0
+    while pos != -1 and tested < CDC_MAX_CANDIDATES:
+        cut = pos + 1
+        mask = hard_mask if cut < avg_size else easy_mask
+        if not zlib.crc32(buf[cut - CDC_WINDOW:cut]) & mask:
+            return cut
+        tested += 1
+        pos = buf.find(CDC_ANCHOR, cut, limit - 1)
+    return limit
+
+
+def cdc_chunks(f, min_size, avg_size, max_size):
+    """Split a file into content-defined chunks.
+
+    Candidate cuts follow each CDC_ANCHOR byte, located with bytes.find, and
+    one is taken when the CRC-32 of the CDC_WINDOW bytes before it has
+    enough zero low bits. Like FastCDC, a stricter mask applies below
+    ``avg_size`` and a looser one above it, and no chunk is shorter than
+    ``min_size`` (except the last) or longer than ``max_size``.
+    """
+    bits = max(avg_size.bit_length() - 9, 2)
+    hard_mask, easy_mask = (1 << (bits + 2)) - 1, (1 << (bits - 2)) - 1
+    buf = b''
+    eof = False
+    while True:
+        while len(buf) < max_size and not eof:
+            data = f.read(max_size)
+            eof = not data
+            buf += data
+        if not buf:
+            return
+        cut = _cdc_cut(buf, max(min_size, CDC_WINDOW), avg_size, max_size, hard_mask, easy_mask)
+        yield buf[:cut]
+        buf = buf[cut:]
+
+
+def hash_chunked(f, config, write=True):
+    """Store a file as deduplicated blob chunks plus a manifest listing them."""
+    lines = []
+    for chunk in cdc_chunks(f, config["min_size"], config["avg_size"], config["max_size"]):
+        lines.append(f"{hash_object(chunk, 'blob', write)} {len(chunk)}\n")
+    return hash_object(''.join(lines).encode(), CHUNK_TYPE, write)
+
+
+def parse_manifest(data):
+    return [(sha1, int(size)) for sha1, size in (line.split() for line in data.decode().splitlines())]
+
+
+def hash_file(path, obj_type='blob', write=True):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        config = chunking_config() if obj_type == 'blob' else None
+        if config and size >= config["threshold"]:
+            return hash_chunked(f, config, write)
+        chunks = iter(lambda: f.read(CHUNK_SIZE), b'')
+        return hash_stream(chunks, size, obj_type, write)
+
+
+def init(chunked=False):
     os.makedirs(OBJECTS_DIR, exist_ok=True)
     with open(INDEX_FILE, 'w') as f:
         json.dump({}, f)
+    config = {"format": REPO_FORMAT}
+    if chunked:
+        config["chunking"] = CDC_DEFAULTS
+    save_config(config)
     print("Initialized empty py_git repository.")
 
 
-def write_tree(path, root=None):
-    if root is None:
-        root = os.path.abspath(path)
+_config = None
+
+
+def load_config():
+    global _config
+    if _config is None:
+        try:
+            with open(CONFIG_FILE, 'r') as f:
+                _config = json.load(f)
+        except FileNotFoundError:
+            _config = {}
+    return _config
+
+
+def save_config(config):
+    global _config
+    tmp_path = CONFIG_FILE + ".lock"
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, CONFIG_FILE)
+    _config = config
+
+
+def load_index():
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            index = json.load(f)
+        # Entries modified at or after the moment the index was written may
+        # have changed again within the same timestamp tick, so they are
+        # never trusted without rehashing.
+        index["racy_ns"] = os.stat(INDEX_FILE).st_mtime_ns
+    except (FileNotFoundError, ValueError):
+        index = {}
+    index.setdefault("entries", {})
+    index.setdefault("trees", {})
+    return index
+
+
+def save_index(index):
+    index.pop("racy_ns", None)
+    tmp_path = INDEX_FILE + ".lock"
+    # json.dumps uses the C encoder in one pass; json.dump streams through
+    # the pure-Python one, which dominates a no-op add on large trees.
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(index, separators=(',', ':')))
+    os.replace(tmp_path, INDEX_FILE)
+
+
+def index_entry(st, sha1):
+    return [st.st_mode, st.st_size, st.st_mtime_ns, st.st_ino, sha1]
+
+
+class Inotify:
+    """Minimal ctypes binding for Linux inotify."""
+
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    # modify, attrib, close_write, moves, create, delete, delete/move self,
+    # plus IN_ONLYDIR and IN_EXCL_UNLINK.
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800 | 0x01000000 | 0x04000000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        while True:
+            try:
+                data = os.read(self.fd, CHUNK_SIZE)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher:
+    """Tracks working-tree paths changed since a token was handed out.
+
+    Tokens are ``"<epoch>:<seq>"``. A token from another epoch (an earlier
+    daemon, or one issued before the dirty set was reset) gets a ``full``
+    reply so the client falls back to scanning everything. The token stored
+    in the index when the daemon starts is honoured too: startup compares the
+    tree against the index, so everything that differs is already dirty.
+    """
+
+    def __init__(self, root, poll=False):
+        self.root = root
+        self.dirty = {}
+        self.seq = 0
+        self.epoch = os.urandom(4).hex()
+        self.wds = {}
+        self.paths = {}
+        self.inotify = None if poll else Inotify()
+        try:
+            seen = {}
+            self._scan('', seen)
+        except OSError:
+            # Most likely the watch limit (fs.inotify.max_user_watches).
+            if self.inotify is None:
+                raise
+            self._stop_inotify()
+            seen = {}
+            self._scan('', seen)
+        self.snapshot = seen
+
+        index = load_index()
+        self.base = None
+        entries = {}
+        if index.get("root") == root:
+            self.base = (index.get("watch_token"),)
+            entries = index["entries"]
+        racy_ns = index.get("racy_ns", 0)
+        for rel_path, (is_dir, sig) in seen.items():
+            cached = entries.get(rel_path)
+            if not is_dir and (not cached or cached[:4] != sig or cached[2] >= racy_ns):
+                self._mark(rel_path)
+        for rel_path in entries:
+            if rel_path not in seen:
+                self._mark(rel_path)
+
+    @property
+    def token(self):
+        return f"{self.epoch}:{self.seq}"
+
+    def _mark(self, rel_path):
+        self.seq += 1
+        self.dirty[rel_path] = self.seq
+        if len(self.dirty) > WATCH_MAX_DIRTY:
+            self._reset()
+
+    def _reset(self):
+        self.epoch = os.urandom(4).hex()
+        self.dirty.clear()
+        self.base = None
+
+    def _stop_inotify(self):
+        self.inotify.close()
+        self.inotify = None
+        self.wds.clear()
+        self.paths.clear()
+
+    def _watch(self, rel_dir, path):
+        try:
+            wd = self.inotify.add_watch(path)
+        except FileNotFoundError:
+            return
+        old = self.paths.get(wd)
+        if old is not None and self.wds.get(old) == wd:
+            del self.wds[old]
+        self.paths[wd] = rel_dir
+        self.wds[rel_dir] = wd
+
+    def _unwatch(self, rel_dir):
+        prefix = rel_dir + '/'
+        for path in [p for p in self.wds if p == rel_dir or p.startswith(prefix)]:
+            wd = self.wds.pop(path)
+            self.paths.pop(wd, None)
+            self.inotify.rm_watch(wd)
+
+    def _scan(self, rel_dir, seen, mark=False):
+        path = os.path.join(self.root, rel_dir)
+        if self.inotify is not None:
+            self._watch(rel_dir, path)
+        try:
+            it = os.scandir(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        with it:
+            for entry in it:
+                if entry.name == REPO_DIR and not rel_dir:
+                    continue
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if mark:
+                    self._mark(rel_path)
+                try:
+                    is_dir = entry.is_dir()
+                    if seen is not None:
+                        seen[rel_path] = (is_dir, index_entry(entry.stat(), None)[:4])
+                except FileNotFoundError:
+                    continue
+                if is_dir:
+                    self._scan(rel_path, seen, mark)
+
+    def _handle(self, wd, mask, name):
+        if mask & Inotify.IN_Q_OVERFLOW:
+            self._reset()
+            return
+        rel_dir = self.paths.get(wd)
+        if rel_dir is None:
+            return
+        if mask & Inotify.IN_IGNORED:
+            del self.paths[wd]
+            if self.wds.get(rel_dir) == wd:
+                del self.wds[rel_dir]
+            return
+        if not name:
+            return
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if rel_path == REPO_DIR:
+            return
+        self._mark(rel_path)
+        if mask & Inotify.IN_ISDIR:
+            if mask & Inotify.IN_MOVED_FROM:
+                self._unwatch(rel_path)
+            elif mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                self._scan(rel_path, None, mark=True)
+
+    def poll(self):
+        seen = {}
+        self._scan('', seen)
+        for rel_path, value in seen.items():
+            if self.snapshot.get(rel_path) != value:
+                self._mark(rel_path)
+        for rel_path in self.snapshot:
+            if rel_path not in seen:
+                self._mark(rel_path)
+        self.snapshot = seen
+
+    def refresh(self):
+        if self.inotify is None:
+            self.poll()
+            return
+        try:
+            for event in self.inotify.read_events():
+                self._handle(*event)
+        except OSError:
+            self._stop_inotify()
+            self._reset()
+            self.poll()
+
+    def changes(self, token):
+        # Events are queued by the kernel before the writing syscall returns,
+        # so draining them here covers every change made before the request.
+        self.refresh()
+        if self.base is not None and token == self.base[0]:
+            since = 0
+        else:
+            epoch, _, seq = (token or '').partition(':')
+            if epoch != self.epoch:
+                return {"token": self.token, "full": True}
+            since = int(seq)
+        paths = [path for path, seq in self.dirty.items() if seq > since]
+        return {"token": self.token, "paths": paths}
+
+def watch(poll=False):
+    if os.path.exists(WATCH_SOCKET):
+        if watch_changes(None) is not None:
+            print("A watcher is already running for this repository.")
+            return
+        os.remove(WATCH_SOCKET)
+    root = os.path.abspath('.')
+    try:
+        watcher = Watcher(root, poll)
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable ({e}); falling back to polling.")
+        watcher = Watcher(root, poll=True)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(WATCH_SOCKET)
+    server.listen()
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    if watcher.inotify is not None:
+        selector.register(watcher.inotify.fd, selectors.EVENT_READ)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    mode = "polling" if watcher.inotify is None else "inotify"
+    print(f"Watching {root} ({mode}, {len(watcher.dirty)} paths dirty since the index).")
+    try:
+        while True:
+            events = selector.select(WATCH_POLL_INTERVAL if watcher.inotify is None else None)
+            if not events:
+                watcher.poll()
+            for key, _ in events:
+                if key.fileobj is server:
+                    serve_watch_client(server, watcher)
+                else:
+                    watcher.refresh()
+                    if watcher.inotify is None:
+                        selector.unregister(key.fileobj)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(WATCH_SOCKET)
+
+def serve_watch_client(server, watcher):
+    conn, _ = server.accept()
+    with conn:
+        try:
+            conn.settimeout(WATCH_TIMEOUT)
+            with conn.makefile('rb') as f:
+                request = json.loads(f.readline())
+            reply = watcher.changes(request.get("token"))
+            conn.sendall(json.dumps(reply, separators=(',', ':')).encode() + b'\n')
+        except (OSError, ValueError):
+            pass
+
+def watch_changes(token):
+    """Ask the watcher which paths changed since ``token``; None if it isn't running."""
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(WATCH_SOCKET):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(WATCH_TIMEOUT)
+            sock.connect(WATCH_SOCKET)
+            sock.sendall(json.dumps({"token": token}).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+def encode_tree(items):
+    if load_config().get("format", 1) < 2:
+        return "\n".join(f"{kind} {sha1} {name}" for kind, sha1, name in items).encode()
+    # git sorts a directory as if its name ended in '/'.
+    items = sorted(items, key=lambda item: item[2] + '/' if item[0] == 'tree' else item[2])
+    return b''.join(
+        TREE_MODES[kind] + b' ' + name.encode() + b'\0' + bytes.fromhex(sha1)
+        for kind, sha1, name in items
+    )
+
 
+def parse_tree(data):
+    if not data[:1].isdigit():
+        return [line.split(' ', 2) for line in data.decode().splitlines() if line]
     entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        mode = data[pos:space]
+        entries.append((TREE_KINDS.get(mode, 'blob'), data[nul + 1:nul + 21].hex(), data[space + 1:nul].decode()))
+        pos = nul + 21
+    return entries
 
-    for entry in sorted(os.listdir(path)):
-        if entry == REPO_DIR:
-            continue
-        full_path = os.path.join(path, entry)
-        rel_path = os.path.relpath(full_path, root).replace(os.sep, '/')
-        print(rel_path)
-        if is_ignored(rel_path, IGNORES):
-            continue
-        if os.path.isdir(full_path):
-            sha1 = write_tree(full_path, root=root)
-            entries.append(f"tree {sha1} {entry}")
+
+def write_tree(path, index=None, jobs=None, verbose=True, unwritten=None):
+    """Hash the tree at ``path``, writing its blobs and trees and updating ``index``.
+
+    If ``unwritten`` is a dict nothing is written: blobs are only hashed
+    and the bodies of trees are collected there by SHA instead.
+    """
+    root = os.path.abspath(path)
+    write = unwritten is None
+    if index is None:
+        index = {}
+    same_root = index.get("root") == root
+    old_entries = index.get("entries", {}) if same_root else {}
+    old_trees = index.get("trees", {}) if same_root else {}
+    racy_ns = index.get("racy_ns", 0)
+    entries = {}
+    trees = {}
+    pending = []
+
+    # With a watcher running, only directories on the way to a changed path
+    # are listed and only changed files are stat'd; everything else is
+    # carried over from the index. A changed ignore file can alter any
+    # subtree, so it forces a full scan.
+    token = dirty = descend = None
+    if root == os.path.abspath('.'):
+        reply = watch_changes(index.get("watch_token"))
+        if reply is not None:
+            token = reply["token"]
+            changed_paths = reply.get("paths")
+            if (same_root and changed_paths is not None and not any(
+                    p.rpartition('/')[2] == IGNORE_FILE for p in changed_paths)):
+                dirty = set(changed_paths)
+                descend = {''}
+                for p in changed_paths:
+                    while p and p not in descend:
+                        descend.add(p)
+                        p = p.rpartition('/')[0]
+    scanned = set()
+    clean_dirs = set()
+    # Ignore rules match paths from the repository root, so a subdirectory
+    # added on its own still honours the ignore files above it.
+    outer_ignores, prefix = root_ignores(root)
+
+    def repo_path(rel_path):
+        if not prefix:
+            return rel_path
+        return f"{prefix}/{rel_path}" if rel_path else prefix
+
+    def scan(dir_path, rel_dir, ignores):
+        if descend is not None and rel_dir not in descend and rel_dir in old_trees:
+            clean_dirs.add(rel_dir)
+            return {"rel": rel_dir, "clean": True}
+        scanned.add(rel_dir)
+        node = {"rel": rel_dir, "items": [], "changed": rel_dir not in old_trees}
+        ignores = load_ignores(ignores, dir_path, repo_path(rel_dir))
+        with os.scandir(dir_path) as it:
+            dir_entries = sorted(it, key=lambda e: e.name)
+
+        for dir_entry in dir_entries:
+            entry = dir_entry.name
+            if entry == REPO_DIR:
+                continue
+            full_path = dir_entry.path
+            rel_path = f"{rel_dir}/{entry}" if rel_dir else entry
+            is_dir = dir_entry.is_dir()
+            if is_ignored(repo_path(rel_path), is_dir, ignores):
+                continue
+            if is_dir:
+                node["items"].append(("tree", entry, scan(full_path, rel_path, ignores)))
+                continue
+            if dirty is not None and rel_path not in dirty and rel_path in old_entries:
+                entries[rel_path] = old_entries[rel_path]
+                node["items"].append(("blob", entry, [entries[rel_path][4]]))
+                continue
+            st = dir_entry.stat()
+
+            cached = old_entries.get(rel_path)
+            slot = [None]
+            if (cached and cached[:4] == index_entry(st, None)[:4]
+                    and cached[2] < racy_ns):
+                slot[0] = cached[4]
+                entries[rel_path] = cached
+            else:
+                pending.append((rel_path, full_path, st, cached, slot, node))
+            node["items"].append(("blob", entry, slot))
+        return node
+
+    def assemble(node):
+        if node.get("clean"):
+            trees[node["rel"]] = old_trees[node["rel"]]
+            return old_trees[node["rel"]][0], False
+        items = []
+        changed = node["changed"]
+        for kind, name, value in node["items"]:
+            if kind == "tree":
+                sha1, sub_changed = assemble(value)
+                changed = changed or sub_changed
+            else:
+                sha1 = value[0]
+            items.append((kind, sha1, name))
+
+        rel_dir = node["rel"]
+        cached_tree = old_trees.get(rel_dir)
+        if not changed and cached_tree[1] == len(items):
+            tree_sha = cached_tree[0]
         else:
-            with open(full_path, 'rb') as f:
-                content = f.read()
-            sha1 = hash_object(content, 'blob')
-            entries.append(f"blob {sha1} {entry}")
+            changed = True
+            body = encode_tree(items)
+            tree_sha = hash_object(body, 'tree', write)
+            if not write:
+                unwritten[tree_sha] = body
+        trees[rel_dir] = [tree_sha, len(items)]
+        return tree_sha, changed
+
+    root_node = scan(root, '', outer_ignores)
+
+    # Blobs are hashed and written on a thread pool (hashlib and zlib release
+    # the GIL on large buffers); trees are then assembled bottom-up from the
+    # sorted scan, so the result does not depend on completion order.
+    paths = [item[1] for item in pending]
+    jobs = jobs or DEFAULT_JOBS
+
+    def hash_path(full_path):
+        return hash_file(full_path, write=write)
+
+    if jobs > 1 and len(paths) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            hashed = list(pool.map(hash_path, paths))
+    else:
+        hashed = map(hash_path, paths)
+    for (rel_path, _, st, cached, slot, node), sha1 in zip(pending, hashed):
+        if verbose:
+            print(rel_path)
+        slot[0] = sha1
+        entries[rel_path] = index_entry(st, sha1)
+        if not cached or cached[4] != sha1:
+            node["changed"] = True
 
-    tree_content = "\n".join(entries)
-    tree_sha = hash_object(tree_content.encode(), 'tree')
+    tree_sha, _ = assemble(root_node)
+
+    if clean_dirs:
+        kept = dict.fromkeys(clean_dirs, True)
+
+        def under_clean(rel_dir):
+            if rel_dir not in kept:
+                kept[rel_dir] = (rel_dir not in scanned and rel_dir != ''
+                                 and under_clean(rel_dir.rpartition('/')[0]))
+            return kept[rel_dir]
+
+        for rel_path, entry in old_entries.items():
+            if under_clean(rel_path.rpartition('/')[0]):
+                entries[rel_path] = entry
+        for rel_dir, tree in old_trees.items():
+            if rel_dir not in trees and under_clean(rel_dir):
+                trees[rel_dir] = tree
+
+    index.update(root=root, root_tree=tree_sha, entries=entries, trees=trees)
+    if token:
+        index["watch_token"] = token
+    else:
+        index.pop("watch_token", None)
     return tree_sha
 
 
-def add(path):
-    tree_sha = write_tree(path)
-    
-    index = {"root_tree": tree_sha}
-    with open(INDEX_FILE, 'w') as f:
-        json.dump(index, f)
+def add(path, jobs=None):
+    index = load_index()
+    tree_sha = write_tree(path, index, jobs)
+    save_index(index)
     
     print(f"Added files and folders recursively. Root tree SHA: {tree_sha}")
 
 
 def commit(message):
-    with open(INDEX_FILE, 'r') as f:
-        index = json.load(f)
+    index = load_index()
 
     root_tree = index.get("root_tree")
     if not root_tree:
@@ -142,28 +941,191 @@ def commit(message):
 
     print(f"Committed {commit_sha[:7]}: {message}")
 
-def push(repo_name):
-    objects_data = []
-    for dir_prefix in os.listdir(OBJECTS_DIR):
-        dir_path = os.path.join(OBJECTS_DIR, dir_prefix)
-        if not os.path.isdir(dir_path):
+def read_ref(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_ref(path, sha1):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(sha1)
+
+
+def remote_ref_path(repo_name, ref="refs/heads/main"):
+    return os.path.join(REPO_DIR, "refs", "remotes", repo_name, ref.rsplit('/', 1)[-1])
+
+
+def read_tree(tree_sha):
+    obj_type, data = read_object(tree_sha)
+    if obj_type != 'tree':
+        raise ValueError(f"Expected tree object, got {obj_type}")
+    return parse_tree(data)
+
+
+def read_commit(commit_sha):
+    obj_type, data = read_object(commit_sha)
+    if obj_type != 'commit':
+        raise ValueError("Not a commit object")
+    header = data.decode().split('\n\n', 1)[0]
+    tree_sha, parents = None, []
+    for line in header.splitlines():
+        if line.startswith("tree "):
+            tree_sha = line.split()[1]
+        elif line.startswith("parent "):
+            parents.append(line.split()[1])
+    # History beyond a shallow clone's boundary was never fetched.
+    if commit_sha in load_config().get("shallow", ()):
+        parents = []
+    return tree_sha, parents
+
+
+def _new_tree_objects(tree_sha, base_sha, seen):
+    if tree_sha == base_sha or tree_sha in seen:
+        return
+    seen.add(tree_sha)
+    yield tree_sha
+    base = {}
+    if base_sha:
+        base = {name: (kind, sha) for kind, sha, name in read_tree(base_sha)}
+    for kind, sha, name in read_tree(tree_sha):
+        base_kind, base_entry = base.get(name, (None, None))
+        if kind == 'tree':
+            yield from _new_tree_objects(sha, base_entry if base_kind == 'tree' else None, seen)
+        elif sha != base_entry and sha not in seen:
+            seen.add(sha)
+            yield sha
+            for chunk_sha, _ in manifest_parts(sha) or ():
+                if chunk_sha not in seen:
+                    seen.add(chunk_sha)
+                    yield chunk_sha
+
+
+def objects_to_push(head_sha, remote_shas):
+    # Everything reachable from a commit the remote already has is on the
+    # remote, so each new commit only contributes what differs from its
+    # parents.
+    boundary = {sha for sha in remote_shas if sha and object_exists(sha)}
+    seen = set()
+    pending = [head_sha]
+    while pending:
+        commit_sha = pending.pop()
+        if commit_sha in boundary or commit_sha in seen:
             continue
-        for file_name in os.listdir(dir_path):
-            sha1 = dir_prefix + file_name
-            obj_path = os.path.join(dir_path, file_name)
+        seen.add(commit_sha)
+        yield commit_sha
+        tree_sha, parents = read_commit(commit_sha)
+        base_tree = read_commit(parents[0])[0] if parents else None
+        yield from _new_tree_objects(tree_sha, base_tree, seen)
+        pending.extend(parents)
+
+
+_session = None
+
+def http_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def http_request(method, url, **kwargs):
+    """Send a request on the pooled session, retrying transient failures.
+
+    Connection errors, timeouts and 5xx responses are retried with
+    exponential backoff; file bodies are rewound before each attempt.
+    """
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    body = kwargs.get('data')
+    start = body.tell() if hasattr(body, 'seek') else None
+    for attempt in range(HTTP_RETRIES + 1):
+        if start is not None:
+            body.seek(start)
+        try:
+            resp = http_session().request(method, url, **kwargs)
+            if resp.status_code < 500 or attempt == HTTP_RETRIES:
+                return resp
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == HTTP_RETRIES:
+                raise
+        time.sleep(HTTP_BACKOFF * 2 ** attempt)
+
+
+def run_batches(fn, batches, jobs=None):
+    """Run ``fn`` over ``batches`` on a thread pool, yielding ``(batch, future)``.
+
+    At most two batches per worker are queued, so a lazy ``batches``
+    iterator is only consumed as fast as the transfer drains it. Nothing
+    new is submitted after the first failure.
+    """
+    jobs = jobs or DEFAULT_JOBS
+    batches = iter(batches)
+    failed = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while True:
+            while not failed and len(running) < 2 * jobs:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                running[pool.submit(fn, batch)] = batch
+            if not running:
+                return
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                failed = failed or future.exception() is not None
+                yield running.pop(future), future
+
+
+def remote_missing(repo_name, shas):
+    missing = []
+    for start in range(0, len(shas), HAVE_BATCH):
+        batch = shas[start:start + HAVE_BATCH]
+        resp = http_request('POST', f"{REMOTE_URL}/{repo_name}/have", json={"shas": batch})
+        resp.raise_for_status()
+        have = set(resp.json().get("have", []))
+        missing.extend(sha for sha in batch if sha not in have)
+    return missing
+
+
+def push_batches(shas):
+    batch, batch_bytes = [], 0
+    for sha1 in shas:
+        batch.append(sha1)
+        batch_bytes += object_info(sha1)[1]
+        if batch_bytes >= PUSH_BATCH_BYTES or len(batch) >= PUSH_BATCH_OBJECTS:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
 
-            with open(obj_path, 'rb') as f:
-                raw = f.read()
 
-            null_index = raw.find(b'\0')
-            header = raw[:null_index].decode().split(' ')
-            obj_type = header[0]
+def upload_objects(repo_name, shas, params=None):
+    # The stream is spooled to disk rather than sent chunked so the upload
+    # carries a Content-Length, which Django needs to read the body, and so
+    # a retry can resend it.
+    with tempfile.TemporaryFile() as spool:
+        for chunk in encode_object_stream(shas):
+            spool.write(chunk)
+        spool.seek(0)
+        resp = http_request(
+            'POST', f"{REMOTE_URL}/{repo_name}/push",
+            params=params,
+            data=spool,
+            headers={"Content-Type": STREAM_CONTENT_TYPE},
+        )
+    resp.raise_for_status()
+    return resp
 
-            objects_data.append({
-                "sha1": sha1,
-                "type": obj_type,
-                "data": raw.hex()
-            })
+
+def push(repo_name, jobs=None):
     if not os.path.exists(HEAD_FILE):
         print("Nothing to push (no HEAD).")
         return
@@ -171,111 +1133,1156 @@ def push(repo_name):
     with open(HEAD_FILE, 'r') as f:
         head_sha = f.read().strip()
 
-    payload = {"objects": objects_data, "head": head_sha, "ref": "refs/heads/main"}
-    resp = requests.post(f"{REMOTE_URL}/{repo_name}/push", json=payload)
+    ref = "refs/heads/main"
+    resp = http_request('GET', f"{REMOTE_URL}/{repo_name}/refs")
+    remote_refs = resp.json().get("refs", {}) if resp.ok else {}
+    tracking_path = remote_ref_path(repo_name, ref)
+    remote_shas = [remote_refs.get(ref), read_ref(tracking_path)]
+
+    candidates = list(objects_to_push(head_sha, remote_shas))
+    missing = remote_missing(repo_name, candidates) if candidates else []
+    print(f"Sending {len(missing)} of {len(candidates)} new objects.")
+
+    # Each batch is committed by the server on its own, so after a failure
+    # the next push asks /have again and only sends what never arrived.
+    sent = 0
+    error = None
+    for batch, future in run_batches(
+            lambda batch: upload_objects(repo_name, batch), push_batches(missing), jobs):
+        if future.exception() is not None:
+            error = error or future.exception()
+            continue
+        sent += len(batch)
+        print(f"Sent {sent}/{len(missing)} objects.")
+    if error is not None:
+        print(f"Push interrupted after {sent} of {len(missing)} objects ({error}); "
+              "run push again to resume.")
+        return
+
+    try:
+        resp = upload_objects(repo_name, [], {"head": head_sha, "ref": ref})
+    except requests.RequestException as e:
+        print(f"Failed to update {ref}: {e}")
+        return
+    write_ref(tracking_path, head_sha)
     print("Push response:", resp.status_code)
 
 
-def read_object(sha1):
-    path = os.path.join(OBJECTS_DIR, sha1[:2], sha1[2:])
+def encode_object_stream(shas, compress=True):
+    compressor = zlib.compressobj() if compress else None
+
+    def out(data):
+        return compressor.compress(data) if compressor else data
+
+    yield STREAM_MAGIC + bytes([STREAM_ZLIB if compress else 0])
+    for sha1 in shas:
+        obj_type, size, chunks = stream_object(sha1)
+        header = f"{obj_type} {size}\0".encode()
+        yield out(FRAME_HEADER.pack(bytes.fromhex(sha1), len(header) + size) + header)
+        for chunk in chunks:
+            yield out(chunk)
+    yield out(END_FRAME)
+    if compressor:
+        yield compressor.flush()
+
+
+class ObjectStreamReader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = bytearray()
+        self.decompressor = None
+        preamble = self.read_exact(len(STREAM_MAGIC) + 1)
+        if preamble[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+            raise ValueError("Not a py_git object stream")
+        if preamble[-1] & STREAM_ZLIB:
+            self.decompressor = zlib.decompressobj()
+            self.buf = bytearray(self._decompress(bytes(self.buf)))
+
+    def _decompress(self, data):
+        try:
+            return self.decompressor.decompress(data)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt object stream: {e}") from e
+
+    def _fill(self):
+        # Empty chunks are skipped; only exhausting the source ends the stream.
+        data = next((chunk for chunk in self.chunks if chunk), b'')
+        if not data:
+            return False
+        if self.decompressor is not None:
+            data = self._decompress(data)
+        self.buf += data
+        return True
+
+    def read_exact(self, n):
+        while len(self.buf) < n:
+            if not self._fill():
+                raise ValueError("Truncated object stream")
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def iter_exact(self, n):
+        while n:
+            if not self.buf and not self._fill():
+                raise ValueError("Truncated object stream")
+            data = bytes(self.buf[:n])
+            del self.buf[:len(data)]
+            n -= len(data)
+            yield data
+
+    def objects(self):
+        while True:
+            frame = self.read_exact(FRAME_HEADER.size)
+            if frame == END_FRAME:
+                return
+            sha_bin, length = FRAME_HEADER.unpack(frame)
+            header = b''
+            while not header.endswith(b'\0'):
+                header += self.read_exact(1)
+            obj_type, size = header[:-1].decode().split(' ')
+            yield sha_bin.hex(), obj_type, int(size), self.iter_exact(length - len(header))
+
+
+def fetch_missing(shas, jobs=None):
+    """Fetch objects a partial clone left on the server; returns how many arrived."""
+    remote = load_config().get("promisor")
+    if not remote:
+        return 0
+    missing = [sha1 for sha1 in dict.fromkeys(shas) if not object_exists(sha1)]
+
+    def fetch(batch):
+        resp = http_request('POST', f"{remote}/objects", json={"shas": batch}, stream=True)
+        resp.raise_for_status()
+        return receive_objects(resp.iter_content(CHUNK_SIZE))
+
+    batches = [missing[start:start + HAVE_BATCH] for start in range(0, len(missing), HAVE_BATCH)]
+    count = 0
+    for _, future in run_batches(fetch, batches, jobs):
+        count += future.result()
+    return count
+
+
+def receive_objects(chunks, on_object=None):
+    """Store the objects of a stream, calling ``on_object`` with each SHA once it is safely stored.
+
+    An object whose content does not hash to its SHA raises ValueError
+    before ``on_object`` sees it, so resumable transfers restart from the
+    last good object rather than skipping the bad one.
+    """
+    count = 0
+    for expected, obj_type, size, body in ObjectStreamReader(chunks).objects():
+        sha1 = hash_stream(body, size, obj_type)
+        if sha1 != expected:
+            raise ValueError(f"Object {expected} failed verification (content hashes to {sha1})")
+        count += 1
+        if on_object is not None:
+            on_object(expected)
+    return count
+
+
+def _inflate_file(path):
     with open(path, 'rb') as f:
-        raw = f.read()
-        
-    null_index = raw.find(b'\0')
-    header = raw[:null_index].decode()
-    obj_type, _ = header.split(' ')
-    data = raw[null_index+1:]
+        data = f.read(CHUNK_SIZE)
+        # Objects written before loose objects were compressed are stored as
+        # plain "<type> <size>\0<body>" and are passed through unchanged.
+        if not data.startswith(b'\x78'):
+            while data:
+                yield data
+                data = f.read(CHUNK_SIZE)
+            return
+        decompressor = zlib.decompressobj()
+        while data:
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            data = decompressor.unconsumed_tail or f.read(CHUNK_SIZE)
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+
+def stream_object(sha1):
+    path = object_path(sha1)
+    if not os.path.exists(path):
+        pack, offset = find_packed(sha1)
+        if pack is not None:
+            return pack.stream(offset)
+        fetch_missing([sha1])
+    chunks = _inflate_file(path)
+    buf = b''
+    for chunk in chunks:
+        buf += chunk
+        null_index = buf.find(b'\0')
+        if null_index != -1:
+            break
+    else:
+        raise ValueError(f"Corrupt object {sha1}")
+    obj_type, size = buf[:null_index].decode().split(' ')
+
+    def body():
+        rest = buf[null_index+1:]
+        if rest:
+            yield rest
+        yield from chunks
+
+    return obj_type, int(size), body()
+
+
+def _read_raw_object(sha1):
+    path = object_path(sha1)
+    if not os.path.exists(path):
+        pack, offset = find_packed(sha1)
+        if pack is not None:
+            return pack.read(offset)
+    obj_type, _, chunks = stream_object(sha1)
+    return obj_type, b''.join(chunks)
+
+def read_object(sha1):
+    obj_type, data = _read_raw_object(sha1)
+    if obj_type == CHUNK_TYPE:
+        return 'blob', b''.join(read_object(chunk)[1] for chunk, _ in parse_manifest(data))
     return obj_type, data
 
-def restore_tree(tree_sha, base_path="."):
-    obj_type, data = read_object(tree_sha)
-    if obj_type != 'tree':
-        raise ValueError(f"Expected tree object, got {obj_type}")
-    entries = data.decode().strip().split('\n')
-
-    for entry in entries:
-        if not entry: continue
-        e_type, e_sha, e_name = entry.split(' ', 2)
-        full_path = os.path.join(base_path, e_name)
-        
-        if e_type == 'blob':
-            _, content = read_object(e_sha)
-            with open(full_path, 'wb') as f:
-                f.write(content)
-        elif e_type == 'tree':
-            os.makedirs(full_path, exist_ok=True)
-            restore_tree(e_sha, full_path)
-
-def checkout(commit_sha):
-    obj_type, data = read_object(commit_sha)
-    if obj_type != 'commit':
-        raise ValueError("Not a commit object")
-    
-    lines = data.decode().split('\n')
-    tree_line = next(l for l in lines if l.startswith("tree "))
-    root_tree_sha = tree_line.split()[1]
+
+def manifest_parts(sha1):
+    """Return the ``(chunk_sha, size)`` parts of a chunked blob, or None for other objects."""
+    obj_type, _, chunks = stream_object(sha1)
+    if obj_type != CHUNK_TYPE:
+        chunks.close()
+        return None
+    return parse_manifest(b''.join(chunks))
+
+
+def stream_blob(sha1):
+    """Return ``(size, body_chunks)`` for a blob, reassembling chunked blobs."""
+    obj_type, size, chunks = stream_object(sha1)
+    if obj_type != CHUNK_TYPE:
+        return size, chunks
+    parts = parse_manifest(b''.join(chunks))
+
+    def body():
+        for chunk_sha, _ in parts:
+            yield from stream_object(chunk_sha)[2]
+
+    return sum(part_size for _, part_size in parts), body()
+
+def _delta_varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if not n:
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+
+def _read_delta_varint(delta, pos):
+    n = shift = 0
+    while True:
+        byte = delta[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return pos, n
+
+
+def _delta_copy(offset, length):
+    cmd = 0x80
+    args = bytearray()
+    for i in range(4):
+        byte = (offset >> (8 * i)) & 0xff
+        if byte:
+            cmd |= 1 << i
+            args.append(byte)
+    for i in range(3):
+        byte = (length >> (8 * i)) & 0xff
+        if byte:
+            cmd |= 0x10 << i
+            args.append(byte)
+    return bytes([cmd]) + args
+
+
+def create_delta(base, target, max_size):
+    out = bytearray(_delta_varint(len(base)) + _delta_varint(len(target)))
+    blocks = {}
+    for i in range(len(base) - DELTA_BLOCK, -1, -DELTA_BLOCK):
+        blocks[base[i:i + DELTA_BLOCK]] = i
+
+    insert = bytearray()
+    pos = 0
+    end = len(target)
+    while pos < end:
+        offset = blocks.get(target[pos:pos + DELTA_BLOCK])
+        if offset is None:
+            insert.append(target[pos])
+            pos += 1
+            if len(insert) == 0x7f:
+                out.append(0x7f)
+                out += insert
+                insert.clear()
+            if len(out) + len(insert) > max_size:
+                return None
+            continue
+
+        length = DELTA_BLOCK
+        limit = min(len(base) - offset, end - pos, 0xffffff)
+        while length < limit:
+            step = min(256, limit - length)
+            if base[offset + length:offset + length + step] == target[pos + length:pos + length + step]:
+                length += step
+                continue
+            while length < limit and base[offset + length] == target[pos + length]:
+                length += 1
+            break
+        if insert:
+            out.append(len(insert))
+            out += insert
+            insert.clear()
+        out += _delta_copy(offset, length)
+        pos += length
+
+    if insert:
+        out.append(len(insert))
+        out += insert
+    return bytes(out) if len(out) <= max_size else None
+
+
+def apply_delta(base, delta):
+    pos, base_size = _read_delta_varint(delta, 0)
+    pos, result_size = _read_delta_varint(delta, pos)
+    if base_size != len(base):
+        raise ValueError("Delta base size mismatch")
+    out = bytearray()
+    while pos < len(delta):
+        cmd = delta[pos]
+        pos += 1
+        if cmd & 0x80:
+            offset = length = 0
+            for i in range(4):
+                if cmd & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if cmd & (0x10 << i):
+                    length |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset:offset + (length or 0x10000)]
+        elif cmd:
+            out += delta[pos:pos + cmd]
+            pos += cmd
+        else:
+            raise ValueError("Invalid delta opcode")
+    if len(out) != result_size:
+        raise ValueError("Delta result size mismatch")
+    return bytes(out)
+
+
+class PackFile:
+    def __init__(self, idx_path):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-len('.idx')] + '.pack'
+        with open(idx_path, 'rb') as f:
+            self.idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.pack_path, 'rb') as f:
+            self.pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.idx[:8] != IDX_HEADER or self.pack[:4] != b'PACK':
+            raise ValueError(f"Unsupported pack {self.pack_path}")
+        self.count = struct.unpack_from('>I', self.idx, 8 + 255 * 4)[0]
+        self.sha_table = 8 + 256 * 4
+        self.offset_table = self.sha_table + 24 * self.count
+        self.large_table = self.offset_table + 4 * self.count
+
+    def close(self):
+        self.idx.close()
+        self.pack.close()
+
+    def shas(self):
+        for i in range(self.count):
+            start = self.sha_table + 20 * i
+            yield self.idx[start:start + 20].hex()
+
+    def find(self, sha1):
+        key = bytes.fromhex(sha1)
+        lo = struct.unpack_from('>I', self.idx, 8 + (key[0] - 1) * 4)[0] if key[0] else 0
+        hi = struct.unpack_from('>I', self.idx, 8 + key[0] * 4)[0]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.sha_table + 20 * mid
+            current = self.idx[start:start + 20]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                offset = struct.unpack_from('>I', self.idx, self.offset_table + 4 * mid)[0]
+                if offset & 0x80000000:
+                    offset = struct.unpack_from('>Q', self.idx, self.large_table + 8 * (offset & 0x7fffffff))[0]
+                return offset
+        return None
+
+    def _entry(self, offset):
+        byte = self.pack[offset]
+        offset += 1
+        type_code = (byte >> 4) & 0x07
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = self.pack[offset]
+            offset += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        base = None
+        if type_code == OFS_DELTA:
+            byte = self.pack[offset]
+            offset += 1
+            distance = byte & 0x7f
+            while byte & 0x80:
+                byte = self.pack[offset]
+                offset += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7f)
+            base = distance
+        return type_code, size, offset, base
+
+    def _iter_inflate(self, offset):
+        decompressor = zlib.decompressobj()
+        while not decompressor.eof:
+            data = decompressor.unconsumed_tail or self.pack[offset:offset + CHUNK_SIZE]
+            if not decompressor.unconsumed_tail:
+                offset += len(data)
+            if not data:
+                raise ValueError(f"Truncated pack {self.pack_path}")
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            if chunk:
+                yield chunk
+
+    def _inflate(self, offset):
+        return b''.join(self._iter_inflate(offset))
+
+    def info(self, offset):
+        type_code, size, data_offset, base = self._entry(offset)
+        if type_code != OFS_DELTA:
+            return PACK_TYPE_NAMES[type_code], size
+        delta_head = next(self._iter_inflate(data_offset))
+        pos, _ = _read_delta_varint(delta_head, 0)
+        _, size = _read_delta_varint(delta_head, pos)
+        return self.info(offset - base)[0], size
+
+    def read(self, offset):
+        chain = []
+        type_code, size, data_offset, base = self._entry(offset)
+        while type_code == OFS_DELTA:
+            chain.append(data_offset)
+            offset -= base
+            type_code, size, data_offset, base = self._entry(offset)
+        data = self._inflate(data_offset)
+        for delta_offset in reversed(chain):
+            data = apply_delta(data, self._inflate(delta_offset))
+        return PACK_TYPE_NAMES[type_code], data
+
+    def stream(self, offset):
+        type_code, size, data_offset, _ = self._entry(offset)
+        if type_code == OFS_DELTA:
+            obj_type, data = self.read(offset)
+            # A generator, like the other streams, so callers can close it.
+            return obj_type, len(data), (chunk for chunk in (data,))
+        return PACK_TYPE_NAMES[type_code], size, self._iter_inflate(data_offset)
+
+
+_packs = None
+
+
+def load_packs():
+    global _packs
+    if _packs is None:
+        _packs = []
+        if os.path.isdir(PACK_DIR):
+            for name in sorted(os.listdir(PACK_DIR)):
+                if name.endswith('.idx'):
+                    _packs.append(PackFile(os.path.join(PACK_DIR, name)))
+    return _packs
+
+
+def reset_packs():
+    global _packs
+    for pack in _packs or []:
+        pack.close()
+    _packs = None
+
+
+def find_packed(sha1):
+    for pack in load_packs():
+        offset = pack.find(sha1)
+        if offset is not None:
+            return pack, offset
+    return None, None
+
+
+def object_exists(sha1):
+    return os.path.exists(object_path(sha1)) or find_packed(sha1)[0] is not None
+
+
+def object_info(sha1):
+    pack, offset = find_packed(sha1) if not os.path.exists(object_path(sha1)) else (None, None)
+    if pack is not None:
+        return pack.info(offset)
+    obj_type, size, chunks = stream_object(sha1)
+    chunks.close()
+    return obj_type, size
+
+
+def iter_loose_objects():
+    if not os.path.isdir(OBJECTS_DIR):
+        return
+    for dir_prefix in os.listdir(OBJECTS_DIR):
+        dir_path = os.path.join(OBJECTS_DIR, dir_prefix)
+        if len(dir_prefix) != 2 or not os.path.isdir(dir_path):
+            continue
+        for file_name in os.listdir(dir_path):
+            yield dir_prefix + file_name
+
+
+def iter_objects():
+    seen = set(iter_loose_objects())
+    yield from seen
+    for pack in load_packs():
+        for sha1 in pack.shas():
+            if sha1 not in seen:
+                seen.add(sha1)
+                yield sha1
+
+
+def _pack_entry_header(type_code, size):
+    byte = (type_code << 4) | (size & 0x0f)
+    size >>= 4
+    out = bytearray()
+    while size:
+        out.append(byte | 0x80)
+        byte = size & 0x7f
+        size >>= 7
+    out.append(byte)
+    return bytes(out)
+
+
+def _pack_ofs(distance):
+    out = bytearray([distance & 0x7f])
+    distance >>= 7
+    while distance:
+        distance -= 1
+        out.insert(0, 0x80 | (distance & 0x7f))
+        distance >>= 7
+    return bytes(out)
+
+
+def _sort_for_delta(shas):
+    infos = {sha1: object_info(sha1) for sha1 in shas}
+    names = {}
+    for sha1, (obj_type, _) in infos.items():
+        if obj_type != 'tree':
+            continue
+        for _, e_sha, e_name in read_tree(sha1):
+            names.setdefault(e_sha, e_name)
+    # Objects with the same type and a similar name (compared from the end,
+    # so extensions group together) are the best delta candidates; bigger
+    # versions go first so smaller ones are expressed as deltas against them.
+    return sorted(
+        infos,
+        key=lambda s: (PACK_TYPES[infos[s][0]], names.get(s, '')[::-1], -infos[s][1], s),
+    ), infos
+
+
+def _best_delta(window, obj_type, body):
+    best = None
+    for base_offset, base_type, base_body, depth in window:
+        if base_type != obj_type or depth >= DELTA_MAX_DEPTH:
+            continue
+        limit = len(best[1]) - 1 if best else len(body) // 2
+        delta = create_delta(base_body, body, limit)
+        if delta is not None:
+            best = (base_offset, delta, depth + 1)
+    return best
+
+
+def write_pack(shas):
+    os.makedirs(PACK_DIR, exist_ok=True)
+    ordered, infos = _sort_for_delta(shas)
+    fd, tmp_path = tempfile.mkstemp(dir=PACK_DIR, prefix='tmp_pack_')
+    pack_sha = hashlib.sha1()
+    entries = []
+    window = collections.deque(maxlen=DELTA_WINDOW)
+    deltas = 0
+    offset = 0
+
+    with os.fdopen(fd, 'wb') as f:
+        def emit(data, crc=0):
+            nonlocal offset
+            pack_sha.update(data)
+            f.write(data)
+            offset += len(data)
+            return zlib.crc32(data, crc)
+
+        emit(b'PACK' + struct.pack('>II', 2, len(ordered)))
+        for sha1 in ordered:
+            obj_type, size = infos[sha1]
+            start = offset
+            if obj_type in DELTA_TYPES and DELTA_BLOCK <= size <= DELTA_MAX_SIZE:
+                _, body = read_object(sha1)
+                best = _best_delta(window, obj_type, body)
+                if best:
+                    base_offset, delta, depth = best
+                    head = _pack_entry_header(OFS_DELTA, len(delta)) + _pack_ofs(start - base_offset)
+                    payload = zlib.compress(delta)
+                    deltas += 1
+                else:
+                    depth = 0
+                    head = _pack_entry_header(PACK_TYPES[obj_type], size)
+                    payload = zlib.compress(body)
+                crc = emit(payload, emit(head))
+                window.append((start, obj_type, body, depth))
+            else:
+                # Small objects and very large blobs are stored whole; the
+                # latter are streamed so they never sit in memory.
+                _, _, chunks = stream_object(sha1)
+                crc = emit(_pack_entry_header(PACK_TYPES[obj_type], size))
+                compressor = zlib.compressobj()
+                for chunk in chunks:
+                    crc = emit(compressor.compress(chunk), crc)
+                crc = emit(compressor.flush(), crc)
+            entries.append((bytes.fromhex(sha1), crc, start))
+        trailer = pack_sha.digest()
+        f.write(trailer)
+
+    name = f"pack-{trailer.hex()}"
+    pack_path = os.path.join(PACK_DIR, name + '.pack')
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, pack_path)
+    _write_pack_index(os.path.join(PACK_DIR, name + '.idx'), entries, trailer)
+    return pack_path, deltas
+
+
+def _write_pack_index(idx_path, entries, pack_checksum):
+    entries.sort()
+    fanout = [0] * 256
+    for sha_bin, _, _ in entries:
+        fanout[sha_bin[0]] += 1
+    offsets = bytearray()
+    large = bytearray()
+    for _, _, offset in entries:
+        if offset < 0x80000000:
+            offsets += struct.pack('>I', offset)
+        else:
+            offsets += struct.pack('>I', 0x80000000 | (len(large) // 8))
+            large += struct.pack('>Q', offset)
+
+    body = bytearray(IDX_HEADER)
+    body += struct.pack('>256I', *itertools.accumulate(fanout))
+    body += b''.join(sha_bin for sha_bin, _, _ in entries)
+    body += b''.join(struct.pack('>I', crc) for _, crc, _ in entries)
+    body += offsets + large + pack_checksum
+    body += hashlib.sha1(body).digest()
+    tmp_path = idx_path + '.lock'
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, idx_path)
+
+
+def _store_size():
+    total = 0
+    for dirpath, _, filenames in os.walk(OBJECTS_DIR):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def repack():
+    loose = list(iter_loose_objects())
+    old_packs = list(load_packs())
+    shas = set(loose)
+    for pack in old_packs:
+        shas.update(pack.shas())
+    if not shas:
+        print("Nothing to pack.")
+        return
+
+    size_before = _store_size()
+    pack_path, deltas = write_pack(shas)
+    reset_packs()
+    for pack in old_packs:
+        if pack.pack_path != pack_path:
+            os.remove(pack.idx_path)
+            os.remove(pack.pack_path)
+    for sha1 in loose:
+        os.remove(object_path(sha1))
+    for dir_prefix in {sha1[:2] for sha1 in loose}:
+        try:
+            os.rmdir(os.path.join(OBJECTS_DIR, dir_prefix))
+        except OSError:
+            pass
+
+    print(f"Packed {len(shas)} objects ({deltas} deltas) into "
+          f"{os.path.basename(pack_path)}: {size_before} -> {_store_size()} bytes")
+
+
+def gc_roots():
+    roots = [read_head(), load_index().get("root_tree")]
+    for dirpath, _, filenames in os.walk(os.path.join(REPO_DIR, "refs")):
+        roots.extend(read_ref(os.path.join(dirpath, name)) for name in filenames)
+    return [sha1 for sha1 in roots if sha1]
+
+
+def reachable_local(roots):
+    # Only objects present locally are read, so a partial clone never
+    # fetches anything while being collected.
+    marked = set()
+    pending = list(roots)
+    while pending:
+        sha1 = pending.pop()
+        if sha1 in marked or not object_exists(sha1):
+            continue
+        marked.add(sha1)
+        obj_type = object_info(sha1)[0]
+        if obj_type == 'commit':
+            tree_sha, parents = read_commit(sha1)
+            pending.append(tree_sha)
+            pending.extend(parents)
+        elif obj_type == 'tree':
+            pending.extend(entry_sha for _, entry_sha, _ in read_tree(sha1))
+        elif obj_type == CHUNK_TYPE:
+            marked.update(chunk_sha for chunk_sha, _ in manifest_parts(sha1))
+    return marked
+
+
+def gc(grace=GC_GRACE_SECONDS):
+    """Delete objects unreachable from HEAD, refs and the index.
+
+    Loose objects, leftover temp files and packs younger than ``grace``
+    seconds are kept, since an ``add`` or ``repack`` may still be about to
+    reference them.
+    """
+    size_before = _store_size()
+    cutoff = time.time() - grace
+    marked = reachable_local(gc_roots())
+
+    removed = 0
+    for sha1 in list(iter_loose_objects()):
+        path = object_path(sha1)
+        if sha1 not in marked and os.stat(path).st_mtime < cutoff:
+            os.remove(path)
+            removed += 1
+    for dir_path in (OBJECTS_DIR, PACK_DIR):
+        if not os.path.isdir(dir_path):
+            continue
+        for name in os.listdir(dir_path):
+            path = os.path.join(dir_path, name)
+            if name.startswith('tmp_') and os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+    for dir_prefix in os.listdir(OBJECTS_DIR):
+        dir_path = os.path.join(OBJECTS_DIR, dir_prefix)
+        if len(dir_prefix) == 2 and os.path.isdir(dir_path) and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+    # Packed objects have no age of their own, so a pack is only rewritten
+    # once it is older than the grace period.
+    stale = [
+        pack for pack in load_packs()
+        if os.stat(pack.pack_path).st_mtime < cutoff
+        and any(sha1 not in marked for sha1 in pack.shas())
+    ]
+    if stale:
+        keep = {sha1 for pack in stale for sha1 in pack.shas() if sha1 in marked}
+        removed += sum(pack.count for pack in stale) - len(keep)
+        pack_path = write_pack(keep)[0] if keep else None
+        reset_packs()
+        for pack in stale:
+            if pack.pack_path != pack_path:
+                os.remove(pack.idx_path)
+                os.remove(pack.pack_path)
+
+    print(f"Removed {removed} unreachable objects, reclaimed "
+          f"{size_before - _store_size()} bytes.")
+
+
+def diff_trees(old_sha, new_sha, prefix='', unwritten=None):
+    """Yield ``(status, path, old_sha, new_sha)`` for changed blobs.
+
+    Trees found in ``unwritten`` (as collected by write_tree) are read from
+    there rather than from the object store.
+    """
+    if old_sha == new_sha:
+        return
+    unwritten = unwritten or {}
+
+    def entries(tree_sha):
+        if not tree_sha:
+            return {}
+        items = parse_tree(unwritten[tree_sha]) if tree_sha in unwritten else read_tree(tree_sha)
+        return {name: (kind, sha) for kind, sha, name in items}
+
+    old, new = entries(old_sha), entries(new_sha)
+
+    for name in sorted(old.keys() | new.keys()):
+        path = f"{prefix}/{name}" if prefix else name
+        old_kind, old_entry = old.get(name, (None, None))
+        new_kind, new_entry = new.get(name, (None, None))
+        if (old_kind, old_entry) == (new_kind, new_entry):
+            continue
+        if old_kind == 'tree' and new_kind == 'tree':
+            yield from diff_trees(old_entry, new_entry, path, unwritten)
+            continue
+        if old_kind == 'blob' and new_kind == 'blob':
+            yield ('M', path, old_entry, new_entry)
+            continue
+        if old_kind == 'tree':
+            yield from diff_trees(old_entry, None, path, unwritten)
+        elif old_kind:
+            yield ('D', path, old_entry, None)
+        if new_kind == 'tree':
+            yield from diff_trees(None, new_entry, path, unwritten)
+        elif new_kind:
+            yield ('A', path, None, new_entry)
+
+
+def write_blob(path, sha1):
+    _, chunks = stream_blob(sha1)
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return os.stat(path)
+
+
+def locally_modified(path, cached, sha1, racy_ns=0):
+    """Return whether the file at ``path`` differs from blob ``sha1``; a missing file does not."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if cached and cached[:4] == index_entry(st, None)[:4] and cached[2] < racy_ns:
+        return cached[4] != sha1
+    return hash_file(path, write=False) != sha1
+
+
+def checkout(commit_sha, jobs=None):
+    root_tree_sha, _ = read_commit(commit_sha)
     print(f"Checking out tree: {root_tree_sha}...")
-    restore_tree(root_tree_sha)
-    with open(INDEX_FILE, 'w') as f:
-        json.dump({"root_tree": root_tree_sha}, f)
+    root = os.path.abspath('.')
+    index = load_index()
+    if index.get("root") != root:
+        index = {"root": root, "entries": {}, "trees": {}}
+    current_tree = index.get("root_tree")
+    entries = index["entries"]
+    trees = index["trees"]
+
+    changes = list(diff_trees(current_tree, root_tree_sha))
+    # A path is only overwritten or removed if it holds exactly what the
+    # index says: files the index does not know must be absent or already
+    # match the target, and staged changes must have been committed.
+    head_sha = read_head()
+    staged = set()
+    if current_tree and head_sha:
+        staged = {path for _, path, _, _ in diff_trees(read_commit(head_sha)[0], current_tree)}
+    racy_ns = index.get("racy_ns", 0)
+    dirty = [path for status, path, old_sha, new_sha in changes
+             if path in staged or locally_modified(
+                 path, entries.get(path), new_sha if status == 'A' else old_sha, racy_ns)]
+    if dirty:
+        print("error: Your local changes or untracked files at these paths would be overwritten by checkout:")
+        for path in dirty:
+            print(f"\t{path}")
+        print("Commit or remove them before you check out.")
+        return
+    updates = [(path, new_sha) for status, path, _, new_sha in changes if status != 'D']
+    for status, path, _, _ in changes:
+        # Cached tree SHAs above a changed path are stale; add recomputes them.
+        parent = path
+        while parent:
+            parent = parent.rpartition('/')[0]
+            trees.pop(parent, None)
+        if status == 'D':
+            entries.pop(path, None)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            parent = os.path.dirname(path)
+            while parent and os.path.isdir(parent) and not os.listdir(parent):
+                os.rmdir(parent)
+                parent = os.path.dirname(parent)
+
+    for path, _ in updates:
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
 
-def clone(repo_url):
+    fetched = fetch_missing([sha1 for _, sha1 in updates], jobs)
+    if load_config().get("promisor"):
+        parts = (manifest_parts(sha1) for _, sha1 in updates)
+        fetched += fetch_missing([chunk for p in parts if p for chunk, _ in p], jobs)
+    if fetched:
+        print(f"Fetched {fetched} missing objects.")
+
+    jobs = jobs or DEFAULT_JOBS
+    total = len(updates)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(write_blob, path, sha1): (path, sha1) for path, sha1 in updates}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            path, sha1 = futures[future]
+            entries[path] = index_entry(future.result(), sha1)
+            if done == total or done % CHECKOUT_PROGRESS_EVERY == 0:
+                print(f"Updating files: {done * 100 // total}% ({done}/{total})")
+
+    removed = len(changes) - total
+    print(f"Updated {total} files, removed {removed}.")
+    index["root_tree"] = root_tree_sha
+    save_index(index)
+    with open(HEAD_FILE, 'w') as f:
+        f.write(commit_sha)
+
+
+def read_head():
+    return read_ref(HEAD_FILE)
+
+
+def worktree_tree(index):
+    """Return ``(tree_sha, unwritten)`` for the worktree without writing any objects."""
+    # A shallow copy keeps the staged root_tree intact while the stat cache
+    # still lets unchanged files skip rehashing.
+    unwritten = {}
+    tree_sha = write_tree('.', dict(index), verbose=False, unwritten=unwritten)
+    return tree_sha, unwritten
+
+
+def print_diff(changes, worktree=False):
+    """Print changes as unified diffs; with ``worktree``, new content is read from the files."""
+    for status, path, old_sha, new_sha in changes:
+        print(f"diff --py_git a/{path} b/{path}")
+        old = read_object(old_sha)[1] if old_sha else b''
+        if not new_sha:
+            new = b''
+        elif worktree:
+            with open(path, 'rb') as f:
+                new = f.read()
+        else:
+            new = read_object(new_sha)[1]
+        if b'\0' in old[:8000] or b'\0' in new[:8000]:
+            print(f"Binary files a/{path} and b/{path} differ")
+            continue
+        print(f"--- {'a/' + path if old_sha else '/dev/null'}")
+        print(f"+++ {'b/' + path if new_sha else '/dev/null'}")
+        old_lines = old.decode(errors='replace').splitlines()
+        new_lines = new.decode(errors='replace').splitlines()
+        for line in unified_diff(old_lines, new_lines):
+            print(line)
+
+
+def diff(base_commit=None, target_commit=None):
+    index = load_index()
+    if base_commit:
+        base_tree = read_commit(base_commit)[0]
+    else:
+        base_tree = index.get("root_tree")
+    if target_commit:
+        target_tree = read_commit(target_commit)[0]
+        print_diff(diff_trees(base_tree, target_tree))
+        return
+    target_tree, unwritten = worktree_tree(index)
+    print_diff(diff_trees(base_tree, target_tree, unwritten=unwritten), worktree=True)
+
+
+def status():
+    index = load_index()
+    head_sha = read_head()
+    head_tree = read_commit(head_sha)[0] if head_sha else None
+    staged_tree = index.get("root_tree")
+    work_tree, unwritten = worktree_tree(index)
+    sections = [
+        ("Changes to be committed:", diff_trees(head_tree, staged_tree)),
+        ("Changes not staged for commit:", diff_trees(staged_tree, work_tree, unwritten=unwritten)),
+    ]
+    labels = {'A': 'new file', 'M': 'modified', 'D': 'deleted'}
+    clean = True
+    for title, changes in sections:
+        changes = list(changes)
+        if not changes:
+            continue
+        clean = False
+        print(title)
+        for status_code, path, _, _ in changes:
+            print(f"    {labels[status_code]}:   {path}")
+    if clean:
+        print("nothing to commit, working tree clean")
+
+
+def clone_prefixes(count):
+    # Fan out over SHA prefixes only once each range holds a fair number of
+    # objects; small repositories come down in a single request.
+    digits = 0
+    while digits < 2 and 16 ** (digits + 1) * CLONE_BUCKET_OBJECTS <= count:
+        digits += 1
+    return [format(i, f'0{digits}x') if digits else '' for i in range(16 ** digits)]
+
+
+def fetch_prefix(repo_url, prefix, progress, params=None):
+    """Download every object under ``prefix``, resuming after the last one stored."""
+    received = [0]
+
+    def stored(sha1):
+        progress[prefix] = sha1
+        received[0] += 1
+
+    for attempt in range(HTTP_RETRIES + 1):
+        query = dict(params or {}, prefix=prefix)
+        if progress[prefix]:
+            query["after"] = progress[prefix]
+        try:
+            resp = http_request('GET', repo_url, params=query, stream=True)
+            resp.raise_for_status()
+            receive_objects(resp.iter_content(CHUNK_SIZE), stored)
+            return received[0]
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError, ValueError):
+            if attempt == HTTP_RETRIES:
+                raise
+            time.sleep(HTTP_BACKOFF * 2 ** attempt)
+
+
+def save_clone_state(state):
+    tmp_path = CLONE_STATE_FILE + ".lock"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, CLONE_STATE_FILE)
+
+
+def shallow_boundary(head_sha):
+    boundary = []
+    seen = set()
+    pending = [head_sha]
+    while pending:
+        commit_sha = pending.pop()
+        if commit_sha in seen:
+            continue
+        seen.add(commit_sha)
+        _, parents = read_commit(commit_sha)
+        if all(object_exists(p) for p in parents):
+            pending.extend(parents)
+        else:
+            boundary.append(commit_sha)
+    return boundary
+
+
+def clone(repo_url, jobs=None, depth=None, blob_filter=None):
     repo_name = repo_url.rstrip('/').split('/')[-2]
-    if os.path.exists(repo_name):
+    state_path = os.path.join(repo_name, CLONE_STATE_FILE)
+    if os.path.exists(state_path):
+        print(f"Resuming clone into '{repo_name}'...")
+        os.chdir(repo_name)
+        with open(CLONE_STATE_FILE) as f:
+            state = json.load(f)
+    elif os.path.exists(repo_name):
         print(f"Error: Directory '{repo_name}' already exists.")
         return
+    else:
+        print(f"Cloning into '{repo_name}'...")
+        os.makedirs(repo_name)
+        os.chdir(repo_name)
+        init()
+        print(f"Fetching from {repo_url}...")
+        try:
+            resp = http_request('GET', repo_url.rstrip('/').rsplit('/', 1)[0] + "/refs")
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Failed to connect: {e}")
+            return
+        info = resp.json()
+        head_sha = info["refs"].get("refs/heads/main")
+        params = {}
+        if head_sha and (depth or blob_filter):
+            params = {"head": head_sha}
+            if depth:
+                params["depth"] = depth
+            if blob_filter:
+                params["filter"] = blob_filter
+        # ``done`` maps each prefix to the last SHA stored from it, or True
+        # once the whole range has arrived. Filtered clones are computed per
+        # request on the server, so they come down as a single range.
+        prefixes = [''] if params else clone_prefixes(info.get("objects", 0))
+        state = {
+            "url": repo_url,
+            "head": head_sha,
+            "params": params,
+            "done": dict.fromkeys(prefixes),
+        }
+        save_clone_state(state)
 
-    print(f"Cloning into '{repo_name}'...")
-    os.makedirs(repo_name)
-    os.chdir(repo_name)
-
-    init()
-    print(f"Fetching from {repo_url}...")
-    try:
-        resp = requests.get(repo_url)
-        resp.raise_for_status()
-        data = resp.json()
-    except Exception as e:
-        print(f"Failed to connect: {e}")
+    done = state["done"]
+    pending = [prefix for prefix, last in done.items() if last is not True]
+    count = 0
+    error = None
+    for prefix, future in run_batches(
+            lambda prefix: fetch_prefix(state["url"], prefix, done, state["params"]),
+            pending, jobs):
+        if future.exception() is not None:
+            error = error or future.exception()
+        else:
+            count += future.result()
+            done[prefix] = True
+        save_clone_state(state)
+    if error is not None:
+        print(f"Clone interrupted ({error}); run the same clone command again to resume.")
         return
-    objects = data.get("objects", [])
-    print(f"Received {len(objects)} objects.")
-    
-    for obj in objects:
-        sha1 = obj['sha1']
-        raw_data = bytes.fromhex(obj['data'])
-        path_dir = os.path.join(OBJECTS_DIR, sha1[:2])
-        os.makedirs(path_dir, exist_ok=True)
-        path = os.path.join(path_dir, sha1[2:])
-        with open(path, 'wb') as f:
-            f.write(raw_data)
-            
-    head_sha = data.get("head")
+    print(f"Received {count} objects.")
+
+    head_sha = state["head"]
+    config = dict(load_config())
+    if head_sha:
+        # Keep writing trees in the format the remote's history uses.
+        _, root = read_object(read_commit(head_sha)[0])
+        if root:
+            config["format"] = 2 if root[:1].isdigit() else 1
+    if state["params"].get("filter"):
+        # Blobs left on the server are fetched on first use.
+        config["promisor"] = state["url"].rstrip('/').rsplit('/', 1)[0]
+        config["filter"] = state["params"]["filter"]
+    if state["params"].get("depth"):
+        config["shallow"] = shallow_boundary(head_sha)
+    save_config(config)
+    os.remove(CLONE_STATE_FILE)
+
     if head_sha:
         with open(HEAD_FILE, 'w') as f:
             f.write(head_sha)
+        write_ref(remote_ref_path(repo_name), head_sha)
         print(f"Resolving deltas (checkout)... HEAD is at {head_sha[:7]}")
-        checkout(head_sha)
+        checkout(head_sha, jobs)
     else:
         print("warning: You appear to have cloned an empty repository.")
-    
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="py_git command")
-    parser.add_argument('command', choices=['init', 'add', 'commit', 'push', 'pull', 'clone'], help='py_git commands')
+    parser.add_argument('command', choices=['init', 'add', 'commit', 'push', 'pull', 'clone', 'repack', 'checkout', 'diff', 'status', 'watch', 'gc'], help='py_git commands')
     parser.add_argument('-p', '--path', type=str, help='Path for add command')
     parser.add_argument('-m', '--message', type=str, help='Commit message')
     parser.add_argument('-r', '--repo_name', type=str, help='Repo Name for push command')
     parser.add_argument('-u', '--url', type=str, help='URL for clone command')
+    parser.add_argument('-c', '--commit', type=str, help='Commit SHA for checkout command, or the base for diff')
+    parser.add_argument('--to', type=str, help='Commit SHA to diff against (default: working tree)')
+    parser.add_argument('--depth', type=int, help='Clone only the last N commits')
+    parser.add_argument('--filter', choices=['blob:none'], help='Partial clone: fetch blobs on demand')
+    parser.add_argument('--grace', type=int, default=GC_GRACE_SECONDS, help='Seconds an unreachable object is kept by gc')
+    parser.add_argument('--chunked', action='store_true', help='Make init store large files as content-defined chunks')
+    parser.add_argument('--poll', action='store_true', help='Make watch poll the tree instead of using inotify')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker threads for add, checkout, push and clone (default: PY_GIT_JOBS or CPU count)')
 
     args = parser.parse_args()
 
     if args.command == 'init':
-        init()
+        init(args.chunked)
     elif args.command == 'add':
         if not args.path:
             parser.error('add requires a -p path')
-        add(args.path)
+        add(args.path, args.jobs)
     elif args.command == 'commit':
         if not args.message:
             parser.error("the commit command requires a -m message")
@@ -283,10 +2290,24 @@ if __name__ == '__main__':
     elif args.command == 'push':
         if not args.repo_name:
             parser.error('push command requires -r repo name')
-        push(args.repo_name)
+        push(args.repo_name, args.jobs)
     elif args.command == 'clone':
         if not args.url:
             parser.error("clone requires a URL")
-        clone(args.url)
+        clone(args.url, args.jobs, args.depth, args.filter)
+    elif args.command == 'checkout':
+        if not args.commit:
+            parser.error('checkout requires a -c commit')
+        checkout(args.commit, args.jobs)
+    elif args.command == 'diff':
+        diff(args.commit, args.to)
+    elif args.command == 'status':
+        status()
+    elif args.command == 'repack':
+        repack()
+    elif args.command == 'gc':
+        gc(args.grace)
+    elif args.command == 'watch':
+        watch(args.poll)
     else:
         print('No command.')
\ No newline at end of file
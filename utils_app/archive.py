@@ -0,0 +1,147 @@
+import io
+import os
+import tarfile
+import tempfile
+import zipfile
+import zlib
+
+from django.conf import settings
+
+from .helpers import get_tree, open_blob
+
+ARCHIVE_CONTENT_TYPES = {"tar.gz": "application/gzip", "zip": "application/zip"}
+# Entries carry a fixed timestamp so an archive depends only on its tree;
+# 1980-01-01 is the earliest time a zip entry can hold.
+ARCHIVE_MTIME = 315532800
+EXECUTABLE_MODE = b"100755"
+
+
+def walk_tree(repo, tree_sha, prefix=""):
+    """Yield ``(path, entry)`` for every directory and blob under a tree, parents first."""
+    for e in get_tree(repo, tree_sha):
+        path = prefix + e.name
+        if e.type == "tree":
+            yield path + "/", e
+            yield from walk_tree(repo, e.sha, path + "/")
+        elif e.type == "blob":
+            yield path, e
+
+
+def _file_mode(entry):
+    return 0o755 if entry.mode == EXECUTABLE_MODE else 0o644
+
+
+def tar_gz_chunks(repo, tree_sha):
+    """Yield a gzipped tar of a tree, one blob chunk at a time."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    written = 0
+    for path, entry in walk_tree(repo, tree_sha):
+        info = tarfile.TarInfo(path)
+        info.mtime = ARCHIVE_MTIME
+        if entry.type == "tree":
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            written += len(header)
+            yield compressor.compress(header)
+            continue
+        size, chunks = open_blob(entry.sha)
+        info.size = size
+        info.mode = _file_mode(entry)
+        header = info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        written += len(header) + size
+        yield compressor.compress(header)
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        padding = -size % tarfile.BLOCKSIZE
+        written += padding
+        yield compressor.compress(tarfile.NUL * padding)
+    # Two empty blocks end the archive, which is then padded to a full record.
+    trailer = 2 * tarfile.BLOCKSIZE
+    trailer += -(written + trailer) % tarfile.RECORDSIZE
+    yield compressor.compress(tarfile.NUL * trailer)
+    yield compressor.flush()
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable write target that hands back whatever was written since the last drain."""
+
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def zip_chunks(repo, tree_sha):
+    """Yield a zip of a tree, one blob chunk at a time.
+
+    The sink cannot seek, so zipfile writes sizes and CRCs in data
+    descriptors after each entry instead of going back to the header.
+    """
+    sink = _Sink()
+    date_time = (1980, 1, 1, 0, 0, 0)
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path, entry in walk_tree(repo, tree_sha):
+            info = zipfile.ZipInfo(path, date_time)
+            if entry.type == "tree":
+                info.external_attr = (0o40755 << 16) | 0x10
+                archive.writestr(info, b"")
+                yield sink.drain()
+                continue
+            size, chunks = open_blob(entry.sha)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (0o100000 | _file_mode(entry)) << 16
+            with archive.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
+
+ARCHIVE_WRITERS = {"tar.gz": tar_gz_chunks, "zip": zip_chunks}
+
+
+def cached_archive_path(tree_sha, fmt):
+    """Return where the archive of a tree is cached, or ``None`` if caching is off."""
+    root = getattr(settings, "PYGIT_ARCHIVE_ROOT", None)
+    if not root:
+        return None
+    return os.path.join(str(root), tree_sha[:2], f"{tree_sha[2:]}.{fmt}")
+
+
+def stream_archive(repo, tree_sha, fmt):
+    """Yield the archive of a tree, keeping a copy in the cache once it completes.
+
+    Archives of the same tree are identical in every repository, so the
+    cache is keyed by tree SHA alone. A stream that is abandoned part way
+    leaves nothing behind.
+    """
+    chunks = (chunk for chunk in ARCHIVE_WRITERS[fmt](repo, tree_sha) if chunk)
+    path = cached_archive_path(tree_sha, fmt)
+    if path is None:
+        yield from chunks
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix="tmp_archive_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
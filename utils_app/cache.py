@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ObjectCache:
+    """Bounded LRU cache for parsed objects, sized by approximate bytes.
+
+    Objects are immutable by SHA, so entries never need invalidation. When
+    ``alias`` names a Django cache, it is consulted on local misses and
+    filled alongside the in-process tier so other workers can share it.
+    """
+
+    def __init__(self, max_bytes, alias=None):
+        self.max_bytes = max_bytes
+        self.alias = alias
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def _shared(self):
+        return caches[self.alias] if self.alias else None
+
+    @staticmethod
+    def _shared_key(key):
+        return "pygit:" + ":".join(str(part) for part in key)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        shared = self._shared()
+        if shared is not None:
+            entry = shared.get(self._shared_key(key))
+            if entry is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self._store(key, *entry)
+                return entry[0]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, size):
+        self._store(key, value, size)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(self._shared_key(key), (value, size), timeout=None)
+
+    def _store(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+            }
+
+
+object_cache = ObjectCache(
+    getattr(settings, "PYGIT_OBJECT_CACHE_BYTES", 64 << 20),
+    getattr(settings, "PYGIT_OBJECT_CACHE_ALIAS", None),
+)
@@ -0,0 +1,85 @@
+from .helpers import parse_commit
+from .models import CommitGraphEntry, GitObject
+from .storage import get_object_store
+
+
+def _graph_entry(repo, sha1, info):
+    author, _, timestamp = info.get("author_line", "").rpartition(" ")
+    return CommitGraphEntry(
+        repo=repo,
+        sha1=sha1,
+        tree=info["tree"],
+        parents=info.get("parents", []),
+        timestamp=int(timestamp) if timestamp.isdigit() else 0,
+        author=author[:255],
+        summary=info["message"].strip().split("\n", 1)[0][:255],
+    )
+
+
+def update_commit_graph(repo, shas):
+    """Add graph entries for ``shas`` and any ancestors still missing one."""
+    store = get_object_store()
+    pending = {}
+    frontier = set(shas)
+    while frontier:
+        frontier -= set(
+            CommitGraphEntry.objects.filter(repo=repo, sha1__in=list(frontier))
+            .values_list('sha1', flat=True)
+        )
+        present = set(
+            GitObject.objects.filter(repo=repo, type='commit', sha1__in=list(frontier))
+            .values_list('sha1', flat=True)
+        )
+        next_frontier = set()
+        for sha1 in present:
+            _, body = store.read(sha1)
+            pending[sha1] = _graph_entry(repo, sha1, parse_commit(body))
+            next_frontier.update(p for p in pending[sha1].parents if p not in pending)
+        frontier = next_frontier
+    if not pending:
+        return 0
+
+    parents = {p for entry in pending.values() for p in entry.parents} - set(pending)
+    generations = dict(
+        CommitGraphEntry.objects.filter(repo=repo, sha1__in=list(parents))
+        .values_list('sha1', 'generation')
+    )
+    for sha1 in pending:
+        if sha1 in generations:
+            continue
+        stack = [sha1]
+        while stack:
+            current = pending[stack[-1]]
+            unresolved = [p for p in current.parents if p in pending and p not in generations]
+            if unresolved:
+                stack.extend(unresolved)
+                continue
+            stack.pop()
+            # Parents missing from the repo (e.g. a shallow push) count as 0.
+            current.generation = 1 + max((generations.get(p, 0) for p in current.parents), default=0)
+            generations[current.sha1] = current.generation
+    CommitGraphEntry.objects.bulk_create(pending.values(), ignore_conflicts=True)
+    return len(pending)
+
+
+def first_parent_history(repo, start_sha, limit):
+    """Return up to ``limit`` graph entries following first parents from ``start_sha``."""
+    rows = {}
+    history = []
+    sha1 = start_sha
+    while sha1 and len(history) < limit:
+        entry = rows.get(sha1)
+        if entry is None:
+            entry = CommitGraphEntry.objects.filter(repo=repo, sha1=sha1).first()
+            if entry is None:
+                break
+            # First parents have strictly lower generations, so one range
+            # query usually covers the rest of the page.
+            low = entry.generation - (limit - len(history))
+            for row in CommitGraphEntry.objects.filter(
+                repo=repo, generation__gt=low, generation__lte=entry.generation
+            ):
+                rows[row.sha1] = row
+        history.append(entry)
+        sha1 = entry.parents[0] if entry.parents else None
+    return history
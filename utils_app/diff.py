@@ -0,0 +1,71 @@
+from linediff import diff_hunks
+
+from .helpers import get_trees, open_blob
+
+DIFF_MAX_BYTES = 1024 * 1024
+DIFF_MAX_FILES = 300
+
+
+def diff_trees(repo, old_sha, new_sha, prefix=""):
+    """Yield ``(status, path, old_sha, new_sha)`` for changed blobs.
+
+    Subtrees with the same SHA on both sides are skipped without being read,
+    so the cost follows the size of the change rather than of the tree.
+    """
+    if old_sha == new_sha:
+        return
+    trees = get_trees(repo, [sha for sha in (old_sha, new_sha) if sha])
+    old = {e.name: (e.type, e.sha) for e in trees.get(old_sha, ())}
+    new = {e.name: (e.type, e.sha) for e in trees.get(new_sha, ())}
+
+    for name in sorted(old.keys() | new.keys()):
+        path = f"{prefix}/{name}" if prefix else name
+        old_kind, old_entry = old.get(name, (None, None))
+        new_kind, new_entry = new.get(name, (None, None))
+        if (old_kind, old_entry) == (new_kind, new_entry):
+            continue
+        if old_kind == "tree" and new_kind == "tree":
+            yield from diff_trees(repo, old_entry, new_entry, path)
+            continue
+        if old_kind == "blob" and new_kind == "blob":
+            yield ("M", path, old_entry, new_entry)
+            continue
+        if old_kind == "tree":
+            yield from diff_trees(repo, old_entry, None, path)
+        elif old_kind:
+            yield ("D", path, old_entry, None)
+        if new_kind == "tree":
+            yield from diff_trees(repo, None, new_entry, path)
+        elif new_kind:
+            yield ("A", path, None, new_entry)
+
+
+def blob_lines(sha1):
+    if not sha1:
+        return []
+    size, chunks = open_blob(sha1)
+    if size > DIFF_MAX_BYTES:
+        chunks.close()
+        return None
+    body = b"".join(chunks)
+    if b"\0" in body[:8000]:
+        return None
+    return body.decode(errors="replace").splitlines()
+
+
+def commit_changes(repo, old_tree, new_tree):
+    """Return ``(files, truncated)`` for the blobs changed between two trees.
+
+    Text blobs come with line hunks. Only the first DIFF_MAX_FILES files
+    are diffed; the tree walk stops there.
+    """
+    files = []
+    for status, path, old_sha, new_sha in diff_trees(repo, old_tree, new_tree):
+        if len(files) >= DIFF_MAX_FILES:
+            return files, True
+        old_lines, new_lines = blob_lines(old_sha), blob_lines(new_sha)
+        hunks = None
+        if old_lines is not None and new_lines is not None:
+            hunks = diff_hunks(old_lines, new_lines)
+        files.append({"status": status, "path": path, "hunks": hunks})
+    return files, False
@@ -1,20 +1,132 @@
+from bisect import bisect_left
+from itertools import islice
+
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from .cache import object_cache
 from .models import GitObject
+from .storage import get_object_store
+
+INGEST_BATCH = 500
+TREE_TYPES = {b"40000": "tree", b"160000": "commit"}
+TEXT_TREE_MODES = {"tree": b"40000", "blob": b"100644"}
 
 
 def load_object(obj: GitObject):
-    raw = obj.data
-    null_index = raw.find(b'\0')
-    header = raw[:null_index].decode()
-    obj_type, size = header.split(' ')
-    body = raw[null_index+1:]
-    return obj_type, body
+    return get_object_store().read(obj.sha1)
+
+class TreeEntry:
+    __slots__ = ("mode", "name", "raw")
+
+    def __init__(self, mode, name, raw):
+        self.mode = mode
+        self.name = name
+        self.raw = raw
+
+    @property
+    def type(self):
+        return TREE_TYPES.get(self.mode, "blob")
+
+    @property
+    def sha(self):
+        return self.raw.hex()
+
+
+class Tree:
+    """A parsed tree: its entries in stored order plus a by-name lookup.
+
+    Binary trees are sorted the way git sorts them, with directories
+    compared as ``name/``; text trees are sorted by plain name. ``keys``
+    holds those sort keys so ``lookup`` can bisect either kind.
+    """
+
+    __slots__ = ("body", "entries", "keys")
+
+    def __init__(self, body, entries, keys):
+        self.body = body
+        self.entries = entries
+        self.keys = keys
+
+    def __reduce__(self):
+        # Entries point into ``body``, so shared caches pickle just the body.
+        return parse_tree, (self.body,)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, name):
+        for key in (name, name + "/"):
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                return self.entries[i]
+        return None
 
 def parse_tree(body: bytes):
+    """Parse a binary (``<mode> <name>\\0<20-byte sha>``) or text tree."""
     entries = []
+    keys = []
+    if body[:1].isdigit():
+        # SHAs stay as views into ``body``; they are hexed only when read.
+        view = memoryview(body)
+        find = body.find
+        pos = 0
+        while pos < len(body):
+            nul = find(b"\0", pos)
+            space = find(b" ", pos, nul)
+            mode = body[pos:space]
+            name = body[space + 1:nul].decode()
+            entries.append(TreeEntry(mode, name, view[nul + 1:nul + 21]))
+            keys.append(name + "/" if mode == b"40000" else name)
+            pos = nul + 21
+    else:
+        for line in body.decode().splitlines():
+            kind, sha, name = line.split(' ', 2)
+            entries.append(TreeEntry(TEXT_TREE_MODES[kind], name, bytes.fromhex(sha)))
+            keys.append(name)
+    return Tree(body, entries, keys)
+
+def parse_manifest(body: bytes):
+    """Return the ``(chunk_sha, size)`` parts listed by a chunked blob."""
+    parts = []
     for line in body.decode().splitlines():
-        kind, sha, name = line.split(' ', 2)
-        entries.append({"type": kind, "sha": sha, "name": name})
-    return entries
+        sha, size = line.split(' ')
+        parts.append((sha, int(size)))
+    return parts
+
+def open_blob(sha1, start=0):
+    """Return ``(size, chunks)`` for a blob's content from byte ``start`` on.
+
+    Chunked blobs are reassembled from their chunk objects; chunks wholly
+    before ``start`` are skipped without being opened.
+    """
+    store = get_object_store()
+    obj_type, size, chunks = store.open(sha1)
+    if obj_type != 'chunked':
+        return size, _skip(chunks, start)
+    parts = parse_manifest(b''.join(chunks))
+
+    def body():
+        offset = start
+        for chunk_sha, chunk_size in parts:
+            if offset >= chunk_size:
+                offset -= chunk_size
+                continue
+            yield from _skip(store.open(chunk_sha)[2], offset)
+            offset = 0
+
+    return sum(chunk_size for _, chunk_size in parts), body()
+
+def _skip(chunks, offset):
+    for chunk in chunks:
+        if offset >= len(chunk):
+            offset -= len(chunk)
+            continue
+        yield chunk[offset:] if offset else chunk
+        offset = 0
 
 def parse_commit(body: bytes):
     text = body.decode()
@@ -28,3 +140,123 @@ def parse_commit(body: bytes):
         elif line.startswith("author "):
             info["author_line"] = line[7:]
     return info
+
+def _cached_object(repo, sha1, kind, parse):
+    key = (kind, repo.pk, sha1)
+    value = object_cache.get(key)
+    if value is None:
+        obj = get_object_or_404(GitObject, repo=repo, sha1=sha1, type=kind)
+        _, body = load_object(obj)
+        value = parse(body)
+        # Parsed dicts and strings take a few times the raw body size.
+        object_cache.set(key, value, 256 + 4 * len(body))
+    return value
+
+def get_commit(repo, sha1):
+    return dict(_cached_object(repo, sha1, 'commit', parse_commit))
+
+def get_tree(repo, sha1):
+    return _cached_object(repo, sha1, 'tree', parse_tree)
+
+def get_trees(repo, shas):
+    """Return ``{sha: entries}`` for ``shas`` with one query for the uncached ones."""
+    trees = {}
+    missing = []
+    for sha1 in shas:
+        entries = object_cache.get(('tree', repo.pk, sha1))
+        if entries is None:
+            missing.append(sha1)
+        else:
+            trees[sha1] = entries
+    store = get_object_store()
+    for sha1 in GitObject.objects.filter(repo=repo, type='tree', sha1__in=missing).values_list('sha1', flat=True):
+        _, body = store.read(sha1)
+        trees[sha1] = parse_tree(body)
+        object_cache.set(('tree', repo.pk, sha1), trees[sha1], 256 + 4 * len(body))
+    return trees
+
+def get_path_index(repo, tree_sha):
+    """Return a memoized ``{path: (type, sha)}`` map of everything under a root tree."""
+    key = ('paths', repo.pk, tree_sha)
+    index = object_cache.get(key)
+    if index is not None:
+        return index
+    index = {"": ("tree", tree_sha)}
+    size = 0
+    level = [("", tree_sha)]
+    while level:
+        trees = get_trees(repo, {sha for _, sha in level})
+        next_level = []
+        for prefix, sha in level:
+            for e in trees.get(sha, ()):
+                path = f"{prefix}/{e.name}" if prefix else e.name
+                index[path] = (e.type, e.sha)
+                size += 160 + len(path)
+                if e.type == "tree":
+                    next_level.append((path, e.sha))
+        level = next_level
+    object_cache.set(key, index, size)
+    return index
+
+def resolve_path(repo, tree_sha, path):
+    """Return ``(type, sha)`` for ``path`` under a root tree, or ``None``.
+
+    Walks one tree per component; history walks use it because they visit
+    many root trees once each, where building a full path index would not pay.
+    """
+    kind, sha = "tree", tree_sha
+    for name in filter(None, path.strip("/").split("/")):
+        if kind != "tree":
+            return None
+        entry = get_tree(repo, sha).lookup(name)
+        if entry is None:
+            return None
+        kind, sha = entry.type, entry.sha
+    return kind, sha
+
+def split_header(chunks):
+    """Split raw object chunks into ``(type, size, body_chunks)``."""
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if b'\0' in head:
+            break
+    else:
+        raise ValueError("Object has no header")
+    header, _, rest = head.partition(b'\0')
+    obj_type, size = header.decode().split(' ')
+
+    def body():
+        if rest:
+            yield rest
+        yield from chunks
+
+    return obj_type, int(size), body()
+
+def ingest_objects(repo, objects, batch_size=INGEST_BATCH):
+    """Store ``(sha1, raw_chunks)`` pairs and return the newly created objects."""
+    store = get_object_store()
+    objects = iter(objects)
+    created = []
+    while True:
+        batch = {}
+        for sha1, chunks in islice(objects, batch_size):
+            obj_type, size, body = split_header(chunks)
+            store.write(sha1, obj_type, size, body)
+            batch[sha1] = (obj_type, size)
+        if not batch:
+            return created
+        existing = set(
+            GitObject.objects.filter(repo=repo, sha1__in=list(batch))
+            .values_list('sha1', flat=True)
+        )
+        new_objects = [
+            GitObject(repo=repo, sha1=sha1, type=obj_type, size=size)
+            for sha1, (obj_type, size) in batch.items()
+            if sha1 not in existing
+        ]
+        if existing:
+            GitObject.objects.filter(repo=repo, sha1__in=list(existing)).update(created_at=timezone.now())
+        GitObject.objects.bulk_create(new_objects, ignore_conflicts=True)
+        created.extend(new_objects)
@@ -0,0 +1,192 @@
+import heapq
+from datetime import datetime, timezone
+
+from linediff import myers_diff
+
+from .cache import object_cache
+from .commit_graph import update_commit_graph
+from .diff import blob_lines
+from .helpers import get_tree, resolve_path
+from .models import CommitGraphEntry
+
+HISTORY_PREFETCH = 256
+
+
+class HistoryWalk:
+    """Visits pushed commits newest-first by generation, each at most once.
+
+    Graph rows are loaded a generation range at a time, since the commits
+    a walk reaches next are almost always just below the current one.
+    """
+
+    def __init__(self, repo, start_sha):
+        self.repo = repo
+        self.entries = {}
+        self.heap = []
+        self.queued = set()
+        entry = CommitGraphEntry.objects.filter(repo=repo, sha1=start_sha).first()
+        if entry is not None:
+            self.entries[start_sha] = entry
+            self.push(entry)
+
+    def push(self, entry):
+        if entry.sha1 not in self.queued:
+            self.queued.add(entry.sha1)
+            heapq.heappush(self.heap, (-entry.generation, entry.sha1))
+
+    def parents(self, entry):
+        missing = [p for p in entry.parents if p not in self.entries]
+        if missing:
+            for row in CommitGraphEntry.objects.filter(
+                repo=self.repo,
+                generation__lt=entry.generation,
+                generation__gte=entry.generation - HISTORY_PREFETCH,
+            ):
+                self.entries.setdefault(row.sha1, row)
+            missing = [p for p in missing if p not in self.entries]
+            if missing:
+                for row in CommitGraphEntry.objects.filter(repo=self.repo, sha1__in=missing):
+                    self.entries[row.sha1] = row
+        # Parents cut off by a shallow push have no graph row.
+        return [self.entries[p] for p in entry.parents if p in self.entries]
+
+    def __iter__(self):
+        while self.heap:
+            _, sha1 = heapq.heappop(self.heap)
+            yield self.entries[sha1]
+
+
+def commit_info(entry):
+    return {
+        "sha": entry.sha1,
+        "message": entry.summary,
+        "author": entry.author,
+        "date": datetime.fromtimestamp(entry.timestamp, tz=timezone.utc),
+    }
+
+
+def _sha_at(repo, tree_sha, path, kind):
+    found = resolve_path(repo, tree_sha, path)
+    return found[1] if found and found[0] == kind else None
+
+
+def _listing(repo, tree_sha):
+    return {e.name: e.sha for e in get_tree(repo, tree_sha)} if tree_sha else {}
+
+
+def last_commits(repo, commit_sha, path=""):
+    """Return ``{name: commit}`` giving the last commit to change each entry of a directory.
+
+    An entry is attributed to the newest commit that has its current SHA
+    while none of that commit's parents do. A parent whose directory tree
+    SHA is unchanged carries every entry at once, so history that does not
+    touch the directory costs one path lookup per commit.
+    """
+    path = path.strip("/")
+    key = ("last-commits", repo.pk, commit_sha, path)
+    result = object_cache.get(key)
+    if result is not None:
+        return result
+    update_commit_graph(repo, [commit_sha])
+    walk = HistoryWalk(repo, commit_sha)
+    targets = None
+    result = {}
+    for entry in walk:
+        dir_sha = _sha_at(repo, entry.tree, path, "tree")
+        if targets is None:
+            targets = _listing(repo, dir_sha)
+            if not targets:
+                break
+        parents = [(p, _sha_at(repo, p.tree, path, "tree")) for p in walk.parents(entry)]
+        same = next((p for p, sha in parents if sha == dir_sha), None)
+        if same is not None:
+            walk.push(same)
+            continue
+        mine = _listing(repo, dir_sha)
+        theirs = [(p, _listing(repo, sha)) for p, sha in parents]
+        for name, target in targets.items():
+            if name in result or mine.get(name) != target:
+                continue
+            carriers = [p for p, listing in theirs if listing.get(name) == target]
+            if not carriers:
+                result[name] = commit_info(entry)
+            for p in carriers:
+                walk.push(p)
+        if len(result) == len(targets):
+            break
+    object_cache.set(key, result, 256 + 200 * len(result))
+    return result
+
+
+def _line_map(old, new):
+    """Map indexes of lines in ``new`` that ``old`` already had to their index there."""
+    mapping = {}
+    i = j = 0
+    for tag, _ in myers_diff(old, new):
+        if tag == " ":
+            mapping[j] = i
+        i += tag != "+"
+        j += tag != "-"
+    return mapping
+
+
+def blame(repo, commit_sha, path):
+    """Return ``[(commit, line)]`` for a blob, or ``None`` if it is binary or too large.
+
+    Lines are handed back to a parent with an identical blob wholesale;
+    otherwise the lines a parent already had are found with a line diff and
+    handed to it, and whatever no parent had is blamed on the commit.
+    """
+    path = path.strip("/")
+    key = ("blame", repo.pk, commit_sha, path)
+    result = object_cache.get(key)
+    if result is not None:
+        return result
+    update_commit_graph(repo, [commit_sha])
+    walk = HistoryWalk(repo, commit_sha)
+    start = walk.entries.get(commit_sha)
+    blob_sha = start and _sha_at(repo, start.tree, path, "blob")
+    lines = blob_lines(blob_sha) if blob_sha else None
+    if lines is None:
+        return None
+
+    texts = {blob_sha: lines}
+
+    def text(sha1):
+        if sha1 not in texts:
+            texts[sha1] = blob_lines(sha1)
+        return texts[sha1]
+
+    origins = [None] * len(lines)
+    # Commit -> (blob SHA there, [(line index at the start, line index there)]).
+    pending = {commit_sha: (blob_sha, [(i, i) for i in range(len(lines))])}
+
+    def hand(parent, sha1, todo):
+        pending.setdefault(parent.sha1, (sha1, []))[1].extend(todo)
+        walk.push(parent)
+
+    for entry in walk:
+        sha1, todo = pending.pop(entry.sha1)
+        parents = [(p, _sha_at(repo, p.tree, path, "blob")) for p in walk.parents(entry)]
+        same = next((p for p, parent_sha in parents if parent_sha == sha1), None)
+        if same is not None:
+            hand(same, sha1, todo)
+            continue
+        for parent, parent_sha in parents:
+            if not todo:
+                break
+            old = text(parent_sha) if parent_sha else None
+            if old is None:
+                continue
+            mapping = _line_map(old, text(sha1))
+            passed = [(i, mapping[j]) for i, j in todo if j in mapping]
+            if passed:
+                hand(parent, parent_sha, passed)
+                todo = [(i, j) for i, j in todo if j not in mapping]
+        info = commit_info(entry)
+        for i, _ in todo:
+            origins[i] = info
+
+    result = list(zip(origins, lines))
+    object_cache.set(key, result, 256 + sum(100 + len(line) for line in lines))
+    return result
@@ -0,0 +1,54 @@
+import hashlib
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utils_app.helpers import ingest_objects, split_header
+from utils_app.models import GitObject, Repository
+from utils_app.storage import get_object_store
+
+
+def synthetic_objects(count, size):
+    for _ in range(count):
+        body = os.urandom(size)
+        raw = f"blob {len(body)}\0".encode() + body
+        yield hashlib.sha1(raw).hexdigest(), [raw]
+
+
+def ingest_per_object(repo, objects):
+    # The ingest loop push_objects used before batching: one SELECT and one
+    # autocommitted INSERT per object.
+    store = get_object_store()
+    for sha1, chunks in objects:
+        if not GitObject.objects.filter(repo=repo, sha1=sha1).exists():
+            obj_type, size, body = split_header(chunks)
+            store.write(sha1, obj_type, size, body)
+            GitObject.objects.create(repo=repo, sha1=sha1, type=obj_type, size=size)
+
+
+def ingest_batched(repo, objects):
+    with transaction.atomic():
+        ingest_objects(repo, objects)
+
+
+class Command(BaseCommand):
+    help = "Measure push ingest throughput (objects/sec) per object vs batched."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--objects', type=int, default=5000)
+        parser.add_argument('--size', type=int, default=1024, help='Blob size in bytes')
+
+    def handle(self, *args, **options):
+        count = options['objects']
+        objects = list(synthetic_objects(count, options['size']))
+        for label, ingest in (("per-object", ingest_per_object), ("batched", ingest_batched)):
+            repo = Repository.objects.create(name=f"__bench_push_{label}_{time.time_ns()}")
+            try:
+                start = time.perf_counter()
+                ingest(repo, objects)
+                elapsed = time.perf_counter() - start
+            finally:
+                repo.delete()
+            self.stdout.write(f"{label:>10}: {count} objects in {elapsed:.2f}s ({count / elapsed:,.0f} objects/sec)")
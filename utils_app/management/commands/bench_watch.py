@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+PY_GIT = os.path.join(settings.BASE_DIR, "py_git.py")
+
+
+def build_tree(root, files, per_dir):
+    dirs = (files + per_dir - 1) // per_dir
+    for d in range(dirs):
+        dir_path = os.path.join(root, f"d{d // 100:04d}", f"s{d % 100:02d}")
+        os.makedirs(dir_path, exist_ok=True)
+        for f in range(min(per_dir, files - d * per_dir)):
+            with open(os.path.join(dir_path, f"f{f}.txt"), "w") as fh:
+                fh.write(f"{d} {f}\n")
+
+
+def touch(root, count, round_no):
+    for i in range(count):
+        with open(os.path.join(root, "d0000", "s00", f"f{i}.txt"), "w") as fh:
+            fh.write(f"edit {round_no}\n")
+
+
+def timed_add(root):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, PY_GIT, "add", "-p", "."], cwd=root,
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = ("Compare py_git add latency on a synthetic tree, no-op and after touching "
+            "a few files, with the stat-cached full scan and with py_git watch running.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=500_000)
+        parser.add_argument('--per-dir', type=int, default=100)
+        parser.add_argument('--touch', type=int, default=10)
+        parser.add_argument('--poll', action='store_true', help='Benchmark the polling watcher')
+
+    def handle(self, *args, **options):
+        files, touched = options['files'], options['touch']
+        with tempfile.TemporaryDirectory(prefix="py_git_bench_") as root:
+            self.stdout.write(f"Building {files} files...")
+            build_tree(root, files, options['per_dir'])
+            subprocess.run([sys.executable, PY_GIT, "init"], cwd=root, check=True,
+                           stdout=subprocess.DEVNULL)
+            self.stdout.write(f"initial add:          {timed_add(root):8.2f}s")
+            self.stdout.write(f"no-op add (scan):     {timed_add(root):8.2f}s")
+            touch(root, touched, 1)
+            self.stdout.write(f"{touched}-file add (scan):  {timed_add(root):8.2f}s")
+
+            cmd = [sys.executable, PY_GIT, "watch"] + (["--poll"] if options['poll'] else [])
+            watcher = subprocess.Popen(cmd, cwd=root, stdout=subprocess.PIPE, text=True)
+            try:
+                self.stdout.write(watcher.stdout.readline().strip())
+                timed_add(root)  # picks up the daemon's token
+                self.stdout.write(f"no-op add (watch):    {timed_add(root):8.2f}s")
+                touch(root, touched, 2)
+                self.stdout.write(f"{touched}-file add (watch): {timed_add(root):8.2f}s")
+            finally:
+                watcher.terminate()
+                watcher.wait()
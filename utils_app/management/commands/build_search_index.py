@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utils_app.models import GitObject, Repository, SearchTrigram
+from utils_app.search import compact_postings, index_blobs
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the trigram search index for blobs pushed before it existed, "
+            "or with --compact merge the posting deltas pushes have appended.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repo', help='Only index this repository')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--compact', action='store_true',
+                            help='Merge each trigram\'s delta rows instead of rebuilding')
+
+    def handle(self, *args, **options):
+        repos = Repository.objects.order_by('name')
+        if options['repo']:
+            repos = repos.filter(name=options['repo'])
+        for repo in repos:
+            if options['compact']:
+                self.stdout.write(f"{repo.name}: compacted {compact_postings(repo)} trigrams")
+                continue
+            SearchTrigram.objects.filter(repo=repo).delete()
+            last_pk = 0
+            blobs = 0
+            while True:
+                rows = list(
+                    GitObject.objects.filter(repo=repo, type='blob', pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', 'sha1')[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                with transaction.atomic():
+                    index_blobs(repo, [sha1 for _, sha1 in rows])
+                blobs += len(rows)
+            compact_postings(repo)
+            self.stdout.write(f"{repo.name}: indexed {blobs} blobs")
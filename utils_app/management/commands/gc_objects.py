@@ -0,0 +1,85 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from utils_app.models import CommitGraphEntry, GitObject, Reference, Repository
+from utils_app.reachability import refs_bitmap
+from utils_app.storage import get_object_store
+
+
+def ref_tips(repo):
+    return frozenset(Reference.objects.filter(repo=repo).values_list('commit_hash', flat=True))
+
+
+class Command(BaseCommand):
+    help = "Delete objects unreachable from any ref, in short batched transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repo', help='Only collect this repository')
+        parser.add_argument('--grace-hours', type=float, default=14 * 24,
+                            help='Keep unreachable objects pushed within this many hours')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        repos = Repository.objects.order_by('name')
+        if options['repo']:
+            repos = repos.filter(name=options['repo'])
+        total_objects = total_bytes = 0
+        for repo in repos:
+            objects, reclaimed = self.collect(repo, cutoff, options)
+            total_objects += objects
+            total_bytes += reclaimed
+            self.stdout.write(f"{repo.name}: {objects} unreachable objects, {reclaimed} bytes")
+        verb = "Would reclaim" if options['dry_run'] else "Reclaimed"
+        self.stdout.write(f"{verb} {total_bytes} bytes from {total_objects} objects.")
+
+    def collect(self, repo, cutoff, options):
+        store = get_object_store()
+        tips = ref_tips(repo)
+        bitmap = refs_bitmap(repo, tips)
+        last_pk = 0
+        objects = reclaimed = 0
+        while True:
+            orphaned = []
+            with transaction.atomic():
+                # A push that moved a ref since the mark phase may have made
+                # garbage reachable again, so re-mark before deleting.
+                current = ref_tips(repo)
+                if current != tips:
+                    tips, bitmap = current, refs_bitmap(repo, current)
+                rows = list(
+                    GitObject.objects.filter(repo=repo, pk__gt=last_pk)
+                    .order_by('pk')
+                    .values_list('pk', 'sha1', 'type', 'size', 'created_at')[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+                garbage = [row for row in rows if row[0] not in bitmap and row[4] < cutoff]
+                objects += len(garbage)
+                if options['dry_run']:
+                    reclaimed += sum(row[3] for row in garbage)
+                elif garbage:
+                    shas = [row[1] for row in garbage]
+                    GitObject.objects.filter(pk__in=[row[0] for row in garbage]).delete()
+                    CommitGraphEntry.objects.filter(
+                        repo=repo, sha1__in=[row[1] for row in garbage if row[2] == 'commit']
+                    ).delete()
+                    # Bodies are shared between repositories; only drop the
+                    # ones no repository refers to any more.
+                    still_used = set(
+                        GitObject.objects.filter(sha1__in=shas).values_list('sha1', flat=True)
+                    )
+                    orphaned = [sha1 for sha1 in shas if sha1 not in still_used]
+            for sha1 in orphaned:
+                reclaimed += store.delete(sha1, older_than=cutoff.timestamp())
+            if options['pause']:
+                time.sleep(options['pause'])
+        return objects, reclaimed
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def move_bodies_to_store(apps, schema_editor):
+    from utils_app.storage import get_object_store
+
+    GitObject = apps.get_model('utils_app', 'GitObject')
+    store = get_object_store()
+    for obj in GitObject.objects.iterator(chunk_size=200):
+        raw = bytes(obj.data)
+        header, _, body = raw.partition(b'\0')
+        obj_type, size = header.decode().split(' ')
+        store.write(obj.sha1, obj_type, int(size), [body])
+        obj.size = int(size)
+        obj.save(update_fields=['size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitobject',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(move_bodies_to_store, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='gitobject',
+            name='data',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0002_gitobject_external_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommitGraphEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha1', models.CharField(max_length=40)),
+                ('tree', models.CharField(max_length=40)),
+                ('parents', models.JSONField(default=list)),
+                ('timestamp', models.BigIntegerField(default=0)),
+                ('generation', models.PositiveIntegerField()),
+                ('author', models.CharField(blank=True, max_length=255)),
+                ('summary', models.CharField(blank=True, max_length=255)),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='utils_app.repository')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['repo', 'generation'], name='utils_app_c_repo_id_a29efd_idx')],
+                'unique_together': {('repo', 'sha1')},
+            },
+        ),
+    ]
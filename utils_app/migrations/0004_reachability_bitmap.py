@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0003_commit_graph'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReachabilityBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('commit', models.CharField(max_length=40)),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('bitmap', models.BinaryField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='utils_app.repository')),
+            ],
+            options={
+                'unique_together': {('repo', 'commit')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0004_reachability_bitmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitobject',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0005_gitobject_created_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gitobject',
+            name='type',
+            field=models.CharField(choices=[('blob', 'Blob'), ('tree', 'Tree'), ('commit', 'Commit'), ('chunked', 'Chunked blob')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0006_gitobject_chunked_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.PositiveIntegerField()),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('bitmap', models.BinaryField()),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='utils_app.repository')),
+            ],
+            options={
+                'unique_together': {('repo', 'trigram')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils_app', '0007_search_trigram'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='searchtrigram',
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name='searchtrigram',
+            index=models.Index(fields=['repo', 'trigram'], name='utils_app_s_repo_id_6b0a11_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class Repository(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -6,8 +7,10 @@ class Repository(models.Model):
 class GitObject(models.Model):
     repo = models.ForeignKey(Repository, on_delete=models.CASCADE)
     sha1 = models.CharField(max_length=40, db_index=True)
-    type = models.CharField(max_length=10, choices=[('blob', 'Blob'), ('tree', 'Tree'), ('commit', 'Commit')])
-    data = models.BinaryField()
+    type = models.CharField(max_length=10, choices=[('blob', 'Blob'), ('tree', 'Tree'), ('commit', 'Commit'), ('chunked', 'Chunked blob')])
+    size = models.PositiveBigIntegerField(default=0)
+    # Refreshed whenever the object is pushed again; gc spares recent rows.
+    created_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ('repo', 'sha1')
@@ -17,3 +20,39 @@ class Reference(models.Model):
     repo = models.ForeignKey(Repository, on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     commit_hash = models.CharField(max_length=40)
+
+class CommitGraphEntry(models.Model):
+    """Precomputed commit metadata so history can be walked without parsing objects"""
+    repo = models.ForeignKey(Repository, on_delete=models.CASCADE)
+    sha1 = models.CharField(max_length=40)
+    tree = models.CharField(max_length=40)
+    parents = models.JSONField(default=list)
+    timestamp = models.BigIntegerField(default=0)
+    generation = models.PositiveIntegerField()
+    author = models.CharField(max_length=255, blank=True)
+    summary = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        unique_together = ('repo', 'sha1')
+        indexes = [models.Index(fields=['repo', 'generation'])]
+
+class ReachabilityBitmap(models.Model):
+    """Objects reachable from a ref tip, as a zlib-compressed bitmap of GitObject ids"""
+    repo = models.ForeignKey(Repository, on_delete=models.CASCADE)
+    commit = models.CharField(max_length=40)
+    offset = models.PositiveBigIntegerField(default=0)
+    bitmap = models.BinaryField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('repo', 'commit')
+
+class SearchTrigram(models.Model):
+    """Posting list delta for one lowercased byte trigram: a zlib-compressed bitmap of GitObject ids containing it; a trigram's list is the union of its rows"""
+    repo = models.ForeignKey(Repository, on_delete=models.CASCADE)
+    trigram = models.PositiveIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    bitmap = models.BinaryField()
+
+    class Meta:
+        indexes = [models.Index(fields=['repo', 'trigram'])]
@@ -0,0 +1,209 @@
+import zlib
+
+from .commit_graph import update_commit_graph
+from .helpers import get_trees, parse_manifest
+from .models import CommitGraphEntry, GitObject, Reference, ReachabilityBitmap
+from .storage import get_object_store
+
+LOOKUP_BATCH = 500
+
+
+class ObjectBitmap:
+    """A set of GitObject ids stored as bits, starting at byte ``offset``."""
+
+    __slots__ = ("offset", "bits")
+
+    def __init__(self, offset=0, bits=b""):
+        self.offset = offset
+        self.bits = bytearray(bits)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.offset, zlib.decompress(row.bitmap))
+
+    @classmethod
+    def from_ids(cls, ids):
+        bitmap = cls()
+        bitmap._cover(min(ids) >> 3, max(ids) >> 3)
+        bits, offset = bitmap.bits, bitmap.offset
+        for pk in ids:
+            bits[(pk >> 3) - offset] |= 1 << (pk & 7)
+        return bitmap
+
+    def compressed(self):
+        return zlib.compress(bytes(self.bits))
+
+    def _cover(self, first, last):
+        """Grow the byte array so bytes ``first``..``last`` are addressable."""
+        if not self.bits:
+            self.offset = first
+        if first < self.offset:
+            self.bits[:0] = bytes(self.offset - first)
+            self.offset = first
+        if last - self.offset >= len(self.bits):
+            self.bits.extend(bytes(last - self.offset + 1 - len(self.bits)))
+
+    def add(self, pk):
+        byte = pk >> 3
+        self._cover(byte, byte)
+        self.bits[byte - self.offset] |= 1 << (pk & 7)
+
+    def __contains__(self, pk):
+        index = (pk >> 3) - self.offset
+        return 0 <= index < len(self.bits) and bool(self.bits[index] & (1 << (pk & 7)))
+
+    def update(self, other):
+        if not other.bits:
+            return
+        self._cover(other.offset, other.offset + len(other.bits) - 1)
+        start = other.offset - self.offset
+        merged = int.from_bytes(self.bits[start:start + len(other.bits)], 'little')
+        merged |= int.from_bytes(other.bits, 'little')
+        self.bits[start:start + len(other.bits)] = merged.to_bytes(len(other.bits), 'little')
+
+    def __and__(self, other):
+        start = max(self.offset, other.offset)
+        end = min(self.offset + len(self.bits), other.offset + len(other.bits))
+        if start >= end:
+            return ObjectBitmap()
+        mine = int.from_bytes(self.bits[start - self.offset:end - self.offset], 'little')
+        theirs = int.from_bytes(other.bits[start - other.offset:end - other.offset], 'little')
+        return ObjectBitmap(start, (mine & theirs).to_bytes(end - start, 'little'))
+
+    def __iter__(self):
+        base = self.offset << 3
+        for index, byte in enumerate(self.bits):
+            while byte:
+                low = byte & -byte
+                yield base + (index << 3) + low.bit_length() - 1
+                byte ^= low
+
+    def __len__(self):
+        return int.from_bytes(self.bits, 'little').bit_count()
+
+
+def reachable_objects(repo, tips, depth=None, blobs=True):
+    """Return ``(shas, shallow)`` for the objects reachable from ``tips``.
+
+    With ``depth``, only commits fewer than ``depth`` parent steps from a
+    tip are followed; ``shallow`` lists the included commits whose parents
+    were cut off. With ``blobs=False`` only commits and trees are returned.
+    """
+    update_commit_graph(repo, tips)
+    objects = set()
+    shallow = []
+    trees = set()
+    level = set(tips)
+    distance = 0
+    while level and (depth is None or distance < depth):
+        entries = list(
+            CommitGraphEntry.objects.filter(repo=repo, sha1__in=list(level))
+            .only('sha1', 'tree', 'parents')
+        )
+        next_level = set()
+        for entry in entries:
+            objects.add(entry.sha1)
+            trees.add(entry.tree)
+            next_level.update(entry.parents)
+        next_level -= objects
+        distance += 1
+        if depth is not None and distance == depth:
+            shallow = [e.sha1 for e in entries if set(e.parents) & next_level]
+        level = next_level
+
+    level = trees
+    blob_shas = set()
+    while level:
+        objects.update(level)
+        next_level = set()
+        for entries in get_trees(repo, level).values():
+            for e in entries:
+                if e.sha in objects:
+                    continue
+                if e.type == "tree":
+                    next_level.add(e.sha)
+                elif blobs:
+                    blob_shas.add(e.sha)
+        level = next_level - objects
+    objects |= blob_shas
+    objects.update(_chunk_shas([sha1 for sha1, _, kind in object_ids(repo, blob_shas) if kind == 'chunked']))
+    return objects, shallow
+
+
+def _chunk_shas(manifests):
+    store = get_object_store()
+    for sha1 in manifests:
+        _, body = store.read(sha1)
+        for chunk_sha, _ in parse_manifest(body):
+            yield chunk_sha
+
+
+def object_ids(repo, shas):
+    """Yield ``(sha1, pk, type)`` for the objects among ``shas`` in ``repo``."""
+    shas = list(shas)
+    for start in range(0, len(shas), LOOKUP_BATCH):
+        yield from GitObject.objects.filter(
+            repo=repo, sha1__in=shas[start:start + LOOKUP_BATCH]
+        ).values_list('sha1', 'pk', 'type')
+
+
+def tip_bitmap(repo, tip):
+    """Return the bitmap of objects reachable from ``tip``, building it if needed.
+
+    The commit walk stops at any commit that already has a bitmap and ORs
+    it in, so after a fast-forward push only the new objects are visited.
+    """
+    row = ReachabilityBitmap.objects.filter(repo=repo, commit=tip).first()
+    if row is not None:
+        return ObjectBitmap.from_row(row)
+
+    update_commit_graph(repo, [tip])
+    bitmap = ObjectBitmap()
+    new_commits = set()
+    level = {tip}
+    while level:
+        for base in ReachabilityBitmap.objects.filter(repo=repo, commit__in=list(level)):
+            bitmap.update(ObjectBitmap.from_row(base))
+            level.discard(base.commit)
+        next_level = set()
+        for entry in CommitGraphEntry.objects.filter(repo=repo, sha1__in=list(level)).only('sha1', 'tree', 'parents'):
+            new_commits.add(entry.sha1)
+            new_commits.add(entry.tree)
+            next_level.update(entry.parents)
+        level = next_level - new_commits
+
+    level = new_commits
+    while level:
+        trees = []
+        manifests = []
+        for sha1, pk, kind in object_ids(repo, level):
+            if pk in bitmap:
+                continue
+            bitmap.add(pk)
+            if kind == 'tree':
+                trees.append(sha1)
+            elif kind == 'chunked':
+                manifests.append(sha1)
+        level = {e.sha for entries in get_trees(repo, trees).values() for e in entries}
+        level.update(_chunk_shas(manifests))
+
+    ReachabilityBitmap.objects.update_or_create(
+        repo=repo, commit=tip,
+        defaults={"offset": bitmap.offset, "bitmap": bitmap.compressed(), "count": len(bitmap)},
+    )
+    return bitmap
+
+
+def update_ref_bitmaps(repo):
+    """Make sure every ref tip has a bitmap and drop bitmaps for old tips."""
+    tips = set(Reference.objects.filter(repo=repo).values_list('commit_hash', flat=True))
+    for tip in tips:
+        tip_bitmap(repo, tip)
+    ReachabilityBitmap.objects.filter(repo=repo).exclude(commit__in=list(tips)).delete()
+
+
+def refs_bitmap(repo, tips):
+    bitmap = ObjectBitmap()
+    for tip in tips:
+        bitmap.update(tip_bitmap(repo, tip))
+    return bitmap
@@ -0,0 +1,221 @@
+import re
+import zlib
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from .cache import object_cache
+from .helpers import get_path_index, open_blob
+from .models import SearchTrigram
+from .reachability import LOOKUP_BATCH, ObjectBitmap, object_ids
+
+SEARCH_MAX_BLOB_BYTES = 1 << 20
+BINARY_PROBE_BYTES = 8000
+MAX_MATCHES_PER_FILE = 10
+# Blobs and content bytes one query may run the regex over.
+SEARCH_MAX_CANDIDATES = 2000
+SEARCH_MAX_VERIFY_BYTES = 32 << 20
+# Delta rows a queried trigram may collect before the query compacts it.
+SEARCH_MAX_DELTAS = 16
+ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+
+def trigrams(data):
+    """Return the distinct byte trigrams of ``data`` as 24-bit integers."""
+    return {(a << 16) | (b << 8) | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+
+def _indexable_text(sha1):
+    size, chunks = open_blob(sha1)
+    if size > SEARCH_MAX_BLOB_BYTES:
+        chunks.close()
+        return None
+    data = b''.join(chunks)
+    if b'\0' in data[:BINARY_PROBE_BYTES]:
+        return None
+    return data
+
+
+def index_blobs(repo, shas):
+    """Add the text blobs among ``shas`` to ``repo``'s trigram postings.
+
+    Content is lowercased (ASCII only) before indexing, so one posting list
+    serves both case-sensitive and case-insensitive queries. Each call only
+    appends one delta row per trigram; a push never reads or rewrites the
+    posting lists already stored, and compact_postings merges them later.
+    """
+    postings = defaultdict(list)
+    for sha1, pk, kind in object_ids(repo, shas):
+        if kind != 'blob':
+            continue
+        data = _indexable_text(sha1)
+        if data is None:
+            continue
+        for trigram in trigrams(data.lower()):
+            postings[trigram].append(pk)
+
+    rows = []
+    for trigram, pks in postings.items():
+        bitmap = ObjectBitmap.from_ids(pks)
+        rows.append(SearchTrigram(repo=repo, trigram=trigram, offset=bitmap.offset, bitmap=bitmap.compressed()))
+    SearchTrigram.objects.bulk_create(rows, batch_size=LOOKUP_BATCH)
+    return len(rows)
+
+
+def posting_lists(repo, grams):
+    """Return ``({trigram: bitmap}, {trigram: [row pk]})`` with each trigram's deltas merged."""
+    lists, row_ids = {}, defaultdict(list)
+    rows = SearchTrigram.objects.filter(repo=repo, trigram__in=list(grams))
+    for pk, trigram, offset, bits in rows.values_list('pk', 'trigram', 'offset', 'bitmap'):
+        bitmap = ObjectBitmap(offset, zlib.decompress(bits))
+        if trigram in lists:
+            lists[trigram].update(bitmap)
+        else:
+            lists[trigram] = bitmap
+        row_ids[trigram].append(pk)
+    return lists, row_ids
+
+
+def compact_postings(repo, grams=None):
+    """Merge each trigram's delta rows into one; return how many trigrams were compacted.
+
+    Only the rows read are replaced, so deltas a concurrent push appends
+    meanwhile survive to the next compaction.
+    """
+    if grams is None:
+        grams = (SearchTrigram.objects.filter(repo=repo).values('trigram')
+                 .annotate(rows=Count('pk')).filter(rows__gt=1).values_list('trigram', flat=True))
+    grams = list(grams)
+    compacted = 0
+    for start in range(0, len(grams), LOOKUP_BATCH):
+        lists, row_ids = posting_lists(repo, grams[start:start + LOOKUP_BATCH])
+        merged = [trigram for trigram, ids in row_ids.items() if len(ids) > 1]
+        with transaction.atomic():
+            SearchTrigram.objects.filter(pk__in=[pk for trigram in merged for pk in row_ids[trigram]]).delete()
+            SearchTrigram.objects.bulk_create(
+                SearchTrigram(repo=repo, trigram=trigram, offset=lists[trigram].offset,
+                              bitmap=lists[trigram].compressed())
+                for trigram in merged
+            )
+        compacted += len(merged)
+    return compacted
+
+
+def required_literals(parsed):
+    """Return the literal strings every match of a parsed pattern contains."""
+    literals = []
+    run = []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if run:
+            literals.append(''.join(run))
+            run = []
+        if op is sre_parse.SUBPATTERN:
+            literals.extend(required_literals(av[-1]))
+        elif op is ATOMIC_GROUP:
+            literals.extend(required_literals(av))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            literals.extend(required_literals(av[2]))
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def query_trigrams(rx):
+    grams = set()
+    for literal in required_literals(sre_parse.parse(rx.pattern, rx.flags)):
+        data = literal.encode().lower()
+        if rx.flags & re.IGNORECASE:
+            # Only ASCII is folded at index time.
+            grams.update(t for t in trigrams(data) if not t & 0x808080)
+        else:
+            grams.update(trigrams(data))
+    return grams
+
+
+def search_scope(repo, tree_sha):
+    """Return a memoized ``{pk: (sha, paths)}`` map of the blobs under a root tree."""
+    key = ('search', repo.pk, tree_sha)
+    scope = object_cache.get(key)
+    if scope is None:
+        paths = {}
+        for path, (kind, sha1) in get_path_index(repo, tree_sha).items():
+            if kind == 'blob':
+                paths.setdefault(sha1, []).append(path)
+        scope = {pk: (sha1, paths[sha1]) for sha1, pk, _ in object_ids(repo, paths)}
+        object_cache.set(key, scope, 200 * len(scope))
+    return scope
+
+
+def _matching_lines(rx, text):
+    matches = []
+    line_no, line_start = 1, 0
+    for m in rx.finditer(text):
+        if m.start() < line_start:
+            continue
+        line_no += text.count('\n', line_start, m.start())
+        line_start = text.rfind('\n', 0, m.start()) + 1
+        line_end = text.find('\n', m.start())
+        if line_end == -1:
+            line_end = len(text)
+        matches.append({"line": line_no, "text": text[line_start:line_end]})
+        if len(matches) >= MAX_MATCHES_PER_FILE:
+            break
+        # Report each line once, however many matches it has.
+        line_no += 1
+        line_start = line_end + 1
+    return matches
+
+
+def search_tree(repo, tree_sha, rx, limit):
+    """Return ``(results, truncated)`` for blobs under ``tree_sha`` matching ``rx``.
+
+    Candidates are the blobs whose posting lists contain every trigram of
+    the pattern's required literals; each is then checked with ``rx``.
+    Verification stops, and the results are reported truncated, after
+    SEARCH_MAX_CANDIDATES blobs or SEARCH_MAX_VERIFY_BYTES of content, so a
+    query whose literals are common cannot read the whole tree.
+    """
+    grams = sorted(query_trigrams(rx))[:LOOKUP_BATCH]
+    if not grams:
+        raise ValueError("query must contain a literal of at least 3 characters")
+    lists, row_ids = posting_lists(repo, grams)
+    if len(lists) < len(grams):
+        return [], False
+    # Trigrams a burst of pushes left scattered over many deltas are merged
+    # as queries touch them, so hot posting lists stay one row each.
+    scattered = [trigram for trigram, ids in row_ids.items() if len(ids) > SEARCH_MAX_DELTAS]
+    if scattered:
+        compact_postings(repo, scattered)
+    ordered = sorted(lists.values(), key=len)
+    candidates = ordered[0]
+    for bitmap in ordered[1:]:
+        candidates = candidates & bitmap
+
+    scope = search_scope(repo, tree_sha)
+    hits = sorted((min(scope[pk][1]), pk) for pk in candidates if pk in scope)
+    results = []
+    verified = 0
+    for checked, (_, pk) in enumerate(hits):
+        if checked >= SEARCH_MAX_CANDIDATES:
+            return results, True
+        sha1, paths = scope[pk]
+        size, chunks = open_blob(sha1)
+        verified += size
+        if verified > SEARCH_MAX_VERIFY_BYTES:
+            chunks.close()
+            return results, True
+        matches = _matching_lines(rx, b''.join(chunks).decode(errors='replace'))
+        for path in sorted(paths) if matches else ():
+            if len(results) >= limit:
+                return results, True
+            results.append({"path": path, "sha": sha1, "matches": matches})
+    return results, False
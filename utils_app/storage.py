@@ -0,0 +1,124 @@
+import hashlib
+import os
+import tempfile
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+CHUNK_SIZE = 1 << 16
+
+
+class ObjectStore:
+    """Content-addressed storage for object bodies, keyed by SHA-1.
+
+    Objects are shared by every repository, so identical objects pushed to
+    different repositories are stored once.
+    """
+
+    def exists(self, sha1: str) -> bool:
+        raise NotImplementedError
+
+    def write(self, sha1: str, obj_type: str, size: int, chunks) -> None:
+        raise NotImplementedError
+
+    def open(self, sha1: str):
+        """Return ``(type, size, body_chunks)`` for a stored object."""
+        raise NotImplementedError
+
+    def delete(self, sha1: str, older_than: float = None) -> int:
+        """Remove an object, unless it was written after ``older_than``.
+
+        Returns the number of bytes reclaimed.
+        """
+        raise NotImplementedError
+
+    def read(self, sha1: str):
+        obj_type, _, chunks = self.open(sha1)
+        return obj_type, b''.join(chunks)
+
+
+class FileSystemObjectStore(ObjectStore):
+    """Zlib-compressed loose objects in a directory sharded by SHA prefix."""
+
+    def __init__(self, root=None):
+        self.root = str(root or settings.PYGIT_OBJECTS_ROOT)
+
+    def path(self, sha1):
+        return os.path.join(self.root, sha1[:2], sha1[2:])
+
+    def exists(self, sha1):
+        return os.path.exists(self.path(sha1))
+
+    def write(self, sha1, obj_type, size, chunks):
+        if self.exists(sha1):
+            for _ in chunks:
+                pass
+            # Rewriting an object counts as a fresh write for gc.
+            os.utime(self.path(sha1))
+            return
+        os.makedirs(self.root, exist_ok=True)
+        header = f"{obj_type} {size}\0".encode()
+        digest = hashlib.sha1(header)
+        compressor = zlib.compressobj()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='tmp_obj_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressor.compress(header))
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+            if digest.hexdigest() != sha1:
+                raise ValueError(f"Object {sha1} does not match its content")
+            os.makedirs(os.path.dirname(self.path(sha1)), exist_ok=True)
+            os.replace(tmp_path, self.path(sha1))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _inflate(self, path):
+        with open(path, 'rb') as f:
+            decompressor = zlib.decompressobj()
+            data = f.read(CHUNK_SIZE)
+            while data:
+                chunk = decompressor.decompress(data, CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                data = decompressor.unconsumed_tail or f.read(CHUNK_SIZE)
+
+    def open(self, sha1):
+        try:
+            chunks = self._inflate(self.path(sha1))
+            first = next(chunks)
+        except (FileNotFoundError, StopIteration):
+            raise KeyError(sha1)
+        while b'\0' not in first:
+            first += next(chunks)
+        header, _, rest = first.partition(b'\0')
+        obj_type, size = header.decode().split(' ')
+
+        def body():
+            if rest:
+                yield rest
+            yield from chunks
+
+        return obj_type, int(size), body()
+
+    def delete(self, sha1, older_than=None):
+        path = self.path(sha1)
+        try:
+            st = os.stat(path)
+            if older_than is not None and st.st_mtime >= older_than:
+                return 0
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return st.st_size
+
+
+@lru_cache(maxsize=None)
+def get_object_store() -> ObjectStore:
+    return import_string(settings.PYGIT_OBJECT_STORE)()
@@ -1,3 +1,1506 @@
-from django.test import TestCase
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core.management import call_command
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, override_settings
+
+import py_git
+from linediff import myers_diff, unified_diff
+
+from . import reachability, search
+from .cache import ObjectCache, object_cache
+from .helpers import get_commit, get_path_index, get_tree, ingest_objects, open_blob, parse_tree, resolve_path
+from .history import blame, last_commits
+from .models import CommitGraphEntry, GitObject, ReachabilityBitmap, Reference, Repository, SearchTrigram
+from .storage import get_object_store
+from .transfer import STREAM_CONTENT_TYPE, STREAM_MAGIC, STREAM_ZLIB, StreamReader, encode_objects
+
+SMALL_CHUNKS = {"threshold": 64 << 10, "min_size": 4 << 10, "avg_size": 16 << 10, "max_size": 64 << 10}
+
+
+def raw_object(obj_type, body):
+    """Return ``(sha1, obj_type, body)`` for an object with the given body."""
+    return hashlib.sha1(f"{obj_type} {len(body)}\0".encode() + body).hexdigest(), obj_type, body
+
+
+def build_tree(files, objects):
+    """Add blobs and git binary trees for ``{path: bytes}`` to ``objects``; return the root tree SHA.
+
+    A ``str`` value is taken as the SHA of a file object added separately.
+    """
+    nested = {}
+    for path, data in files.items():
+        *dirs, name = path.split("/")
+        node = nested
+        for part in dirs:
+            node = node.setdefault(part, {})
+        node[name] = data
+
+    def write(node):
+        items = []
+        for name, value in node.items():
+            if isinstance(value, dict):
+                items.append((b"40000", name + "/", name, write(value)))
+            elif isinstance(value, str):
+                items.append((b"100644", name, name, value))
+            else:
+                sha1, obj_type, body = raw_object("blob", value)
+                objects[sha1] = (obj_type, body)
+                items.append((b"100644", name, name, sha1))
+        body = b"".join(mode + b" " + name.encode() + b"\0" + bytes.fromhex(sha1)
+                        for mode, _, name, sha1 in sorted(items, key=lambda item: item[1]))
+        sha1, obj_type, body = raw_object("tree", body)
+        objects[sha1] = (obj_type, body)
+        return sha1
+
+    return write(nested)
+
+
+class ServerRepoMixin:
+    """Pushes commits built from file contents through the push endpoint into a temporary store."""
+
+    def setUp(self):
+        super().setUp()
+        server_objects = tempfile.TemporaryDirectory()
+        self.addCleanup(server_objects.cleanup)
+        settings = override_settings(PYGIT_OBJECTS_ROOT=server_objects.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_object_store.cache_clear()
+        self.addCleanup(get_object_store.cache_clear)
+        # Cache keys use repo primary keys, which the test database reuses.
+        object_cache.clear()
+        self.addCleanup(object_cache.clear)
+
+    def push_stream(self, repo_name, objects, **params):
+        body = b"".join(encode_objects(
+            (sha1, obj_type, len(data), [data]) for sha1, (obj_type, data) in objects.items()))
+        query = "&".join(f"{key}={value}" for key, value in params.items())
+        return self.client.post(f"/api/git/{repo_name}/push?{query}", body, content_type=STREAM_CONTENT_TYPE)
+
+    def make_commit(self, repo_name, files, parents=(), message="change", timestamp=1700000000, extra=None):
+        """Push a commit of ``{path: bytes}`` and move refs/heads/main to it; return its SHA.
+
+        ``extra`` maps SHAs to ``(type, body)`` for further objects to send along.
+        """
+        objects = dict(extra or {})
+        tree = build_tree(files, objects)
+        body = (f"tree {tree}\n" + "".join(f"parent {p}\n" for p in parents)
+                + f"author User <user@example.com> {timestamp}\n\n{message}").encode()
+        sha1, obj_type, body = raw_object("commit", body)
+        objects[sha1] = (obj_type, body)
+        resp = self.push_stream(repo_name, objects, head=sha1)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return sha1
+
+
+class RawBlobTests(ServerRepoMixin, TestCase):
+    def test_active_content_is_served_as_inert_text(self):
+        commit = self.make_commit("demo", {
+            "page.html": b"<script>alert(1)</script>",
+            "logo.svg": b"<svg onload='alert(1)'/>",
+            "photo.png": b"\x89PNG\r\n",
+            "tool.bin": b"\0\1\2",
+        })
+        expected = {
+            "page.html": "text/plain; charset=utf-8",
+            "logo.svg": "text/plain; charset=utf-8",
+            "photo.png": "image/png",
+            "tool.bin": "application/octet-stream",
+        }
+        for path, content_type in expected.items():
+            with self.subTest(path=path):
+                resp = self.client.get(f"/api/git/demo/raw/{commit}/{path}")
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp["Content-Type"], content_type)
+                self.assertEqual(resp["X-Content-Type-Options"], "nosniff")
+                self.assertIn("sandbox", resp["Content-Security-Policy"])
+
+
+class ReachabilityTests(ServerRepoMixin, TestCase):
+    def cloned_shas(self, repo_name, **params):
+        resp = self.client.get(f"/api/git/{repo_name}/clone", params)
+        self.assertEqual(resp.status_code, 200)
+        reader = StreamReader(io.BytesIO(b"".join(resp.streaming_content)).read)
+        shas = []
+        for sha1, chunks in reader.objects():
+            b"".join(chunks)
+            shas.append(sha1)
+        return shas
+
+    def bitmap_shas(self, repo, bitmap):
+        ids = set(bitmap)
+        return set(GitObject.objects.filter(repo=repo, pk__in=ids).values_list("sha1", flat=True))
+
+    def test_clone_skips_objects_left_by_overwritten_pushes(self):
+        self.make_commit("bitmaps", {"old.txt": b"overwritten\n"})
+        head = self.make_commit("bitmaps", {"new.txt": b"current\n"}, message="force")
+        expected = {head, build_tree({"new.txt": b"current\n"}, {}), raw_object("blob", b"current\n")[0]}
+        cloned = self.cloned_shas("bitmaps")
+        self.assertEqual(cloned, sorted(expected))
+        self.assertEqual(GitObject.objects.filter(repo__name="bitmaps").count(), 6)
+
+    def test_bitmap_built_on_a_parent_bitmap_matches_a_full_walk(self):
+        files = {"lib/util.txt": b"shared\n", "main.txt": b"v1\n"}
+        parent = self.make_commit("bitmaps", files)
+        head = self.make_commit("bitmaps", dict(files, **{"main.txt": b"v2\n"}), parents=[parent])
+        repo = Repository.objects.get(name="bitmaps")
+        ReachabilityBitmap.objects.all().delete()
+        reachability.tip_bitmap(repo, parent)
+
+        listed = []
+        get_trees = reachability.get_trees
+
+        def record(repo, shas):
+            listed.extend(shas)
+            return get_trees(repo, shas)
+
+        with mock.patch.object(reachability, "get_trees", record):
+            reused = reachability.tip_bitmap(repo, head)
+        # The unchanged subtree is already in the parent's bitmap and is not listed again.
+        self.assertNotIn(build_tree({"util.txt": b"shared\n"}, {}), listed)
+
+        ReachabilityBitmap.objects.all().delete()
+        fresh = reachability.tip_bitmap(repo, head)
+        walked, _ = reachability.reachable_objects(repo, [head])
+        self.assertEqual(set(reused), set(fresh))
+        self.assertEqual(self.bitmap_shas(repo, reused), walked)
+
+    def test_bitmaps_follow_the_ref_tips(self):
+        first = self.make_commit("bitmaps", {"a.txt": b"a\n"})
+        topic = self.make_commit("bitmaps", {"b.txt": b"b\n"}, parents=[first], message="topic")
+        self.assertEqual(self.push_stream("bitmaps", {}, head=topic, ref="refs/heads/topic").status_code, 200)
+        head = self.make_commit("bitmaps", {"a.txt": b"a2\n"}, parents=[first], message="second")
+        repo = Repository.objects.get(name="bitmaps")
+
+        def tips():
+            return set(ReachabilityBitmap.objects.filter(repo=repo).values_list("commit", flat=True))
+
+        self.assertEqual(tips(), {head, topic})
+        Reference.objects.filter(repo=repo, name="refs/heads/topic").delete()
+        reachability.update_ref_bitmaps(repo)
+        self.assertEqual(tips(), {head})
+
+
+class GcObjectsTests(ServerRepoMixin, TestCase):
+    def collect(self, grace_hours=0, **options):
+        call_command("gc_objects", grace_hours=grace_hours, stdout=io.StringIO(), **options)
+
+    def shas(self, repo_name):
+        return set(GitObject.objects.filter(repo__name=repo_name).values_list("sha1", flat=True))
+
+    def commit_objects(self, repo_name, files, **kwargs):
+        """Push a commit like ``make_commit``; return its SHA and every object it sent."""
+        objects = dict(kwargs.pop("extra", {}))
+        before = self.shas(repo_name)
+        head = self.make_commit(repo_name, files, extra=objects, **kwargs)
+        return head, self.shas(repo_name) - before | set(objects)
+
+    def test_unreachable_objects_are_collected_and_reachable_ones_kept(self):
+        store = get_object_store()
+        _, dropped = self.commit_objects("gc", {"a.txt": b"one\n"})
+        parts = [raw_object("blob", data) for data in (b"part one\n", b"part two\n")]
+        manifest = raw_object("chunked", "".join(f"{sha1} {len(body)}\n" for sha1, _, body in parts).encode())
+        extra = {sha1: (obj_type, body) for sha1, obj_type, body in parts + [manifest]}
+        _, kept = self.commit_objects("gc", {"a.txt": b"two\n", "big.bin": manifest[0]}, extra=extra)
+
+        self.collect()
+        self.assertEqual(self.shas("gc"), kept)
+        for sha1 in kept:
+            self.assertTrue(store.exists(sha1))
+        for sha1 in dropped:
+            self.assertFalse(store.exists(sha1))
+
+    def test_objects_inside_the_grace_period_survive(self):
+        self.make_commit("gc", {"a.txt": b"one\n"})
+        self.make_commit("gc", {"a.txt": b"two\n"})
+        before = self.shas("gc")
+        self.collect(grace_hours=1)
+        self.assertEqual(self.shas("gc"), before)
+
+    def test_shared_bodies_stay_while_any_repo_refers_to_them(self):
+        store = get_object_store()
+        shared = raw_object("blob", b"shared\n")[0]
+        self.make_commit("one", {"s.txt": b"shared\n"})
+        self.make_commit("two", {"s.txt": b"shared\n"})
+        self.make_commit("one", {"other.txt": b"one\n"})
+        self.collect()
+        self.assertNotIn(shared, self.shas("one"))
+        self.assertIn(shared, self.shas("two"))
+        self.assertTrue(store.exists(shared))
+
+        self.make_commit("two", {"other.txt": b"two\n"})
+        self.collect()
+        self.assertFalse(store.exists(shared))
+
+    def test_push_landing_mid_run_is_honoured(self):
+        base = self.make_commit("gc", {"base.txt": b"base\n"})
+        abandoned, revived = self.commit_objects(
+            "gc", {"base.txt": b"base\n", "a.txt": b"abandoned\n"}, parents=[base])
+        self.make_commit("gc", {"base.txt": b"base\n", "b.txt": b"current\n"}, parents=[base])
+        pushes = []
+
+        def push_between_batches(seconds):
+            if not pushes:
+                pushes.append(self.make_commit(
+                    "gc", {"base.txt": b"base\n", "a.txt": b"abandoned\n", "c.txt": b"new\n"},
+                    parents=[abandoned], message="revive"))
+
+        with mock.patch("utils_app.management.commands.gc_objects.time.sleep", push_between_batches):
+            self.collect(batch_size=1, pause=1)
+        self.assertEqual(len(pushes), 1)
+        self.assertLessEqual(revived, self.shas("gc"))
+        for sha1 in revived:
+            self.assertTrue(get_object_store().exists(sha1))
+
+
+class IngestTests(ServerRepoMixin, TestCase):
+    def raw_stream(self, bodies):
+        for body in bodies:
+            sha1, obj_type, body = raw_object("blob", body)
+            yield sha1, [b"%s %d\0" % (obj_type.encode(), len(body)), body]
+
+    def test_duplicates_are_stored_once(self):
+        repo = Repository.objects.create(name="ingest")
+        ingest_objects(repo, self.raw_stream([b"a"]))
+        bodies = [b"a", b"b", b"b", b"c", b"d"]
+        created = ingest_objects(repo, self.raw_stream(bodies), batch_size=2)
+        self.assertEqual([obj.sha1 for obj in created], [raw_object("blob", body)[0] for body in (b"b", b"c", b"d")])
+        self.assertEqual(GitObject.objects.filter(repo=repo).count(), 4)
+        for body in (b"a", b"b", b"c", b"d"):
+            self.assertEqual(get_object_store().read(raw_object("blob", body)[0]), ("blob", body))
+
+    def test_a_batch_costs_a_fixed_number_of_queries(self):
+        repo = Repository.objects.create(name="ingest")
+        with self.assertNumQueries(2):
+            created = ingest_objects(repo, self.raw_stream([b"%d" % i for i in range(100)]), batch_size=500)
+        self.assertEqual(len(created), 100)
+
+
+class ObjectStoreTests(ServerRepoMixin, TestCase):
+    def stored_files(self):
+        root = get_object_store().root
+        return sorted(os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "")
+                      for dirpath, _, names in os.walk(root) for name in names)
+
+    def test_identical_objects_in_two_repos_are_stored_once(self):
+        one = self.make_commit("one", {"shared.txt": b"same bytes\n"})
+        two = self.make_commit("two", {"shared.txt": b"same bytes\n"}, message="other")
+        shared = raw_object("blob", b"same bytes\n")[0]
+        tree = build_tree({"shared.txt": b"same bytes\n"}, {})
+        self.assertEqual(self.stored_files(), sorted([shared, tree, one, two]))
+        self.assertEqual(GitObject.objects.filter(sha1=shared).count(), 2)
+        self.assertEqual(GitObject.objects.get(repo__name="two", sha1=shared).size, len(b"same bytes\n"))
+        self.assertEqual(get_object_store().read(shared), ("blob", b"same bytes\n"))
+
+    def test_bodies_that_do_not_match_their_sha_are_refused(self):
+        store = get_object_store()
+        sha1 = raw_object("blob", b"expected\n")[0]
+        with self.assertRaises(ValueError):
+            store.write(sha1, "blob", 9, [b"tampered\n"])
+        self.assertFalse(store.exists(sha1))
+        self.assertEqual(self.stored_files(), [])
+
+
+class ObjectCacheTests(SimpleTestCase):
+    def test_least_recently_used_entries_are_evicted_by_size(self):
+        cache = ObjectCache(100)
+        cache.set("a", "A", 40)
+        cache.set("b", "B", 40)
+        self.assertEqual(cache.get("a"), "A")
+        cache.set("c", "C", 40)
+        cache.set("huge", "H", 101)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNone(cache.get("huge"))
+        self.assertEqual((cache.get("a"), cache.get("c")), ("A", "C"))
+        self.assertEqual(cache.stats(), {
+            "entries": 2, "bytes": 80, "max_bytes": 100, "hits": 3, "shared_hits": 0, "misses": 2,
+        })
+
+    @override_settings(CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "objects": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "objects"},
+    })
+    def test_shared_tier_fills_other_workers(self):
+        first, second = ObjectCache(100, "objects"), ObjectCache(100, "objects")
+        first.set(("tree", 1, "abc"), ["entry"], 10)
+        self.assertEqual(second.get(("tree", 1, "abc")), ["entry"])
+        self.assertEqual(second.get(("tree", 1, "abc")), ["entry"])
+        self.assertEqual((second.shared_hits, second.hits, second.misses), (1, 1, 0))
+
+
+class ParsedObjectCacheTests(ServerRepoMixin, TestCase):
+    def test_parsed_trees_and_commits_are_served_from_the_cache(self):
+        head = self.make_commit("cached", {"a.txt": b"a\n"})
+        repo = Repository.objects.get(name="cached")
+        commit = get_commit(repo, head)
+        tree = get_tree(repo, commit["tree"])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_commit(repo, head), commit)
+            self.assertIs(get_tree(repo, commit["tree"]), tree)
+            self.assertEqual(self.client.get("/api/git/_stats/cache").json()["entries"], 2)
+
+
+class CommitGraphTests(ServerRepoMixin, TestCase):
+    def test_generations_count_the_longest_parent_chain(self):
+        root = self.make_commit("graph", {"a.txt": b"1\n"})
+        main = self.make_commit("graph", {"a.txt": b"2\n"}, parents=[root])
+        side = self.make_commit("graph", {"b.txt": b"1\n"}, parents=[root])
+        merged = {"a.txt": b"2\n", "b.txt": b"1\n"}
+        merge = self.make_commit("graph", merged, parents=[main, side])
+        generations = dict(CommitGraphEntry.objects.filter(repo__name="graph").values_list("sha1", "generation"))
+        self.assertEqual(generations, {root: 1, main: 2, side: 2, merge: 3})
+        entry = CommitGraphEntry.objects.get(sha1=merge)
+        self.assertEqual((entry.parents, entry.tree, entry.timestamp), ([main, side], build_tree(merged, {}), 1700000000))
+
+    def test_history_pages_follow_first_parents(self):
+        shas = []
+        for i in range(5):
+            shas.append(self.make_commit(
+                "graph", {"a.txt": b"%d\n" % i}, parents=shas[-1:], message=f"change {i}", timestamp=1700000000 + i))
+        newest_first = shas[::-1]
+        with mock.patch("utils_app.views.COMMITS_PER_PAGE", 2):
+            pages = []
+            start = ""
+            while start is not None:
+                resp = self.client.get("/api/git/graph/commits/", {"from": start} if start else {})
+                pages.append([commit["sha"] for commit in resp.context["commits"]])
+                start = resp.context["next_sha"]
+        self.assertEqual(pages, [newest_first[0:2], newest_first[2:4], newest_first[4:]])
+        self.assertEqual(resp.context["commits"][0]["message"], "change 0")
+
+
+class PathIndexTests(ServerRepoMixin, TestCase):
+    FILES = {"README": b"top\n", "src/app/main.py": b"print()\n", "src/app/util.py": b"pass\n", "src/lib.py": b"x = 1\n"}
+
+    def test_index_maps_every_path_and_is_memoized(self):
+        head = self.make_commit("paths", self.FILES)
+        repo = Repository.objects.get(name="paths")
+        tree = get_commit(repo, head)["tree"]
+        index = get_path_index(repo, tree)
+        self.assertEqual(sorted(index), ["", "README", "src", "src/app", "src/app/main.py", "src/app/util.py", "src/lib.py"])
+        self.assertEqual(index["src/app"], ("tree", build_tree({"main.py": b"print()\n", "util.py": b"pass\n"}, {})))
+        self.assertEqual(index["src/lib.py"], ("blob", raw_object("blob", b"x = 1\n")[0]))
+        for path, entry in index.items():
+            self.assertEqual(resolve_path(repo, tree, path), entry)
+        self.assertIsNone(resolve_path(repo, tree, "src/missing.py"))
+        self.assertIsNone(resolve_path(repo, tree, "README/inside"))
+        with self.assertNumQueries(0):
+            self.assertIs(get_path_index(repo, tree), index)
+
+    def test_views_resolve_deep_paths(self):
+        head = self.make_commit("paths", self.FILES)
+        self.assertContains(self.client.get(f"/api/git/paths/tree/{head}/src/app/"), "main.py")
+        self.assertContains(self.client.get(f"/api/git/paths/blob/{head}/src/app/util.py/"), "pass")
+        self.assertEqual(self.client.get(f"/api/git/paths/tree/{head}/src/lib.py/").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/git/paths/blob/{head}/src/app/").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/git/paths/blob/{head}/src/nope.py/").status_code, 404)
+
+    def test_views_answer_from_the_memoized_index(self):
+        head = self.make_commit("paths", self.FILES)
+        repo = Repository.objects.get(name="paths")
+        self.client.get(f"/api/git/paths/blob/{head}/README/")
+        self.assertIsNotNone(object_cache.get(("paths", repo.pk, get_commit(repo, head)["tree"])))
+        with mock.patch("utils_app.helpers.get_tree", side_effect=AssertionError("walked the tree")):
+            self.assertContains(self.client.get(f"/api/git/paths/blob/{head}/src/app/main.py/"), "print()")
+
+
+class SearchTests(ServerRepoMixin, TestCase):
+    FILES = {
+        "src/app.py": b"def main():\n    print('Hello')\n",
+        "src/util.py": b"def helper():\n    return 42\n",
+        "README": b"Hello world\nsee main\n",
+    }
+
+    def literals(self, pattern):
+        return search.required_literals(search.sre_parse.parse(pattern))
+
+    def test_required_literals(self):
+        self.assertEqual(self.literals("foo.*bar"), ["foo", "bar"])
+        self.assertEqual(self.literals(r"def\s+main\("), ["def", "main("])
+        self.assertEqual(self.literals("(abc)+x?"), ["abc"])
+        # Optional repeats and alternations require nothing.
+        self.assertEqual(self.literals("x{0,3}abcd"), ["abcd"])
+        self.assertEqual(self.literals("a|bcd"), [])
+
+    def test_query_trigrams(self):
+        self.assertEqual(search.query_trigrams(re.compile("foo.*bar")),
+                         search.trigrams(b"foo") | search.trigrams(b"bar"))
+        self.assertEqual(search.query_trigrams(re.compile("AbCd", re.IGNORECASE)), search.trigrams(b"abcd"))
+        # Non-ASCII is not case-folded in the index, so it cannot narrow a case-insensitive query.
+        self.assertEqual(search.query_trigrams(re.compile("\u00c4bc", re.IGNORECASE)), set())
+        self.assertEqual(search.query_trigrams(re.compile("ab")), set())
+
+    def test_search_finds_matching_lines(self):
+        self.make_commit("find", self.FILES)
+        resp = self.client.get("/api/git/find/search", {"q": "hello"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["results"], [])
+        resp = self.client.get("/api/git/find/search", {"q": "hello", "i": "1"})
+        self.assertEqual([(r["path"], r["matches"]) for r in resp.json()["results"]], [
+            ("README", [{"line": 1, "text": "Hello world"}]),
+            ("src/app.py", [{"line": 2, "text": "    print('Hello')"}]),
+        ])
+        resp = self.client.get("/api/git/find/search", {"q": r"def \w+\(\):", "regex": "1"})
+        self.assertEqual(sorted(r["path"] for r in resp.json()["results"]), ["src/app.py", "src/util.py"])
+
+    def search_paths(self, repo_name, query):
+        resp = self.client.get(f"/api/git/{repo_name}/search", {"q": query})
+        self.assertEqual(resp.status_code, 200)
+        return [r["path"] for r in resp.json()["results"]], resp.json()["truncated"]
+
+    def test_pushes_append_posting_deltas(self):
+        head = self.make_commit("find", self.FILES)
+        repo = Repository.objects.get(name="find")
+        first = set(SearchTrigram.objects.filter(repo=repo).values_list("pk", flat=True))
+        self.make_commit("find", {**self.FILES, "src/new.py": b"def main2():\n"}, [head])
+        rows = SearchTrigram.objects.filter(repo=repo)
+        self.assertLessEqual(first, set(rows.values_list("pk", flat=True)))
+        self.assertEqual(rows.filter(trigram__in=search.trigrams(b"def")).count(), 2)
+        self.assertEqual(self.search_paths("find", "def main"), (["src/app.py", "src/new.py"], False))
+
+        self.assertGreater(search.compact_postings(repo), 0)
+        self.assertEqual(search.compact_postings(repo), 0)
+        self.assertEqual(rows.count(), rows.values("trigram").distinct().count())
+        self.assertEqual(self.search_paths("find", "def main"), (["src/app.py", "src/new.py"], False))
+
+        self.make_commit("find", {"late.py": b"def main3():\n"})
+        call_command("build_search_index", "--compact", stdout=io.StringIO())
+        self.assertEqual(rows.count(), rows.values("trigram").distinct().count())
+
+    def test_queries_compact_scattered_trigrams(self):
+        head = self.make_commit("find", self.FILES)
+        self.make_commit("find", {**self.FILES, "src/new.py": b"def main2():\n"}, [head])
+        repo = Repository.objects.get(name="find")
+        grams = search.trigrams(b"main")
+        with mock.patch.object(search, "SEARCH_MAX_DELTAS", 1):
+            self.search_paths("find", "main")
+        self.assertEqual(SearchTrigram.objects.filter(repo=repo, trigram__in=grams).count(), len(grams))
+
+    def test_verification_is_capped(self):
+        self.make_commit("find", {f"f{i}.txt": f"needle {i}\n".encode() for i in range(5)})
+        self.assertEqual(self.search_paths("find", "needle"), ([f"f{i}.txt" for i in range(5)], False))
+        with mock.patch.object(search, "SEARCH_MAX_CANDIDATES", 2):
+            self.assertEqual(self.search_paths("find", "needle"), (["f0.txt", "f1.txt"], True))
+        # Each file is 9 bytes.
+        with mock.patch.object(search, "SEARCH_MAX_VERIFY_BYTES", 27):
+            self.assertEqual(self.search_paths("find", "needle"), (["f0.txt", "f1.txt", "f2.txt"], True))
+        with mock.patch("utils_app.search.open_blob", wraps=open_blob) as opened, \
+                mock.patch.object(search, "SEARCH_MAX_CANDIDATES", 1):
+            self.search_paths("find", "needle")
+        self.assertEqual(opened.call_count, 1)
+
+    def test_queries_without_a_trigram_are_rejected(self):
+        self.make_commit("find", self.FILES)
+        for params in ({"q": "de"}, {"q": ""}, {"q": "a|bcd", "regex": "1"}, {"q": ".*", "regex": "1"},
+                       {"q": "(unclosed", "regex": "1"}):
+            with self.subTest(params=params):
+                resp = self.client.get("/api/git/find/search", params)
+                self.assertEqual(resp.status_code, 400)
+                self.assertIn("error", resp.json())
+
+
+class HistoryTests(ServerRepoMixin, TestCase):
+    """Blame and last-commit over a side branch and a merge that also adds a file."""
+
+    def setUp(self):
+        super().setUp()
+        files = {"a.txt": b"one\ntwo\nthree\n", "src/x.py": b"x\n", "src/y.py": b"y\n", "docs/r": b"r\n"}
+        self.base = self.make_commit("hist", files, timestamp=1700000000)
+        files.update({"a.txt": b"one\nTWO\nthree\n", "src/y.py": b"y2\n"})
+        self.main = self.make_commit("hist", files, [self.base], timestamp=1700000100)
+        side = {**files, "a.txt": b"one\ntwo\nthree\nfour\n", "src/y.py": b"y\n"}
+        self.side = self.make_commit("hist", side, [self.base], timestamp=1700000200)
+        files.update({"a.txt": b"one\nTWO\nthree\nfour\n", "src/z.py": b"z\n"})
+        self.merge = self.make_commit("hist", files, [self.main, self.side], timestamp=1700000300)
+        files["docs/r"] = b"r2\n"
+        self.head = self.make_commit("hist", files, [self.merge], timestamp=1700000400)
+        self.repo = Repository.objects.get(name="hist")
+
+    def test_blame_follows_lines_through_the_merge(self):
+        lines = blame(self.repo, self.head, "a.txt")
+        self.assertEqual([(origin["sha"], line) for origin, line in lines], [
+            (self.base, "one"), (self.main, "TWO"), (self.base, "three"), (self.side, "four"),
+        ])
+        self.assertIsNone(blame(self.repo, self.head, "missing.txt"))
+
+    def test_last_commits(self):
+        def shas(path):
+            return {name: info["sha"] for name, info in last_commits(self.repo, self.head, path).items()}
+
+        self.assertEqual(shas("src"), {"x.py": self.base, "y.py": self.main, "z.py": self.merge})
+        self.assertEqual(shas(""), {"a.txt": self.merge, "src": self.merge, "docs": self.head})
+        self.assertEqual(shas("docs/"), {"r": self.head})
+        # The side branch's own tip sees its own history only.
+        self.assertEqual(last_commits(self.repo, self.side, "src")["y.py"]["sha"], self.base)
+
+    def test_views(self):
+        resp = self.client.get(f"/api/git/hist/blame/{self.head}/a.txt/")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([row["commit"] and row["commit"]["sha"] for row in resp.context["rows"]],
+                         [self.base, self.main, self.base, self.side])
+        resp = self.client.get(f"/api/git/hist/tree/{self.head}/src/")
+        self.assertEqual({entry.name: last["sha"] for entry, last in resp.context["entries"]},
+                         {"x.py": self.base, "y.py": self.main, "z.py": self.merge})
+
+
+class ArchiveTests(ServerRepoMixin, TestCase):
+    FILES = {"README": b"hello\n", "src/main.py": b"print()\n", "src/big.bin": bytes(range(256)) * 64}
+
+    def download(self, url, **headers):
+        resp = self.client.get(url, headers=headers)
+        return resp, b"".join(resp.streaming_content) if resp.status_code == 200 else b""
+
+    def test_archives_depend_only_on_the_tree(self):
+        head = self.make_commit("arch", self.FILES)
+        # Another repository, commit message and time, but the same tree.
+        other = self.make_commit("copy", self.FILES, message="elsewhere", timestamp=1800000000)
+        for fmt in ("tar.gz", "zip"):
+            with self.subTest(fmt=fmt):
+                _, first = self.download(f"/api/git/arch/archive/{head}/?format={fmt}")
+                _, again = self.download(f"/api/git/arch/archive/main/?format={fmt}")
+                _, copy = self.download(f"/api/git/copy/archive/{other}/?format={fmt}")
+                self.assertEqual(first, again)
+                self.assertEqual(first, copy)
+
+        _, data = self.download(f"/api/git/arch/archive/{head}/")
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.getnames(), ["README", "src", "src/big.bin", "src/main.py"])
+            self.assertEqual({m.mtime for m in tar}, {315532800})
+            self.assertEqual(tar.extractfile("src/big.bin").read(), self.FILES["src/big.bin"])
+        _, data = self.download(f"/api/git/arch/archive/{head}/?format=zip")
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["README", "src/", "src/big.bin", "src/main.py"])
+            self.assertEqual(archive.read("src/main.py"), b"print()\n")
+
+    def test_etag_and_not_modified(self):
+        head = self.make_commit("arch", self.FILES)
+        tree = get_commit(Repository.objects.get(name="arch"), head)["tree"]
+        resp, _ = self.download(f"/api/git/arch/archive/{head}/")
+        self.assertEqual(resp["ETag"], f'"{tree}.tar.gz"')
+        self.assertIn("immutable", resp["Cache-Control"])
+        resp, _ = self.download("/api/git/arch/archive/main/?format=zip")
+        self.assertEqual(resp["ETag"], f'"{tree}.zip"')
+        self.assertEqual(resp["Cache-Control"], "no-cache")
+
+        for url, tag in ((f"/api/git/arch/archive/{head}/", f'"{tree}.tar.gz"'),
+                         ("/api/git/arch/archive/main/?format=zip", f'"other", "{tree}.zip"'),
+                         ("/api/git/arch/archive/main/", "*")):
+            with self.subTest(url=url, tag=tag):
+                resp = self.client.get(url, headers={"If-None-Match": tag})
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.content, b"")
+        resp, data = self.download(f"/api/git/arch/archive/{head}/?format=zip", **{"If-None-Match": f'"{tree}.tar.gz"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(data)
+        self.assertEqual(self.client.get(f"/api/git/arch/archive/{head}/?format=rar").status_code, 400)
+
+    def test_completed_archives_are_cached_by_tree(self):
+        head = self.make_commit("arch", self.FILES)
+        with tempfile.TemporaryDirectory() as root, override_settings(PYGIT_ARCHIVE_ROOT=root):
+            _, streamed = self.download(f"/api/git/arch/archive/{head}/?format=zip")
+            with mock.patch("utils_app.archive.open_blob", side_effect=AssertionError("rebuilt")):
+                resp, cached = self.download(f"/api/git/arch/archive/{head}/?format=zip")
+            self.assertEqual(cached, streamed)
+            self.assertIn("attachment", resp["Content-Disposition"])
+
+
+class MalformedTransferTests(TestCase):
+    """Bad transfer bodies get a 400, which the client does not retry."""
+
+    def setUp(self):
+        Repository.objects.create(name="demo")
+
+    def post_stream(self, body):
+        return self.client.post("/api/git/demo/push", body, content_type=STREAM_CONTENT_TYPE)
+
+    def test_push_rejects_malformed_streams(self):
+        for body in (
+            b"not a stream",
+            STREAM_MAGIC + b"\0" + b"\1" * 10,
+            STREAM_MAGIC + bytes([STREAM_ZLIB]) + b"not zlib data",
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(self.post_stream(body).status_code, 400)
+        self.assertFalse(GitObject.objects.exists())
+
+    def test_have_and_objects_reject_malformed_json(self):
+        for url in ("/api/git/demo/have", "/api/git/demo/objects"):
+            for body in ("{not json", "[]", '{"shas": "abc"}'):
+                with self.subTest(url=url, body=body):
+                    resp = self.client.post(url, body, content_type="application/json")
+                    self.assertEqual(resp.status_code, 400)
+        resp = self.client.post("/api/git/demo/have", '{"shas": []}', content_type="application/json")
+        self.assertEqual(resp.json(), {"have": []})
+
+
+class PyGitRepoMixin:
+    """Runs each test inside a fresh client repository in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.workdir.cleanup)
+        cwd = os.getcwd()
+        os.chdir(self.workdir.name)
+        self.addCleanup(os.chdir, cwd)
+        py_git.reset_packs()
+        self.addCleanup(py_git.reset_packs)
+        self.addCleanup(setattr, py_git, "_config", None)
+        self.run_py_git(py_git.init)
+
+    def run_py_git(self, fn, *args):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            fn(*args)
+        return output.getvalue()
+
+    def write_file(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def commit_all(self, message):
+        self.run_py_git(py_git.add, ".")
+        self.run_py_git(py_git.commit, message)
+        with open(py_git.HEAD_FILE) as f:
+            return f.read().strip()
+
+
+def edit_distance(a, b):
+    """Insertions plus deletions turning ``a`` into ``b``, by the quadratic LCS table."""
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return len(a) + len(b) - 2 * previous[-1]
+
+
+class MyersDiffTests(SimpleTestCase):
+    def test_edit_scripts_are_valid_and_minimal(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            a = [rng.choice("abcd") for _ in range(rng.randint(0, 20))]
+            b = [line for line in a if rng.random() < 0.8] + [rng.choice("abxy") for _ in range(rng.randint(0, 3))]
+            if rng.random() < 0.3:
+                rng.shuffle(b)
+            ops = myers_diff(a, b)
+            self.assertEqual([line for tag, line in ops if tag != "+"], a)
+            self.assertEqual([line for tag, line in ops if tag != "-"], b)
+            self.assertEqual(sum(tag != " " for tag, _ in ops), edit_distance(a, b))
+
+    def test_large_disjoint_inputs_stay_within_time_and_memory(self):
+        a = [f"old {i}" for i in range(20000)]
+        b = [f"new {i}" for i in range(20000)]
+        peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.monotonic()
+        ops = myers_diff(a, b)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertLess(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_kib, 100 << 10)
+        self.assertEqual(ops, [("-", line) for line in a] + [("+", line) for line in b])
+
+
+class UnifiedDiffTests(SimpleTestCase):
+    def test_new_and_deleted_files_start_at_zero(self):
+        self.assertEqual(list(unified_diff([], ["a", "b"])), ["@@ -0,0 +1,2 @@", "+a", "+b"])
+        self.assertEqual(list(unified_diff(["a"], [])), ["@@ -1,1 +0,0 @@", "-a"])
+
+    def test_zero_context_hunks_point_at_the_line_before(self):
+        old = ["a", "b", "c", "d"]
+        new = ["a", "x", "b", "c"]
+        self.assertEqual(
+            list(unified_diff(old, new, context=0)),
+            ["@@ -1,0 +2,1 @@", "+x", "@@ -4,1 +4,0 @@", "-d"],
+        )
+
+
+class ReceiveObjectsTests(PyGitRepoMixin, SimpleTestCase):
+    def test_object_failing_verification_stops_the_transfer(self):
+        good = raw_object("blob", b"good\n")
+        bad_sha = raw_object("blob", b"expected\n")[0]
+        stream = encode_objects([
+            (good[0], "blob", 5, [b"good\n"]),
+            (bad_sha, "blob", 9, [b"tampered\n"]),
+        ])
+        stored = []
+        with self.assertRaises(ValueError):
+            py_git.receive_objects(stream, stored.append)
+        # Resume progress stops at the last object that verified.
+        self.assertEqual(stored, [good[0]])
+        self.assertTrue(py_git.object_exists(good[0]))
+        self.assertFalse(py_git.object_exists(bad_sha))
+
+    def test_corrupt_compressed_stream_is_a_value_error(self):
+        with self.assertRaises(ValueError):
+            py_git.receive_objects([STREAM_MAGIC + bytes([STREAM_ZLIB]) + b"not zlib data"])
+
+
+class LooseObjectTests(PyGitRepoMixin, SimpleTestCase):
+    def test_objects_are_stored_compressed_and_read_back(self):
+        data = b"compressible line\n" * 1000
+        sha1 = py_git.hash_object(data, "blob")
+        with open(py_git.object_path(sha1), "rb") as f:
+            stored = f.read()
+        self.assertEqual(zlib.decompress(stored), b"blob %d\0" % len(data) + data)
+        self.assertLess(len(stored), len(data) // 10)
+        self.assertEqual(py_git.read_object(sha1), ("blob", data))
+
+        self.write_file("big.bin", data)
+        self.assertEqual(py_git.hash_file("big.bin"), sha1)
+        self.assertEqual(py_git.hash_file("big.bin", write=False), sha1)
+
+    def test_uncompressed_objects_from_older_repositories_are_readable(self):
+        data = b"written before compression\n"
+        sha1 = raw_object("blob", data)[0]
+        os.makedirs(os.path.dirname(py_git.object_path(sha1)))
+        self.write_file(py_git.object_path(sha1), b"blob %d\0" % len(data) + data)
+        self.assertEqual(py_git.read_object(sha1), ("blob", data))
+        self.assertEqual(py_git.object_info(sha1), ("blob", len(data)))
+
+
+class StatCacheTests(PyGitRepoMixin, SimpleTestCase):
+    def add_hashing(self):
+        """Run ``add .`` and return the paths it had to rehash."""
+        with mock.patch.object(py_git, "hash_file", wraps=py_git.hash_file) as hash_file:
+            self.run_py_git(py_git.add, ".")
+        return sorted(os.path.relpath(call.args[0]) for call in hash_file.call_args_list)
+
+    def set_mtime(self, path, offset):
+        mtime_ns = time.time_ns() + offset * 10**9
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        return mtime_ns
+
+    def test_unchanged_files_are_not_rehashed(self):
+        for name in ("a.txt", "b.txt"):
+            self.write_file(name, b"%s\n" % name.encode())
+            self.set_mtime(name, -100)
+        self.assertEqual(self.add_hashing(), ["a.txt", "b.txt"])
+        self.assertEqual(self.add_hashing(), [])
+
+        self.write_file("a.txt", b"changed\n")
+        self.assertEqual(self.add_hashing(), ["a.txt"])
+
+    def test_racy_entries_are_rehashed(self):
+        self.write_file("a.txt", b"aaaa\n")
+        mtime_ns = self.set_mtime("a.txt", 100)
+        self.add_hashing()
+        # Same size and mtime, but the entry is no older than the index that recorded it.
+        self.write_file("a.txt", b"bbbb\n")
+        os.utime("a.txt", ns=(mtime_ns, mtime_ns))
+        self.assertEqual(self.add_hashing(), ["a.txt"])
+        self.assertEqual(py_git.load_index()["entries"]["a.txt"][4], raw_object("blob", b"bbbb\n")[0])
+
+
+class ParallelWriteTreeTests(PyGitRepoMixin, SimpleTestCase):
+    def test_tree_sha_does_not_depend_on_worker_count(self):
+        rng = random.Random(0)
+        files = {}
+        for i in range(300):
+            path = f"d{i % 7}/sub{i % 3}/f{i}.txt"
+            files[path] = b"%d %x\n" % (i, rng.getrandbits(64)) * rng.randint(1, 50)
+        for path, data in files.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.write_file(path, data)
+        expected = build_tree(files, {})
+        for jobs in (1, 2, 8):
+            with self.subTest(jobs=jobs):
+                index = {}
+                self.assertEqual(py_git.write_tree(".", index, jobs=jobs, verbose=False), expected)
+                self.assertEqual(len(index["entries"]), len(files))
+        self.assertEqual(py_git.write_tree(".", {}, jobs=8, verbose=False, unwritten={}), expected)
+
+
+class WatcherTests(PyGitRepoMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("a.txt", "b.txt"):
+            self.write_file(name, b"%s\n" % name.encode())
+            mtime_ns = time.time_ns() - 100 * 10**9
+            os.utime(name, ns=(mtime_ns, mtime_ns))
+        self.commit_all("first")
+
+    def test_tokens_report_changes_since_they_were_issued(self):
+        watcher = py_git.Watcher(os.path.abspath("."), poll=True)
+        first = watcher.changes(None)
+        self.assertEqual(first["paths"], [])
+        self.write_file("a.txt", b"changed\n")
+        second = watcher.changes(first["token"])
+        self.assertEqual(second["paths"], ["a.txt"])
+        self.assertEqual(watcher.changes(second["token"])["paths"], [])
+        self.assertEqual(watcher.changes(first["token"])["paths"], ["a.txt"])
+
+    def test_unknown_or_reset_tokens_get_a_full_reply(self):
+        watcher = py_git.Watcher(os.path.abspath("."), poll=True)
+        token = watcher.changes(None)["token"]
+        self.assertTrue(watcher.changes("00000000:1")["full"])
+        with mock.patch.object(py_git, "WATCH_MAX_DIRTY", 2):
+            for name in ("c.txt", "d.txt", "e.txt"):
+                self.write_file(name, b"new\n")
+            reply = watcher.changes(token)
+        self.assertTrue(reply["full"])
+        self.assertEqual(watcher.changes(reply["token"]), {"token": reply["token"], "paths": []})
+
+    def test_add_rescans_only_reported_paths_unless_told_to_scan_everything(self):
+        self.write_file("a.txt", b"changed a\n")
+        self.write_file("b.txt", b"changed b\n")
+        with mock.patch.object(py_git, "watch_changes", return_value={"token": "e:1", "paths": ["a.txt"]}):
+            self.run_py_git(py_git.add, ".")
+        index = py_git.load_index()
+        self.assertEqual(index["watch_token"], "e:1")
+        self.assertEqual(index["entries"]["a.txt"][4], raw_object("blob", b"changed a\n")[0])
+        self.assertEqual(index["entries"]["b.txt"][4], raw_object("blob", b"b.txt\n")[0])
+
+        with mock.patch.object(py_git, "watch_changes", return_value={"token": "f:1", "full": True}):
+            self.run_py_git(py_git.add, ".")
+        self.assertEqual(py_git.load_index()["entries"]["b.txt"][4], raw_object("blob", b"changed b\n")[0])
+
+
+class TreeFormatTests(PyGitRepoMixin, SimpleTestCase):
+    FILES = {"a.b": b"1\n", "a/x": b"2\n", "a-b/y": b"3\n", "a0": b"4\n", "b": b"5\n"}
+
+    def write_files(self, root="."):
+        for path, data in self.FILES.items():
+            os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+            self.write_file(os.path.join(root, path), data)
+
+    def test_tree_sha_matches_git_write_tree(self):
+        if shutil.which("git") is None:
+            self.skipTest("git is not installed")
+        self.write_files()
+        tree = py_git.write_tree(".", {}, verbose=False)
+        with tempfile.TemporaryDirectory() as git_dir:
+            self.write_files(git_dir)
+            subprocess.run(["git", "init", "-q"], cwd=git_dir, check=True)
+            subprocess.run(["git", "add", "-A"], cwd=git_dir, check=True)
+            git_tree = subprocess.run(["git", "write-tree"], cwd=git_dir, check=True,
+                                      capture_output=True, text=True).stdout.strip()
+        self.assertEqual(tree, git_tree)
+
+    def test_text_trees_from_older_repositories_are_still_read(self):
+        py_git.save_config(dict(py_git.load_config(), format=1))
+        self.write_files()
+        text_tree = py_git.write_tree(".", {}, verbose=False)
+        _, body = py_git.read_object(text_tree)
+        self.assertFalse(body[:1].isdigit())
+        py_git.save_config(dict(py_git.load_config(), format=2))
+        binary_tree = py_git.write_tree(".", {}, verbose=False)
+
+        # Subtrees are written in each format too, so only blob SHAs agree.
+        def blobs(entries):
+            return sorted((name, kind, sha1 if kind == "blob" else None) for kind, sha1, name in entries)
+
+        self.assertEqual(blobs(py_git.read_tree(text_tree)), blobs(py_git.read_tree(binary_tree)))
+        text, binary = parse_tree(body), parse_tree(py_git.read_object(binary_tree)[1])
+        self.assertEqual(blobs((e.type, e.sha, e.name) for e in text), blobs((e.type, e.sha, e.name) for e in binary))
+        for name in ("a", "a.b", "a-b", "a0", "b"):
+            self.assertEqual(text.lookup(name).type, binary.lookup(name).type)
+        self.assertIsNone(text.lookup("missing"))
+
+
+class CheckoutTests(PyGitRepoMixin, SimpleTestCase):
+    def test_checkout_moves_head_and_worktree(self):
+        self.write_file("a.txt", b"first\n")
+        first = self.commit_all("first")
+        self.write_file("a.txt", b"second\n")
+        self.write_file("b.txt", b"new\n")
+        second = self.commit_all("second")
+
+        self.run_py_git(py_git.checkout, first)
+        with open(py_git.HEAD_FILE) as f:
+            self.assertEqual(f.read(), first)
+        with open("a.txt", "rb") as f:
+            self.assertEqual(f.read(), b"first\n")
+        self.assertFalse(os.path.exists("b.txt"))
+
+        self.run_py_git(py_git.checkout, second)
+        with open(py_git.HEAD_FILE) as f:
+            self.assertEqual(f.read(), second)
+
+    def test_checkout_refuses_to_overwrite_local_edits(self):
+        self.write_file("a.txt", b"first\n")
+        first = self.commit_all("first")
+        self.write_file("a.txt", b"second\n")
+        second = self.commit_all("second")
+        self.write_file("a.txt", b"edited\n")
+
+        output = self.run_py_git(py_git.checkout, first)
+        self.assertIn("a.txt", output)
+        with open("a.txt", "rb") as f:
+            self.assertEqual(f.read(), b"edited\n")
+        with open(py_git.HEAD_FILE) as f:
+            self.assertEqual(f.read(), second)
+
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_checkout_refuses_to_overwrite_untracked_files(self):
+        self.write_file("a.txt", b"a\n")
+        first = self.commit_all("first")
+        self.write_file("b.txt", b"b\n")
+        second = self.commit_all("second")
+        self.run_py_git(py_git.checkout, first)
+        self.write_file("b.txt", b"untracked\n")
+
+        output = self.run_py_git(py_git.checkout, second)
+        self.assertIn("b.txt", output)
+        self.assertEqual(self.read("b.txt"), b"untracked\n")
+        self.assertEqual(self.read(py_git.HEAD_FILE).decode(), first)
+
+    def test_checkout_without_an_index_refuses_to_overwrite_differing_files(self):
+        self.write_file("a.txt", b"a\n")
+        self.write_file("same.txt", b"same\n")
+        first = self.commit_all("first")
+        os.remove(py_git.INDEX_FILE)
+        self.write_file("a.txt", b"edited\n")
+
+        output = self.run_py_git(py_git.checkout, first)
+        self.assertIn("a.txt", output)
+        self.assertNotIn("same.txt", output)
+        self.assertEqual(self.read("a.txt"), b"edited\n")
+
+    def test_checkout_refuses_to_drop_staged_changes(self):
+        self.write_file("a.txt", b"first\n")
+        first = self.commit_all("first")
+        self.write_file("a.txt", b"second\n")
+        self.commit_all("second")
+        self.write_file("a.txt", b"staged\n")
+        self.run_py_git(py_git.add, ".")
+
+        output = self.run_py_git(py_git.checkout, first)
+        self.assertIn("a.txt", output)
+        self.assertEqual(self.read("a.txt"), b"staged\n")
+
+
+class WorktreeDiffTests(PyGitRepoMixin, SimpleTestCase):
+    def test_status_and_diff_write_no_objects(self):
+        os.mkdir("src")
+        self.write_file("src/a.txt", b"a\nb\n")
+        self.commit_all("first")
+        self.write_file("src/a.txt", b"a\nc\n")
+        self.write_file("src/new.txt", b"new\n")
+        before = set(py_git.iter_objects())
+
+        status = self.run_py_git(py_git.status)
+        diff = self.run_py_git(py_git.diff)
+        self.assertIn("modified:   src/a.txt", status)
+        self.assertIn("new file:   src/new.txt", status)
+        self.assertIn("-b\n+c\n", diff)
+        self.assertIn("@@ -0,0 +1,1 @@\n+new\n", diff)
+        self.assertEqual(set(py_git.iter_objects()), before)
+
+
+class IgnoreTests(PyGitRepoMixin, SimpleTestCase):
+    def staged_paths(self, path="."):
+        self.run_py_git(py_git.add, path)
+        return sorted(py_git.load_index()["entries"])
+
+    def test_matcher_rules(self):
+        matcher = py_git.IgnoreMatcher(["*.log", "!keep.log", "/build", "tmp/", "docs/*.md"])
+        self.assertTrue(matcher.match("a/debug.log", False))
+        self.assertFalse(matcher.match("a/keep.log", False))
+        self.assertTrue(matcher.match("build", True))
+        self.assertIsNone(matcher.match("src/build", True))
+        self.assertTrue(matcher.match("src/tmp", True))
+        self.assertIsNone(matcher.match("src/tmp", False))
+        self.assertTrue(matcher.match("docs/a.md", False))
+        self.assertIsNone(matcher.match("docs/sub/a.md", False))
+
+    def test_nested_ignore_files_take_precedence(self):
+        os.makedirs("src/build")
+        os.makedirs("build")
+        self.write_file(".py_gitignore", b"*.log\n/build\ntmp/\n")
+        self.write_file("src/.py_gitignore", b"!keep.log\n")
+        for path in ["a.log", "src/keep.log", "src/drop.log", "build/out", "src/build/out", "main.py"]:
+            self.write_file(path, b"x\n")
+        os.makedirs("src/tmp")
+        self.write_file("src/tmp/cache", b"x\n")
+        self.write_file("tmp", b"a file named tmp\n")
+        self.assertEqual(self.staged_paths(), [
+            ".py_gitignore", "main.py", "src/.py_gitignore", "src/build/out", "src/keep.log", "tmp",
+        ])
+
+    def test_adding_a_subdirectory_honours_ignore_files_above_it(self):
+        os.makedirs("src/lib")
+        self.write_file(".py_gitignore", b"*.log\n/src/lib/gen.py\n")
+        self.write_file("src/.py_gitignore", b"*.tmp\n")
+        for path in ["src/lib/a.py", "src/lib/gen.py", "src/lib/b.log", "src/lib/c.tmp"]:
+            self.write_file(path, b"x\n")
+        self.assertEqual(self.staged_paths("src/lib"), ["a.py"])
+
+
+class PackTests(PyGitRepoMixin, SimpleTestCase):
+    def commit_versions(self, count=6):
+        lines = [f"line {i} of a file that changes a little every commit\n".encode() for i in range(200)]
+        for version in range(count):
+            lines[version * 30] = f"edited in version {version}\n".encode()
+            lines.append(f"appended in version {version}\n".encode())
+            self.write_file("notes.txt", b"".join(lines))
+            self.commit_all(f"version {version}")
+
+    def delta_depth(self, pack, offset):
+        depth = 0
+        type_code, _, _, base = pack._entry(offset)
+        while type_code == py_git.OFS_DELTA:
+            depth += 1
+            offset -= base
+            type_code, _, _, base = pack._entry(offset)
+        return depth
+
+    def test_delta_chains_read_back_identical_without_loose_objects(self):
+        self.commit_versions()
+        originals = {sha1: py_git.read_object(sha1) for sha1 in py_git.iter_loose_objects()}
+        self.run_py_git(py_git.repack)
+
+        self.assertEqual(list(py_git.iter_loose_objects()), [])
+        [pack] = py_git.load_packs()
+        depths = [self.delta_depth(pack, pack.find(sha1)) for sha1 in originals]
+        self.assertGreaterEqual(max(depths), 2)
+        for sha1, (obj_type, body) in originals.items():
+            self.assertTrue(py_git.object_exists(sha1))
+            self.assertEqual(py_git.read_object(sha1), (obj_type, body))
+            self.assertEqual(py_git.object_info(sha1), (obj_type, len(body)))
+            self.assertEqual(hashlib.sha1(f"{obj_type} {len(body)}\0".encode() + body).hexdigest(), sha1)
+        self.assertFalse(py_git.object_exists("0" * 40))
+
+    def test_repack_is_idempotent(self):
+        self.commit_versions()
+        self.run_py_git(py_git.repack)
+        first = sorted(os.listdir(py_git.PACK_DIR))
+        objects = sorted(py_git.iter_objects())
+        self.run_py_git(py_git.repack)
+        self.assertEqual(sorted(os.listdir(py_git.PACK_DIR)), first)
+        self.assertEqual(sorted(py_git.iter_objects()), objects)
+        self.assertEqual(len(py_git.load_packs()), 1)
+
+
+class GcTests(PyGitRepoMixin, SimpleTestCase):
+    def age_objects(self, seconds):
+        mtime = time.time() - seconds
+        for dirpath, _, filenames in os.walk(py_git.OBJECTS_DIR):
+            for filename in filenames:
+                os.utime(os.path.join(dirpath, filename), (mtime, mtime))
+
+    def test_gc_keeps_everything_reachable(self):
+        py_git.save_config(dict(py_git.load_config(), chunking=SMALL_CHUNKS))
+        rng = random.Random(0)
+        self.write_file("big.txt", b"".join(b"%x\n" % rng.getrandbits(64) for i in range(20000)))
+        self.write_file("a.txt", b"one\n")
+        self.commit_all("first")
+        self.write_file("a.txt", b"two\n")
+        head = self.commit_all("second")
+        self.write_file("side.txt", b"only on a branch\n")
+        side = self.commit_all("side")
+        py_git.write_ref(os.path.join(py_git.REPO_DIR, "refs", "heads", "side"), side)
+        with open(py_git.HEAD_FILE, "w") as f:
+            f.write(head)
+        self.write_file("staged.txt", b"added, not committed\n")
+        self.run_py_git(py_git.add, ".")
+        orphan = py_git.hash_object(b"never referenced\n", "blob")
+        big_sha = {name: sha for _, sha, name in py_git.read_tree(py_git.load_index()["root_tree"])}["big.txt"]
+        self.assertGreater(len(py_git.manifest_parts(big_sha)), 1)
+        before = set(py_git.iter_objects())
+
+        self.age_objects(3600)
+        self.run_py_git(py_git.gc, 60)
+        self.assertEqual(set(py_git.iter_objects()), before - {orphan})
+
+    def test_gc_keeps_unreachable_objects_inside_the_grace_period(self):
+        self.write_file("a.txt", b"one\n")
+        self.commit_all("first")
+        orphan = py_git.hash_object(b"just written\n", "blob")
+        self.run_py_git(py_git.gc, 60)
+        self.assertTrue(py_git.object_exists(orphan))
+        self.age_objects(3600)
+        self.run_py_git(py_git.gc, 60)
+        self.assertFalse(py_git.object_exists(orphan))
+
+    def test_gc_rewrites_stale_packs_without_unreachable_objects(self):
+        self.write_file("a.txt", b"one\n")
+        head = self.commit_all("first")
+        orphan = py_git.hash_object(b"packed but unreachable\n", "blob")
+        self.run_py_git(py_git.repack)
+        self.run_py_git(py_git.gc, 60)
+        self.assertTrue(py_git.object_exists(orphan))
+
+        self.age_objects(3600)
+        self.run_py_git(py_git.gc, 60)
+        self.assertFalse(py_git.object_exists(orphan))
+        self.assertEqual(py_git.read_object(py_git.read_commit(head)[0])[0], "tree")
+
+
+class LiveRemoteMixin(PyGitRepoMixin):
+    """Points the client at the live test server, backed by a temporary object store."""
+
+    def setUp(self):
+        super().setUp()
+        self.server_objects = tempfile.TemporaryDirectory()
+        self.addCleanup(self.server_objects.cleanup)
+        settings = override_settings(PYGIT_OBJECTS_ROOT=self.server_objects.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_object_store.cache_clear()
+        self.addCleanup(get_object_store.cache_clear)
+
+        remote_url = py_git.REMOTE_URL
+        py_git.REMOTE_URL = f"{self.live_server_url}/api/git"
+        self.addCleanup(setattr, py_git, "REMOTE_URL", remote_url)
+        self.addCleanup(self.close_http_session)
+        self.origin = os.getcwd()
+        self.clones = tempfile.TemporaryDirectory()
+        self.addCleanup(self.clones.cleanup)
+
+    def server_objects_of(self, repo_name):
+        return set(GitObject.objects.filter(repo__name=repo_name).values_list("sha1", flat=True))
+
+    def push_all(self, repo_name):
+        os.chdir(self.origin)
+        py_git.reset_packs()
+        py_git._config = None
+        return self.run_py_git(py_git.push, repo_name, 1)
+
+    def run_clone(self, repo_name, depth=None, blob_filter=None):
+        """Clone ``repo_name`` into a scratch directory, leaving the clone as the working directory."""
+        os.chdir(self.clones.name)
+        py_git.reset_packs()
+        py_git._config = None
+        url = f"{self.live_server_url}/api/git/{repo_name}/clone"
+        return self.run_py_git(py_git.clone, url, 1, depth, blob_filter)
+
+    def close_http_session(self):
+        # Pooled keep-alive connections would hold live server threads open.
+        if py_git._session is not None:
+            py_git._session.close()
+            py_git._session = None
+
+
+class ChunkedRoundTripTests(LiveRemoteMixin, LiveServerTestCase):
+    """Chunked blobs survive a repack on the client and a push to the server."""
+
+    def setUp(self):
+        super().setUp()
+        py_git.save_config(dict(py_git.load_config(), chunking=SMALL_CHUNKS))
+
+    def test_chunked_blob_round_trips_through_pack_and_push(self):
+        rng = random.Random(0)
+        content = b"".join(b"%d %x\n" % (i, rng.getrandbits(64)) for i in range(20000))
+        self.write_file("big.txt", content)
+        self.write_file("notes.txt", b"".join(b"note %d\n" % i for i in range(200)))
+        self.commit_all("add big file")
+        # A second version of a small file is packed as a delta against the first.
+        with open("notes.txt", "ab") as f:
+            f.write(b"one more note\n")
+        head_sha = self.commit_all("extend notes")
+        entries = {name: sha for _, sha, name in py_git.read_tree(py_git.load_index()["root_tree"])}
+        blob_sha = entries["big.txt"]
+        parts = py_git.manifest_parts(blob_sha)
+        self.assertGreater(len(parts), 1)
+
+        self.run_py_git(py_git.repack)
+        self.assertEqual(list(py_git.iter_loose_objects()), [])
+        self.assertEqual(py_git.object_info(blob_sha)[0], py_git.CHUNK_TYPE)
+        self.assertEqual(py_git.manifest_parts(blob_sha), parts)
+        self.assertEqual(py_git.read_object(blob_sha), ("blob", content))
+
+        self.run_py_git(py_git.push, "chunked")
+        repo = Repository.objects.get(name="chunked")
+        self.assertEqual(Reference.objects.get(repo=repo, name="refs/heads/main").commit_hash, head_sha)
+        self.assertEqual(GitObject.objects.get(repo=repo, sha1=blob_sha).type, py_git.CHUNK_TYPE)
+        size, chunks = open_blob(blob_sha)
+        self.assertEqual(size, len(content))
+        self.assertEqual(b"".join(chunks), content)
+
+
+class PushNegotiationTests(LiveRemoteMixin, LiveServerTestCase):
+    def record_uploads(self):
+        upload = py_git.upload_objects
+        sent = []
+
+        def record(repo_name, shas, params=None):
+            sent.extend(shas)
+            return upload(repo_name, shas, params)
+
+        patch = mock.patch.object(py_git, "upload_objects", record)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return sent
+
+    def test_second_push_sends_only_new_objects(self):
+        os.makedirs("src/deep")
+        self.write_file("src/deep/a.txt", b"one\n")
+        self.write_file("src/b.txt", b"unchanged\n")
+        self.commit_all("first")
+        self.push_all("negotiate")
+        sent = self.record_uploads()
+
+        self.write_file("src/deep/a.txt", b"two\n")
+        head = self.commit_all("second")
+        self.push_all("negotiate")
+        tree = py_git.read_commit(head)[0]
+        src = {name: sha for _, sha, name in py_git.read_tree(tree)}["src"]
+        deep = {name: sha for _, sha, name in py_git.read_tree(src)}["deep"]
+        self.assertEqual(sorted(sent), sorted([head, tree, src, deep, raw_object("blob", b"two\n")[0]]))
+        self.assertEqual(Reference.objects.get(repo__name="negotiate").commit_hash, head)
+
+    def test_objects_the_server_already_has_are_not_sent(self):
+        self.write_file("a.txt", b"already uploaded\n")
+        self.write_file("b.txt", b"new\n")
+        head = self.commit_all("first")
+        present = raw_object("blob", b"already uploaded\n")[0]
+        py_git.upload_objects("negotiate", [present])
+        sent = self.record_uploads()
+
+        output = self.push_all("negotiate")
+        self.assertIn("Sending 3 of 4 new objects.", output)
+        self.assertNotIn(present, sent)
+        self.assertEqual(self.server_objects_of("negotiate"), set(py_git.objects_to_push(head, [None])))
+
+
+class TransferResumeTests(LiveRemoteMixin, LiveServerTestCase):
+    """Interrupted pushes and clones pick up where they stopped."""
+
+    def setUp(self):
+        super().setUp()
+        self.sleeps = []
+        sleep = mock.patch.object(py_git.time, "sleep", self.sleeps.append)
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def commit_history(self):
+        os.mkdir("src")
+        for i in range(40):
+            self.write_file(f"src/file{i}.txt", b"content %d\n" % i)
+        self.commit_all("first")
+        for i in range(0, 40, 4):
+            self.write_file(f"src/file{i}.txt", b"changed %d\n" % i)
+        return self.commit_all("second")
+
+    def test_interrupted_push_resends_only_missing_objects(self):
+        head_sha = self.commit_history()
+        objects = set(py_git.objects_to_push(head_sha, [None, None]))
+        upload = py_git.upload_objects
+        batches = []
+
+        def drop_second_batch(repo_name, shas, params=None):
+            batches.append(list(shas))
+            if len(batches) == 2:
+                raise requests.ConnectionError("connection reset")
+            return upload(repo_name, shas, params)
+
+        with mock.patch.object(py_git, "PUSH_BATCH_OBJECTS", 5), \
+                mock.patch.object(py_git, "upload_objects", drop_second_batch):
+            output = self.push_all("resume")
+        self.assertIn("Push interrupted", output)
+        stored = self.server_objects_of("resume")
+        self.assertEqual(stored, {sha1 for batch in batches[:1] + batches[2:] for sha1 in batch})
+        self.assertTrue(stored.isdisjoint(batches[1]))
+        self.assertFalse(Reference.objects.filter(repo__name="resume").exists())
+        self.assertIsNone(py_git.read_ref(py_git.remote_ref_path("resume")))
+
+        resent = []
+
+        def record(repo_name, shas, params=None):
+            resent.extend(shas)
+            return upload(repo_name, shas, params)
+
+        with mock.patch.object(py_git, "upload_objects", record):
+            self.push_all("resume")
+        self.assertEqual(sorted(resent), sorted(objects - stored))
+        self.assertEqual(self.server_objects_of("resume"), objects)
+        self.assertEqual(Reference.objects.get(repo__name="resume", name="refs/heads/main").commit_hash, head_sha)
+        self.assertEqual(py_git.read_ref(py_git.remote_ref_path("resume")), head_sha)
+
+    def test_server_errors_are_retried_with_backoff(self):
+        head_sha = self.commit_history()
+        session = py_git.http_session()
+        request = session.request
+        failures = []
+
+        def fail_first_pushes(method, url, **kwargs):
+            if url.endswith("/push") and len(failures) < 2:
+                failures.append(url)
+                resp = requests.Response()
+                resp.status_code = 503
+                return resp
+            return request(method, url, **kwargs)
+
+        with mock.patch.object(session, "request", fail_first_pushes):
+            self.push_all("retried")
+        self.assertEqual(self.sleeps, [py_git.HTTP_BACKOFF, py_git.HTTP_BACKOFF * 2])
+        self.assertEqual(Reference.objects.get(repo__name="retried").commit_hash, head_sha)
+
+        self.sleeps.clear()
+        resp = py_git.http_request("GET", f"{py_git.REMOTE_URL}/no-such-repo/refs")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(self.sleeps, [])
+
+    def test_head_update_for_missing_objects_is_rejected(self):
+        head_sha = self.commit_history()
+        with self.assertRaises(requests.HTTPError) as cm:
+            py_git.upload_objects("early", [], {"head": head_sha, "ref": "refs/heads/main"})
+        self.assertEqual(cm.exception.response.status_code, 409)
+        self.assertFalse(Reference.objects.filter(repo__name="early").exists())
+
+    def interrupt_stream(self, target):
+        """Patch the client so the first stream for ``target`` drops after one object."""
+        http_request = py_git.http_request
+        receive = py_git.receive_objects
+        queries = []
+        dropped = []
+
+        def record_query(method, url, **kwargs):
+            queries.append(dict(kwargs.get("params") or {}))
+            return http_request(method, url, **kwargs)
+
+        def drop_after_first(chunks, on_object=None):
+            if dropped or queries[-1]["prefix"] != target:
+                return receive(chunks, on_object)
+
+            def store_then_drop(sha1):
+                on_object(sha1)
+                dropped.append(sha1)
+                raise requests.ConnectionError("connection reset")
+
+            return receive(chunks, store_then_drop)
+
+        patches = [
+            mock.patch.object(py_git, "CLONE_BUCKET_OBJECTS", 2),
+            mock.patch.object(py_git, "http_request", record_query),
+            mock.patch.object(py_git, "receive_objects", drop_after_first),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return queries, dropped
+
+    def busiest_prefix(self, objects):
+        counts = {}
+        for sha1 in objects:
+            counts[sha1[0]] = counts.get(sha1[0], 0) + 1
+        return max(counts, key=counts.get)
+
+    def test_dropped_clone_stream_retries_from_last_object(self):
+        head_sha = self.commit_history()
+        self.push_all("flaky")
+        objects = self.server_objects_of("flaky")
+        target = self.busiest_prefix(objects)
+        queries, dropped = self.interrupt_stream(target)
+
+        self.run_clone("flaky")
+        self.assertEqual(self.sleeps, [py_git.HTTP_BACKOFF])
+        resumed = [query for query in queries if query.get("prefix") == target]
+        self.assertEqual(resumed[1]["after"], dropped[0])
+        self.assertEqual(set(py_git.iter_objects()), objects)
+        self.assertFalse(os.path.exists(py_git.CLONE_STATE_FILE))
+        with open(py_git.HEAD_FILE) as f:
+            self.assertEqual(f.read(), head_sha)
+
+    def test_interrupted_clone_resumes_from_saved_state(self):
+        head_sha = self.commit_history()
+        self.push_all("partial")
+        objects = self.server_objects_of("partial")
+        target = self.busiest_prefix(objects)
+        queries, dropped = self.interrupt_stream(target)
+
+        with mock.patch.object(py_git, "HTTP_RETRIES", 0):
+            output = self.run_clone("partial")
+        self.assertIn("Clone interrupted", output)
+        self.assertFalse(os.path.exists(py_git.HEAD_FILE))
+        with open(py_git.CLONE_STATE_FILE) as f:
+            done = json.load(f)["done"]
+        self.assertEqual(done[target], dropped[0])
+        have = set(py_git.iter_objects())
+        self.assertEqual(have, {sha1 for sha1 in objects if done.get(sha1[0]) is True} | set(dropped))
+
+        queries.clear()
+        receive = py_git.receive_objects
+        received = []
+
+        def record(chunks, on_object=None):
+            def stored(sha1):
+                received.append(sha1)
+                on_object(sha1)
+            return receive(chunks, stored)
+
+        with mock.patch.object(py_git, "receive_objects", record):
+            output = self.run_clone("partial")
+        self.assertIn("Resuming clone", output)
+        fetched = [query["prefix"] for query in queries if "prefix" in query]
+        self.assertEqual(sorted(fetched), sorted(prefix for prefix, last in done.items() if last is not True))
+        self.assertIn({"prefix": target, "after": dropped[0]}, queries)
+        self.assertEqual(sorted(received), sorted(objects - have))
+        self.assertEqual(set(py_git.iter_objects()), objects)
+        self.assertFalse(os.path.exists(py_git.CLONE_STATE_FILE))
+        with open(py_git.HEAD_FILE) as f:
+            self.assertEqual(f.read(), head_sha)
+        with open("src/file0.txt", "rb") as f:
+            self.assertEqual(f.read(), b"changed 0\n")
+
+
+class PartialCloneTests(LiveRemoteMixin, LiveServerTestCase):
+    def commit_chain(self):
+        self.write_file("a.txt", b"one\n")
+        self.write_file("old.txt", b"removed later\n")
+        first = self.commit_all("first")
+        self.write_file("a.txt", b"two\n")
+        second = self.commit_all("second")
+        self.write_file("a.txt", b"three\n")
+        os.remove("old.txt")
+        third = self.commit_all("third")
+        self.push_all("partial")
+        return first, second, third
+
+    def blob_shas(self, *contents):
+        return [raw_object("blob", content)[0] for content in contents]
+
+    def test_depth_clone_stops_at_the_boundary(self):
+        first, second, third = self.commit_chain()
+        one, two, three = self.blob_shas(b"one\n", b"two\n", b"three\n")
+
+        self.run_clone("partial", depth=2)
+        self.assertEqual(py_git.load_config()["shallow"], [second])
+        self.assertEqual(py_git.read_commit(second)[1], [])
+        for sha1 in (third, second, two, three):
+            self.assertTrue(py_git.object_exists(sha1))
+        for sha1 in (first, one):
+            self.assertFalse(py_git.object_exists(sha1))
+        with open("a.txt", "rb") as f:
+            self.assertEqual(f.read(), b"three\n")
+        self.assertFalse(os.path.exists("old.txt"))
+
+    def test_blobless_clone_fetches_blobs_on_checkout(self):
+        first, second, third = self.commit_chain()
+        one, two, three, removed = self.blob_shas(b"one\n", b"two\n", b"three\n", b"removed later\n")
+
+        self.run_clone("partial", blob_filter="blob:none")
+        self.assertEqual(py_git.load_config()["filter"], "blob:none")
+        for sha1 in (first, second, third, three):
+            self.assertTrue(py_git.object_exists(sha1))
+        for sha1 in (one, two, removed):
+            self.assertFalse(py_git.object_exists(sha1))
+
+        output = self.run_py_git(py_git.checkout, first)
+        self.assertIn("Fetched 2 missing objects.", output)
+        self.assertFalse(py_git.object_exists(two))
+        with open("a.txt", "rb") as f:
+            self.assertEqual(f.read(), b"one\n")
+        with open("old.txt", "rb") as f:
+            self.assertEqual(f.read(), b"removed later\n")
@@ -0,0 +1,90 @@
+import struct
+import zlib
+
+STREAM_MAGIC = b"PGS1"
+STREAM_ZLIB = 0x01
+STREAM_CONTENT_TYPE = "application/x-pygit-stream"
+FRAME_HEADER = struct.Struct(">20sQ")
+END_FRAME = b"\0" * FRAME_HEADER.size
+CHUNK_SIZE = 1 << 16
+
+
+class StreamReader:
+    """Reads the object stream incrementally from a ``read(n)`` callable."""
+
+    def __init__(self, read):
+        self._read = read
+        self._buf = bytearray()
+        self._decompressor = None
+        self._eof = False
+        preamble = self.read_exact(len(STREAM_MAGIC) + 1)
+        if preamble[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+            raise ValueError("Not a py_git object stream")
+        if preamble[-1] & STREAM_ZLIB:
+            self._decompressor = zlib.decompressobj()
+            self._buf = bytearray(self._decompress(bytes(self._buf)))
+
+    def _decompress(self, data):
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt object stream: {e}") from e
+
+    def _fill(self):
+        data = self._read(CHUNK_SIZE)
+        if not data:
+            self._eof = True
+            return
+        if self._decompressor is not None:
+            data = self._decompress(data)
+        self._buf += data
+
+    def read_exact(self, n):
+        while len(self._buf) < n and not self._eof:
+            self._fill()
+        if len(self._buf) < n:
+            raise ValueError("Truncated object stream")
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def iter_exact(self, n):
+        while n:
+            if not self._buf:
+                self._fill()
+                if self._eof and not self._buf:
+                    raise ValueError("Truncated object stream")
+            data = bytes(self._buf[:n])
+            del self._buf[:len(data)]
+            n -= len(data)
+            yield data
+
+    def objects(self):
+        """Yield ``(sha1, raw_chunks)`` pairs until the end frame.
+
+        Each object's chunks must be consumed before asking for the next.
+        """
+        while True:
+            header = self.read_exact(FRAME_HEADER.size)
+            if header == END_FRAME:
+                return
+            sha_bin, length = FRAME_HEADER.unpack(header)
+            yield sha_bin.hex(), self.iter_exact(length)
+
+
+def encode_objects(objects, compress=True):
+    """Encode ``(sha1, type, size, body_chunks)`` tuples as a stream of byte chunks."""
+    compressor = zlib.compressobj() if compress else None
+
+    def out(data):
+        return compressor.compress(data) if compressor else data
+
+    yield STREAM_MAGIC + bytes([STREAM_ZLIB if compress else 0])
+    for sha1, obj_type, size, chunks in objects:
+        header = f"{obj_type} {size}\0".encode()
+        yield out(FRAME_HEADER.pack(bytes.fromhex(sha1), len(header) + size) + header)
+        for chunk in chunks:
+            yield out(chunk)
+    yield out(END_FRAME)
+    if compressor:
+        yield compressor.flush()
@@ -9,7 +9,12 @@ app_name = 'utils_app'
 
 urlpatterns = [
     path('<repo_name>/push', views.push_objects, name='push_objects_view'),
+    path('<repo_name>/refs', views.list_refs, name='list_refs'),
+    path('<repo_name>/have', views.have_objects, name='have_objects'),
+    path('<repo_name>/objects', views.fetch_objects, name='fetch_objects'),
+    path('<repo_name>/search', views.search, name='search'),
     path("", views.repo_list, name="repo_list"),
+    path("_stats/cache", views.cache_stats, name="cache_stats"),
     path("<str:name>/", views.repo_overview, name="repo_overview"),
     path(
         "<str:name>/tree/<str:commit_sha>/",
@@ -26,6 +31,17 @@ urlpatterns = [
         views.blob_view,
         name="blob_view",
     ),
+    path(
+        "<str:name>/raw/<str:commit_sha>/<path:path>",
+        views.raw_blob,
+        name="raw_blob",
+    ),
+    path(
+        "<str:name>/blame/<str:commit_sha>/<path:path>/",
+        views.blame_view,
+        name="blame_view",
+    ),
+    path("<str:name>/archive/<str:rev>/", views.archive_view, name="archive"),
     path("<str:name>/commits/", views.commit_list, name="commit_list"),
     path(
         "<str:name>/commit/<str:commit_sha>/",
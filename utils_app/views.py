@@ -1,31 +1,144 @@
-from django.http import JsonResponse, Http404, HttpRequest, HttpResponse
+from django.http import FileResponse, JsonResponse, Http404, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render, get_object_or_404
+from django.db import transaction
 from .models import Repository, GitObject, Reference
-from .helpers import load_object, parse_tree, parse_commit
+from .cache import object_cache
+from .diff import commit_changes
+from .commit_graph import update_commit_graph, first_parent_history
+from .helpers import get_commit, get_tree, get_path_index, ingest_objects, open_blob
+from .reachability import reachable_objects, refs_bitmap, update_ref_bitmaps
+from .search import index_blobs, search_tree
+from .history import blame, last_commits
+from .archive import ARCHIVE_CONTENT_TYPES, cached_archive_path, stream_archive
+from .storage import get_object_store
+from .transfer import STREAM_CONTENT_TYPE, StreamReader, encode_objects
+from datetime import datetime, timezone
 import json
-import zlib
+import mimetypes
+import os
+import re
+
+HAVE_BATCH_LIMIT = 1000
+CLONE_BATCH = 200
+COMMITS_PER_PAGE = 50
+BLOB_PREVIEW_BYTES = 256 * 1024
+SEARCH_RESULTS = 100
+# Raw blobs are user content served from the app's own origin, so only
+# passive image types keep their own Content-Type; everything else is
+# plain text or a download, and nothing is sniffed or allowed to run.
+RAW_INLINE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp"}
+RAW_TEXT_TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+RAW_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; sandbox",
+}
 
 @csrf_exempt
 def push_objects(request: HttpRequest, repo_name: str) -> JsonResponse:
     if request.method == 'POST':
-        data = json.loads(request.body)
-        repo, _ = Repository.objects.get_or_create(name=repo_name)
-        for obj in data.get('objects', []):
-            if not GitObject.objects.filter(repo=repo, sha1=obj['sha1']).exists():
-                GitObject.objects.create(
-                    repo=repo, 
-                    sha1=obj['sha1'], 
-                    type=obj['type'], 
-                    data=bytes.fromhex(obj['data'])
-                )
-        ref_name = data.get('ref', 'refs/heads/main')
-        new_hash = data.get('head')
-        Reference.objects.update_or_create(repo=repo, name=ref_name, defaults={'commit_hash': new_hash})
+        if request.content_type != STREAM_CONTENT_TYPE:
+            return JsonResponse({"error": f"expected {STREAM_CONTENT_TYPE}"}, status=415)
+        ref_name = request.GET.get('ref', 'refs/heads/main')
+        new_hash = request.GET.get('head')
+        # Without a head this is one batch of a larger push: its objects are
+        # committed on their own so an interrupted push can resume, and the
+        # graph and ref are only updated by the final request. A malformed
+        # stream rolls the batch back and is rejected with a 400, which the
+        # client does not retry.
+        try:
+            reader = StreamReader(request.read)
+            with transaction.atomic():
+                repo, _ = Repository.objects.get_or_create(name=repo_name)
+                created = ingest_objects(repo, reader.objects())
+                index_blobs(repo, [obj.sha1 for obj in created if obj.type == 'blob'])
+                if not new_hash:
+                    return JsonResponse({"status": "stored", "objects": len(created)})
+                if not GitObject.objects.filter(repo=repo, sha1=new_hash).exists():
+                    return JsonResponse({"error": f"missing head object {new_hash}"}, status=409)
+                update_commit_graph(repo, [obj.sha1 for obj in created if obj.type == 'commit'] + [new_hash])
+                Reference.objects.update_or_create(repo=repo, name=ref_name, defaults={'commit_hash': new_hash})
+                update_ref_bitmaps(repo)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
         return JsonResponse({"status": "pushed"})
     return JsonResponse({'status': "online"})
 
 
+def list_refs(request: HttpRequest, repo_name: str) -> JsonResponse:
+    repo = get_object_or_404(Repository, name=repo_name)
+    refs = dict(Reference.objects.filter(repo=repo).values_list('name', 'commit_hash'))
+    objects = GitObject.objects.filter(repo=repo).count()
+    return JsonResponse({"refs": refs, "objects": objects})
+
+
+def _requested_shas(request):
+    """Return the ``shas`` list of a JSON request body, or ``None`` if the body is malformed."""
+    try:
+        shas = json.loads(request.body).get('shas', [])
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(shas, list) or not all(isinstance(sha1, str) for sha1 in shas):
+        return None
+    return shas[:HAVE_BATCH_LIMIT]
+
+
+@csrf_exempt
+def have_objects(request: HttpRequest, repo_name: str) -> JsonResponse:
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST required"}, status=405)
+    shas = _requested_shas(request)
+    if shas is None:
+        return JsonResponse({"error": "expected a JSON body with a list of shas"}, status=400)
+    have = list(
+        GitObject.objects.filter(repo__name=repo_name, sha1__in=shas)
+        .values_list('sha1', flat=True)
+    )
+    return JsonResponse({"have": have})
+
+
+@csrf_exempt
+def fetch_objects(request: HttpRequest, repo_name: str) -> HttpResponse:
+    """Stream the requested objects; used by partial clones to fill in blobs."""
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST required"}, status=405)
+    repo = get_object_or_404(Repository, name=repo_name)
+    shas = _requested_shas(request)
+    if shas is None:
+        return JsonResponse({"error": "expected a JSON body with a list of shas"}, status=400)
+    store = get_object_store()
+    present = (
+        GitObject.objects.filter(repo=repo, sha1__in=shas)
+        .values_list('sha1', flat=True)
+    )
+    objects = ((sha1, *store.open(sha1)) for sha1 in present)
+    return StreamingHttpResponse(encode_objects(objects), content_type=STREAM_CONTENT_TYPE)
+
+
+def search(request: HttpRequest, repo_name: str) -> JsonResponse:
+    """Search the files at a ref tip: ``?q=`` is a literal unless ``regex=1``."""
+    repo = get_object_or_404(Repository, name=repo_name)
+    ref = get_object_or_404(Reference, repo=repo, name=request.GET.get('ref', 'refs/heads/main'))
+    flags = re.IGNORECASE if request.GET.get('i') == '1' else 0
+    query = request.GET.get('q', '')
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_RESULTS)), SEARCH_RESULTS)
+        rx = re.compile(query if request.GET.get('regex') == '1' else re.escape(query), flags)
+        results, truncated = search_tree(repo, get_commit(repo, ref.commit_hash)["tree"], rx, limit)
+    except (re.error, ValueError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({
+        "ref": ref.name,
+        "commit": ref.commit_hash,
+        "results": results,
+        "truncated": truncated,
+    })
+
+
+def cache_stats(request: HttpRequest) -> JsonResponse:
+    return JsonResponse(object_cache.stats())
+
+
 def repo_list(request: HttpRequest) -> HttpResponse:
     repos = Repository.objects.all()
     return render(request, "pygit/repo_list.html", {"repos": repos})
@@ -35,14 +148,8 @@ def repo_overview(request: HttpRequest, name: str) -> HttpResponse:
     repo = get_object_or_404(Repository, name=name)
     ref = get_object_or_404(Reference, repo=repo, name="refs/heads/main")
     head_sha = ref.commit_hash
-    commit_obj = get_object_or_404(GitObject, repo=repo, sha1=head_sha)
-    _, commit_body = load_object(commit_obj)
-    commit = parse_commit(commit_body)
-
-    tree_sha = commit["tree"]
-    tree_obj = get_object_or_404(GitObject, repo=repo, sha1=tree_sha)
-    _, tree_body = load_object(tree_obj)
-    entries = parse_tree(tree_body)
+    commit = get_commit(repo, head_sha)
+    entries = get_tree(repo, commit["tree"])
     context = {
         "repo": repo,
         "head_sha": head_sha,
@@ -51,38 +158,22 @@ def repo_overview(request: HttpRequest, name: str) -> HttpResponse:
     }
     return render(request, "pygit/repo_overview.html", context)
 
-def _resolve_tree_sha(repo, commit_sha, rel_path):
-    commit_obj = get_object_or_404(GitObject, repo=repo, sha1=commit_sha)
-    _, commit_body = load_object(commit_obj)
-    commit = parse_commit(commit_body)
-
-    current_tree_sha = commit["tree"]
-    if not rel_path:
-        return current_tree_sha, commit
-
-    parts = [p for p in rel_path.strip("/").split("/") if p]
-    for part in parts:
-        tree_obj = get_object_or_404(GitObject, repo=repo, sha1=current_tree_sha)
-        _, tree_body = load_object(tree_obj)
-        entries = parse_tree(tree_body)
-        match = next(
-            (e for e in entries if e["name"] == part and e["type"] == "tree"),
-            None,
-        )
-        if not match:
-            raise Http404(f"Directory '{rel_path}' not found")
-        current_tree_sha = match["sha"]
-
-    return current_tree_sha, commit
+def _resolve_path(repo, commit_sha, rel_path, kind):
+    commit = get_commit(repo, commit_sha)
+    # Browsing keeps hitting the same few root trees, so their memoized path
+    # index answers every later request for that commit with one lookup.
+    paths = get_path_index(repo, commit["tree"])
+    entry = paths.get("/".join(filter(None, rel_path.split("/"))))
+    if not entry or entry[0] != kind:
+        raise Http404(f"'{rel_path}' not found")
+    return entry[1], commit
 
 
 def tree_view(request, name, commit_sha, path=""):
     repo = get_object_or_404(Repository, name=name)
-    tree_sha, commit = _resolve_tree_sha(repo, commit_sha, path)
-
-    tree_obj = get_object_or_404(GitObject, repo=repo, sha1=tree_sha)
-    _, tree_body = load_object(tree_obj)
-    entries = parse_tree(tree_body)
+    tree_sha, commit = _resolve_path(repo, commit_sha, path, "tree")
+    entries = get_tree(repo, tree_sha)
+    last = last_commits(repo, commit_sha, path)
 
     return render(
         request,
@@ -92,28 +183,24 @@ def tree_view(request, name, commit_sha, path=""):
             "commit": commit,
             "commit_sha": commit_sha,
             "path": path,
-            "entries": entries,
+            "entries": [(e, last.get(e.name)) for e in entries],
         },
     )
 
 def blob_view(request, name, commit_sha, path):
     repo = get_object_or_404(Repository, name=name)
-    parent_path, _, leaf = path.rstrip("/").rpartition("/")
-    tree_sha, commit = _resolve_tree_sha(repo, commit_sha, parent_path)
-
-    tree_obj = get_object_or_404(GitObject, repo=repo, sha1=tree_sha)
-    _, tree_body = load_object(tree_obj)
-    entries = parse_tree(tree_body)
-    file_entry = next(
-        (e for e in entries if e["name"] == leaf and e["type"] == "blob"),
-        None,
-    )
-    if not file_entry:
-        raise Http404("File not found")
+    blob_sha, commit = _resolve_path(repo, commit_sha, path, "blob")
+    blob_obj = get_object_or_404(GitObject, repo=repo, sha1=blob_sha)
 
-    blob_obj = get_object_or_404(GitObject, repo=repo, sha1=file_entry["sha"])
-    _, body = load_object(blob_obj)
-    content = body.decode(errors="replace")
+    size, chunks = open_blob(blob_obj.sha1)
+    preview = b''
+    for chunk in chunks:
+        preview += chunk
+        if len(preview) >= BLOB_PREVIEW_BYTES:
+            break
+    chunks.close()
+    is_binary = b'\0' in preview[:8000]
+    content = "" if is_binary else preview[:BLOB_PREVIEW_BYTES].decode(errors="replace")
 
     return render(
         request,
@@ -124,58 +211,261 @@ def blob_view(request, name, commit_sha, path):
             "commit_sha": commit_sha,
             "path": path,
             "content": content,
+            "size": size,
+            "is_binary": is_binary,
+            "truncated": not is_binary and size > BLOB_PREVIEW_BYTES,
+        },
+    )
+
+
+def _parse_range(header, size):
+    """Return ``(start, end)`` for a single ``bytes=`` range, or None to send everything."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start > end:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+def _slice_chunks(chunks, start, length):
+    for chunk in chunks:
+        if start >= len(chunk):
+            start -= len(chunk)
+            continue
+        piece = chunk[start:start + length]
+        start = 0
+        length -= len(piece)
+        yield piece
+        if not length:
+            break
+    chunks.close()
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match", "")
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+
+def _raw_content_type(path):
+    guessed = mimetypes.guess_type(path)[0]
+    if guessed in RAW_INLINE_TYPES:
+        return guessed
+    if guessed is None or guessed.startswith("text/") or guessed in RAW_TEXT_TYPES:
+        return "text/plain; charset=utf-8"
+    return "application/octet-stream"
+
+
+def raw_blob(request, name, commit_sha, path):
+    repo = get_object_or_404(Repository, name=name)
+    blob_sha, _ = _resolve_path(repo, commit_sha, path, "blob")
+    blob_obj = get_object_or_404(GitObject, repo=repo, sha1=blob_sha)
+    etag = f'"{blob_obj.sha1}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Blobs are immutable by SHA, so any cached copy stays valid.
+        "Cache-Control": "public, max-age=31536000, immutable",
+        **RAW_SECURITY_HEADERS,
+    }
+
+    if _etag_matches(request, etag):
+        return HttpResponse(status=304, headers=headers)
+
+    size, chunks = open_blob(blob_obj.sha1)
+    content_type = _raw_content_type(path)
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    byte_range = None
+    if range_header and (not if_range or if_range == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            chunks.close()
+            headers["Content-Range"] = f"bytes */{size}"
+            return HttpResponse(status=416, headers=headers)
+
+    if byte_range is None:
+        response = StreamingHttpResponse(chunks, content_type=content_type, headers=headers)
+        response["Content-Length"] = size
+        return response
+    start, end = byte_range
+    chunks.close()
+    _, chunks = open_blob(blob_obj.sha1, start)
+    response = StreamingHttpResponse(
+        _slice_chunks(chunks, 0, end - start + 1),
+        status=206,
+        content_type=content_type,
+        headers=headers,
+    )
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = end - start + 1
+    return response
+
+
+def blame_view(request, name, commit_sha, path):
+    repo = get_object_or_404(Repository, name=name)
+    _resolve_path(repo, commit_sha, path, "blob")
+    lines = blame(repo, commit_sha, path)
+    rows = []
+    for number, (origin, text) in enumerate(lines or (), 1):
+        # Only the first line of each run from the same commit shows it.
+        first = number == 1 or origin["sha"] != lines[number - 2][0]["sha"]
+        rows.append({"number": number, "commit": origin if first else None, "text": text})
+    return render(
+        request,
+        "pygit/blame.html",
+        {
+            "repo": repo,
+            "commit_sha": commit_sha,
+            "path": path,
+            "rows": rows,
+            "available": lines is not None,
         },
     )
 
 
+def archive_view(request, name, rev):
+    """Download a commit's snapshot; ``rev`` is a branch name or a commit SHA."""
+    repo = get_object_or_404(Repository, name=name)
+    fmt = request.GET.get("format", "tar.gz")
+    if fmt not in ARCHIVE_CONTENT_TYPES:
+        return JsonResponse({"error": f"format must be one of {', '.join(ARCHIVE_CONTENT_TYPES)}"}, status=400)
+    ref = Reference.objects.filter(repo=repo, name=f"refs/heads/{rev}").first()
+    commit_sha = ref.commit_hash if ref else rev
+    tree_sha = get_commit(repo, commit_sha)["tree"]
+    # The archive depends only on the tree; a branch can move, so clients
+    # revalidate those, while a commit SHA always names the same archive.
+    etag = f'"{tree_sha}.{fmt}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache" if ref else "public, max-age=31536000, immutable",
+    }
+    if _etag_matches(request, etag):
+        return HttpResponse(status=304, headers=headers)
+
+    filename = f"{repo.name}-{commit_sha[:12]}.{fmt}"
+    cached = cached_archive_path(tree_sha, fmt)
+    if cached and os.path.exists(cached):
+        return FileResponse(
+            open(cached, "rb"),
+            as_attachment=True,
+            filename=filename,
+            content_type=ARCHIVE_CONTENT_TYPES[fmt],
+            headers=headers,
+        )
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingHttpResponse(
+        stream_archive(repo, tree_sha, fmt),
+        content_type=ARCHIVE_CONTENT_TYPES[fmt],
+        headers=headers,
+    )
+
+
 def commit_list(request, name):
     repo = get_object_or_404(Repository, name=name)
     ref = get_object_or_404(Reference, repo=repo, name="refs/heads/main")
-    sha = ref.commit_hash
-    commits = []
-    seen = set()
-    while sha and sha not in seen:
-        seen.add(sha)
-        obj = get_object_or_404(GitObject, repo=repo, sha1=sha)
-        _, body = load_object(obj)
-        info = parse_commit(body)
-        info["sha"] = sha
-        commits.append(info)
-        parents = info.get("parents", [])
-        sha = parents[0] if parents else None
-
-    return render(request, "pygit/commits.html", {"repo": repo, "commits": commits})
+    # Repositories pushed before the graph existed are backfilled once.
+    update_commit_graph(repo, [ref.commit_hash])
+    start = request.GET.get("from") or ref.commit_hash
+    history = first_parent_history(repo, start, COMMITS_PER_PAGE + 1)
+    commits = [
+        {
+            "sha": entry.sha1,
+            "message": entry.summary,
+            "author": entry.author,
+            "date": datetime.fromtimestamp(entry.timestamp, tz=timezone.utc),
+        }
+        for entry in history[:COMMITS_PER_PAGE]
+    ]
+    next_sha = history[COMMITS_PER_PAGE].sha1 if len(history) > COMMITS_PER_PAGE else None
+
+    return render(
+        request,
+        "pygit/commits.html",
+        {"repo": repo, "commits": commits, "next_sha": next_sha},
+    )
 
 
 def commit_detail(request, name, commit_sha):
     repo = get_object_or_404(Repository, name=name)
-    obj = get_object_or_404(GitObject, repo=repo, sha1=commit_sha)
-    _, body = load_object(obj)
-    commit = parse_commit(body)
+    commit = get_commit(repo, commit_sha)
     commit["sha"] = commit_sha
-    return render(request, "pygit/commit_detail.html", {"repo": repo, "commit": commit})
+    parents = commit.get("parents", [])
+    parent_tree = get_commit(repo, parents[0])["tree"] if parents else None
+    changes, truncated = commit_changes(repo, parent_tree, commit["tree"])
+    return render(
+        request,
+        "pygit/commit_detail.html",
+        {"repo": repo, "commit": commit, "changes": changes, "truncated": truncated},
+    )
 
 
-def clone_repo(request: HttpRequest, repo_name: str) -> JsonResponse:
+def clone_repo(request: HttpRequest, repo_name: str) -> StreamingHttpResponse:
     repo = get_object_or_404(Repository, name=repo_name)
     try:
         ref = Reference.objects.get(repo=repo, name="refs/heads/main")
         head_sha = ref.commit_hash
     except Reference.DoesNotExist:
         head_sha = None
-    objects_qs = GitObject.objects.filter(repo=repo)
-    objects_data = []
-    
-    for obj in objects_qs:
-        objects_data.append({
-            "sha1": obj.sha1,
-            "type": obj.type,
-            "data": obj.data.hex() 
-        })
-    
-    return JsonResponse({
-        "status": "success",
-        "repo": repo.name,
-        "head": head_sha,
-        "objects": objects_data
-    })
\ No newline at end of file
+    store = get_object_store()
+    # Objects go out in SHA order so a client can fetch disjoint ``prefix``
+    # ranges in parallel and resume each one ``after`` the last SHA it got.
+    # "g" sorts after every hex digit, which turns the prefix into a range
+    # the (repo, sha1) index can serve.
+    prefix = request.GET.get('prefix', '')
+    after = request.GET.get('after', '')
+    depth = request.GET.get('depth')
+    blob_filter = request.GET.get('filter')
+    if depth or blob_filter:
+        # Shallow and blobless clones send only what is reachable from the
+        # requested head (pinned by the client so resumed requests agree).
+        tip = request.GET.get('head') or head_sha
+        if not tip or not GitObject.objects.filter(repo=repo, sha1=tip, type='commit').exists():
+            raise Http404("Unknown head")
+        reachable, _ = reachable_objects(
+            repo, [tip],
+            depth=int(depth) if depth else None,
+            blobs=blob_filter != 'blob:none',
+        )
+        shas = sorted(
+            sha1 for sha1 in reachable
+            if sha1 > after and prefix <= sha1 < prefix + "g"
+        )
+    else:
+        # Everything reachable from the requested refs (all of them by
+        # default), read off the per-tip bitmaps; objects left behind by
+        # overwritten pushes are skipped without being opened.
+        refs = Reference.objects.filter(repo=repo)
+        if request.GET.get('refs'):
+            refs = refs.filter(name__in=request.GET['refs'].split(','))
+        bitmap = refs_bitmap(repo, set(refs.values_list('commit_hash', flat=True)))
+        rows = GitObject.objects.filter(repo=repo)
+        if prefix:
+            rows = rows.filter(sha1__gte=prefix, sha1__lt=prefix + "g")
+        if after:
+            rows = rows.filter(sha1__gt=after)
+        shas = (
+            sha1 for pk, sha1 in rows.order_by('sha1')
+            .values_list('pk', 'sha1')
+            .iterator(chunk_size=CLONE_BATCH)
+            if pk in bitmap
+        )
+    objects = ((sha1, *store.open(sha1)) for sha1 in shas)
+    compress = request.GET.get('compress', '1') != '0'
+
+    response = StreamingHttpResponse(
+        encode_objects(objects, compress=compress),
+        content_type=STREAM_CONTENT_TYPE,
+    )
+    response["X-PyGit-Head"] = head_sha or ""
+    return response